@@ -1,2 +1,46 @@
 # following PEP 386
 __version__ = "4.4"
+
+
+def preload():
+    """
+    Loads what the first request to render a ``{% compress %}`` block would
+    otherwise load: the offline manifest, the templates of the output tags
+    and the parser, filter and precompiler classes.
+
+    Call it in the process that forks the workers of the application server,
+    once Django is set up, so the workers start warm and share these pages.
+    """
+    from importlib import import_module
+
+    from django.template.loader import get_template
+
+    from compressor.cache import get_offline_manifest
+    from compressor.conf import settings
+    from compressor.exceptions import FilterDoesNotExist
+    from compressor.filters.base import is_reusable
+    from compressor.utils import get_class, get_mod_func
+
+    if settings.COMPRESS_ENABLED and settings.COMPRESS_OFFLINE:
+        get_offline_manifest()
+
+    get_class(settings.COMPRESS_PARSER)
+    for kind, compressor in settings.COMPRESSORS.items():
+        compressor = get_class(compressor)(kind)
+        for mode in ("file", "inline", "preload"):
+            get_template(compressor.get_template_name(mode))
+        for filter_cls in compressor.filters:
+            filter_cls = get_class(filter_cls)
+            if is_reusable(filter_cls):
+                # Instantiating them imports the modules they call, e.g. the
+                # minifiers of CallbackOutputFilter subclasses.
+                filter_cls(None, filter_type=kind)
+
+    for mimetype, filter_or_command in settings.COMPRESS_PRECOMPILERS:
+        mod_name, cls_name = get_mod_func(filter_or_command)
+        try:
+            import_module(mod_name)
+        except (ImportError, TypeError):
+            # A command, run by CompilerFilter.
+            continue
+        get_class(filter_or_command, exception=FilterDoesNotExist)
@@ -1,21 +1,36 @@
 import os
 import codecs
+import hashlib
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from importlib import import_module
 from urllib.request import url2pathname
 
-from django.core.files.base import ContentFile
+from django.core.files.base import ContentFile, File
 from django.utils.safestring import mark_safe
 from django.template.loader import render_to_string
 from django.utils.functional import cached_property
 
-from compressor.cache import get_hexdigest, get_mtime
+from compressor.cache import (
+    get_hexdigest,
+    get_indexed_filename,
+    get_indexed_filenames,
+    get_mtimes,
+    is_registered_output,
+    output_registry_enabled,
+    register_output,
+    set_indexed_filename,
+)
 from compressor.conf import settings
 from compressor.exceptions import (
     CompressorError,
     UncompressableFileError,
     FilterDoesNotExist,
 )
-from compressor.filters import CachedCompilerFilter
+from compressor.filters import CachedCompilerFilter, FilterBase
+from compressor.filters.base import is_reusable
 from compressor.storage import compressor_file_storage
 from compressor.signals import post_compress
 from compressor.utils import get_class, get_mod_func, staticfiles
@@ -24,6 +39,28 @@ from compressor.utils import get_class, get_mod_func, staticfiles
 SOURCE_HUNK, SOURCE_FILE = "inline", "file"
 METHOD_INPUT, METHOD_OUTPUT = "input", "output"
 
+_hunk_executor = None
+_hunk_executor_lock = threading.Lock()
+
+
+def get_hunk_executor(max_workers):
+    """
+    Returns the thread pool shared by all compressors to process hunks
+    concurrently, see COMPRESS_HUNK_WORKERS.
+    """
+    global _hunk_executor
+    with _hunk_executor_lock:
+        # Threads don't survive a fork, never reuse a parent's pool.
+        key = (max_workers, os.getpid())
+        if _hunk_executor is None or _hunk_executor[0] != key:
+            if _hunk_executor is not None and _hunk_executor[0][1] == os.getpid():
+                _hunk_executor[1].shutdown(wait=False)
+            executor = ThreadPoolExecutor(
+                max_workers=max_workers, thread_name_prefix="compressor"
+            )
+            _hunk_executor = (key, executor)
+        return _hunk_executor[1]
+
 
 class Compressor:
     """
@@ -63,6 +100,8 @@ class Compressor:
         self.precompiler_mimetypes = dict(settings.COMPRESS_PRECOMPILERS)
         self.finders = staticfiles.finders
         self._storage = None
+        self._filter_instances = {}
+        self._indexed_filenames = {}
         self.log = log
         self.verbosity = verbosity
 
@@ -139,11 +178,18 @@ class Compressor:
 
         get_filepath(content, "my_file.css") -> 'CACHE/css/my_file.58a8c0714e59.css'
         """
+        return self.get_digest_filepath(get_hexdigest(content), basename)
+
+    def get_digest_filepath(self, hexdigest, basename=None):
+        """
+        Returns file path for an output file based on the SHA-256 hex digest
+        of its contents, see ``get_filepath``.
+        """
         parts = []
         if basename:
             filename = os.path.split(basename)[1]
             parts.append(os.path.splitext(filename)[0])
-        parts.extend([get_hexdigest(content, 12), self.resource_kind])
+        parts.extend([hexdigest[:12], self.resource_kind])
         return os.path.join(self.output_dir, self.output_prefix, ".".join(parts))
 
     def get_filename(self, basename):
@@ -151,6 +197,41 @@ class Compressor:
         Returns full path to a file, for example:
 
         get_filename('css/one.css') -> '/full/path/to/static/css/one.css'
+
+        If ``COMPRESS_FILENAME_INDEX`` is enabled, previously resolved paths
+        are looked up in the cache before searching the storage and finders.
+        """
+        if not settings.COMPRESS_FILENAME_INDEX:
+            return self.find_filename(basename)
+        if basename in self._indexed_filenames:
+            filename = self._indexed_filenames.pop(basename)
+        else:
+            filename = get_indexed_filename(basename)
+        if filename is None:
+            filename = self.find_filename(basename)
+            set_indexed_filename(basename, filename)
+        return filename
+
+    def prefetch_filenames(self, urls):
+        """
+        Looks up the files of the given URLs in the filename index at once,
+        so that ``get_filename`` doesn't make a request for each of them.
+        """
+        if not settings.COMPRESS_FILENAME_INDEX:
+            return
+        basenames = []
+        for url in urls:
+            try:
+                basenames.append(self.get_basename(url))
+            except UncompressableFileError:
+                # Raised again by split_contents.
+                continue
+        self._indexed_filenames = get_indexed_filenames(basenames)
+
+    def find_filename(self, basename):
+        """
+        Searches the storage and the staticfiles finders for the full path
+        to a file.
         """
         filename = None
         # First try finding the file using the storage class.
@@ -227,13 +308,86 @@ class Compressor:
         return [get_class(filter_cls) for filter_cls in self.filters]
 
     @cached_property
-    def mtimes(self):
+    def linked_files(self):
+        """
+        The ``(filename, basename, charset)`` of the linked files.
+        """
         return [
-            str(get_mtime(value))
+            (
+                value,
+                basename,
+                self.parser.elem_attribs(elem).get("charset", self.charset),
+            )
             for kind, value, basename, elem in self.split_contents()
             if kind == SOURCE_FILE
         ]
 
+    @cached_property
+    def filenames(self):
+        return [filename for filename, basename, charset in self.linked_files]
+
+    @cached_property
+    def file_mtimes(self):
+        """
+        The modification times of the linked files by path, and of the files
+        the filters looked up for ``referenced_filenames``.
+        """
+        return get_mtimes(self.filenames)
+
+    def get_filter_files(self, method):
+        """
+        Returns the files the ``method`` of the filters returns for the
+        linked files, see ``FilterBase.get_referenced_files``.
+        """
+        default = getattr(FilterBase, method)
+        filters = [
+            filter_cls
+            for filter_cls in self.cached_filters
+            if getattr(filter_cls, method, default) is not default
+        ]
+        if not filters:
+            return []
+        filenames = []
+        # The linked files may have been reused from a previous render, see
+        # CompressorNode.render_cached, so the content isn't parsed again.
+        for filename, basename, charset in self.linked_files:
+            for filter_cls in filters:
+                if is_reusable(filter_cls):
+                    filter = self.get_filter_instance(filter_cls)
+                else:
+                    filter = filter_cls(None, filter_type=self.resource_kind)
+                for referenced in getattr(filter, method)(
+                    filename, basename, charset, self.file_mtimes
+                ):
+                    if referenced not in filenames:
+                        filenames.append(referenced)
+        return filenames
+
+    @cached_property
+    def referenced_filenames(self):
+        """
+        The files the filters read besides the linked files, see
+        ``FilterBase.get_referenced_files``.
+        """
+        return self.get_filter_files("get_referenced_files")
+
+    @cached_property
+    def asset_filenames(self):
+        """
+        The files the linked files refer to that may change the output, see
+        ``FilterBase.get_asset_files``.
+        """
+        return self.get_filter_files("get_asset_files")
+
+    @cached_property
+    def mtimes(self):
+        mtimes = self.file_mtimes
+        filenames = self.filenames + self.referenced_filenames
+        missing = [filename for filename in filenames if filename not in mtimes]
+        if missing:
+            mtimes.update(get_mtimes(missing))
+        return [str(mtimes[value]) for value in filenames]
+
     @cached_property
     def cachekey(self):
         return get_hexdigest(
@@ -248,35 +402,52 @@ class Compressor:
         bunch of precompiled and/or rendered hunks.
         """
         enabled = settings.COMPRESS_ENABLED or forced
+        split_contents = self.split_contents()
+        workers = settings.COMPRESS_HUNK_WORKERS
+
+        if workers > 1 and len(split_contents) > 1:
+            # Precompile and filter the hunks concurrently, ``map`` yields
+            # the results in the original order.
+            executor = get_hunk_executor(workers)
+            yield from executor.map(
+                lambda split: self.process_hunk(*split, enabled=enabled),
+                split_contents,
+            )
+        else:
+            for kind, value, basename, elem in split_contents:
+                yield self.process_hunk(kind, value, basename, elem, enabled)
 
-        for kind, value, basename, elem in self.split_contents():
-            precompiled = False
-            attribs = self.parser.elem_attribs(elem)
-            charset = attribs.get("charset", self.charset)
-            options = {
-                "method": METHOD_INPUT,
-                "elem": elem,
-                "kind": kind,
-                "basename": basename,
-                "charset": charset,
-            }
-
-            if kind == SOURCE_FILE:
-                options = dict(options, filename=value)
-                value = self.get_filecontent(value, charset)
-
-            if self.precompiler_mimetypes:
-                precompiled, value = self.precompile(value, **options)
-
-            if enabled:
-                yield self.filter(value, self.cached_filters, **options)
-            elif precompiled:
-                for filter_cls in self.cached_filters:
-                    if filter_cls.run_with_compression_disabled:
-                        value = self.filter(value, [filter_cls], **options)
-                yield self.handle_output(kind, value, forced=True, basename=basename)
-            else:
-                yield self.parser.elem_str(elem)
+    def process_hunk(self, kind, value, basename, elem, enabled):
+        """
+        Reads, precompiles and filters a single file or code hunk.
+        """
+        precompiled = False
+        attribs = self.parser.elem_attribs(elem)
+        charset = attribs.get("charset", self.charset)
+        options = {
+            "method": METHOD_INPUT,
+            "elem": elem,
+            "kind": kind,
+            "basename": basename,
+            "charset": charset,
+        }
+
+        if kind == SOURCE_FILE:
+            options = dict(options, filename=value)
+            value = self.get_filecontent(value, charset)
+
+        if self.precompiler_mimetypes:
+            precompiled, value = self.precompile(value, **options)
+
+        if enabled:
+            return self.filter(value, self.cached_filters, **options)
+        elif precompiled:
+            for filter_cls in self.cached_filters:
+                if filter_cls.run_with_compression_disabled:
+                    value = self.filter(value, [filter_cls], **options)
+            return self.handle_output(kind, value, forced=True, basename=basename)
+        else:
+            return self.parser.elem_str(elem)
 
     def filter_output(self, content):
         """
@@ -290,10 +461,14 @@ class Compressor:
         Passes each hunk (file or code) to the 'input' methods
         of the compressor filters.
         """
-        content = []
-        for hunk in self.hunks(forced):
-            content.append(hunk)
-        return content
+        return list(self.iter_input(forced))
+
+    def iter_input(self, forced=False):
+        """
+        Yields the hunks passed to the 'input' methods of the compressor
+        filters one by one.
+        """
+        return self.hunks(forced)
 
     def precompile(
         self, content, kind=None, elem=None, filename=None, charset=None, **kwargs
@@ -346,11 +521,28 @@ class Compressor:
         )
         return True, filter.input(**kwargs)
 
+    def get_filter_instance(self, filter_cls):
+        """
+        Returns the instance of a reusable filter class shared by all
+        contents filtered by this compressor.
+        """
+        try:
+            return self._filter_instances[filter_cls]
+        except KeyError:
+            instance = filter_cls(None, filter_type=self.resource_kind)
+            self._filter_instances[filter_cls] = instance
+            return instance
+
     def filter(self, content, filters, method, **kwargs):
         for filter_cls in filters:
-            filter_func = getattr(
-                filter_cls(content, filter_type=self.resource_kind), method
-            )
+            if is_reusable(filter_cls):
+                filter_func = partial(
+                    self.get_filter_instance(filter_cls).apply, content, method
+                )
+            else:
+                filter_func = getattr(
+                    filter_cls(content, filter_type=self.resource_kind), method
+                )
             try:
                 if callable(filter_func):
                     content = filter_func(**kwargs)
@@ -364,6 +556,9 @@ class Compressor:
         any custom modification. Calls other mode specific methods or simply
         returns the content directly.
         """
+        if self.can_stream_output(mode, forced):
+            return self.output_stream(mode, forced, basename)
+
         output = "\n".join(self.filter_input(forced))
 
         if not output:
@@ -383,14 +578,92 @@ class Compressor:
         # Total failure, raise a general exception
         raise CompressorError("Couldn't find output method for mode '%s'" % mode)
 
+    def output_exists(self, filepath):
+        """
+        Returns whether the output file ``filepath`` is in the storage,
+        consulting the registry of saved output files first, see
+        COMPRESS_OUTPUT_REGISTRY_SIZE.
+        """
+        if not output_registry_enabled():
+            return self.storage.exists(filepath)
+        if is_registered_output(filepath):
+            return True
+        if settings.COMPRESS_OUTPUT_REGISTRY_TRUSTED:
+            return False
+        exists = self.storage.exists(filepath)
+        if exists:
+            register_output(filepath)
+        return exists
+
     def output_file(self, mode, content, forced=False, basename=None):
         """
         The output method that saves the content to a file and renders
         the appropriate template with the file's URL.
         """
         new_filepath = self.get_filepath(content, basename=basename)
-        if not self.storage.exists(new_filepath) or forced:
+        if not self.output_exists(new_filepath) or forced:
             self.storage.save(new_filepath, ContentFile(content.encode(self.charset)))
+            register_output(new_filepath)
+        url = mark_safe(self.storage.url(new_filepath))
+        return self.render_output(mode, {"url": url})
+
+    def can_stream_output(self, mode, forced=False):
+        """
+        Whether the output can be written to the storage hunk by hunk
+        instead of being concatenated in memory, see COMPRESS_STREAM_OUTPUT.
+        That's only the case for files whose filters either don't have an
+        'output' method or can apply it to each hunk on its own.
+        """
+        if not settings.COMPRESS_STREAM_OUTPUT:
+            return False
+        if not (settings.COMPRESS_ENABLED or forced):
+            return False
+        if mode not in ("file", "preload"):
+            return False
+        # Subclasses that change how the output is built need all of it.
+        cls, output_method = type(self), "output_%s" % mode
+        if (
+            getattr(cls, output_method) is not getattr(Compressor, output_method)
+            or cls.filter_input is not Compressor.filter_input
+            or cls.filter_output is not Compressor.filter_output
+        ):
+            return False
+        return all(
+            getattr(filter_cls, "streamable", False)
+            or getattr(filter_cls, METHOD_OUTPUT, FilterBase.output)
+            is FilterBase.output
+            for filter_cls in self.cached_filters
+        )
+
+    def output_stream(self, mode, forced=False, basename=None):
+        """
+        The output method that filters the hunks one by one, writes them to
+        a temporary file while hashing them and saves it to the storage, so
+        that only one hunk at a time is kept in memory.
+        """
+        hexdigest = hashlib.sha256()
+        # The file name is based on the UTF-8 encoded content, like in
+        # ``get_filepath``.
+        is_utf8 = codecs.lookup(self.charset).name == "utf-8"
+        with tempfile.TemporaryFile() as file:
+            empty = True
+            for i, hunk in enumerate(self.iter_input(forced)):
+                hunk = self.filter_output(hunk)
+                if i:
+                    hunk = "\n" + hunk
+                if not hunk:
+                    continue
+                empty = False
+                data = hunk.encode("utf-8")
+                hexdigest.update(data)
+                file.write(data if is_utf8 else hunk.encode(self.charset))
+            if empty:
+                return ""
+            new_filepath = self.get_digest_filepath(hexdigest.hexdigest(), basename)
+            if not self.output_exists(new_filepath) or forced:
+                file.seek(0)
+                self.storage.save(new_filepath, File(file))
+                register_output(new_filepath)
         url = mark_safe(self.storage.url(new_filepath))
         return self.render_output(mode, {"url": url})
 
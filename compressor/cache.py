@@ -2,17 +2,21 @@ import json
 import hashlib
 import os
 import socket
+import tempfile
+import threading
 import time
+from collections import OrderedDict
 from importlib import import_module
 
 from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
 from django.core.files.base import ContentFile
 from django.utils.encoding import force_str, smart_bytes
 from django.utils.functional import SimpleLazyObject
 
 from compressor.conf import settings
 from compressor.storage import default_offline_manifest_storage
-from compressor.utils import get_mod_func
+from compressor.utils import get_class, get_mod_func
 
 _cachekey_func = None
 
@@ -68,19 +72,106 @@ def get_offline_cachekey(source):
     return get_cachekey("offline.%s" % get_offline_hexdigest(source))
 
 
+# the loaded offline manifest as (manifest, outputs, modified time), where
+# outputs are its entries by (placeholder, COMPRESS_URL) and key
 _offline_manifest = None
+# when the manifest was last checked for changes
+_offline_manifest_checked = 0
+_offline_manifest_lock = threading.Lock()
+
+
+def get_offline_manifest_backend():
+    return get_class(
+        settings.COMPRESS_OFFLINE_MANIFEST_BACKEND, exception=ImproperlyConfigured
+    )()
+
+
+def get_offline_manifest_modified_time():
+    try:
+        return default_offline_manifest_storage.get_modified_time(
+            settings.COMPRESS_OFFLINE_MANIFEST
+        )
+    except (NotImplementedError, OSError):
+        return None
+
+
+def load_offline_manifest():
+    filename = settings.COMPRESS_OFFLINE_MANIFEST
+    if not default_offline_manifest_storage.exists(filename):
+        return {}, {}, None
+    modified_time = get_offline_manifest_modified_time()
+    manifest = get_offline_manifest_backend().load(
+        default_offline_manifest_storage, filename
+    )
+    return manifest, {}, modified_time
+
+
+def reload_offline_manifest(loaded):
+    """
+    Returns the newer offline manifest if it changed since ``loaded`` was
+    loaded, otherwise ``loaded``. A manifest that is missing or can't be
+    read keeps the current one in use.
+    """
+    modified_time = get_offline_manifest_modified_time()
+    if modified_time is None or modified_time == loaded[2]:
+        return loaded
+    try:
+        return load_offline_manifest()
+    except (OSError, ValueError):
+        return loaded
+
+
+def get_loaded_offline_manifest():
+    global _offline_manifest, _offline_manifest_checked
+    loaded = _offline_manifest
+    if loaded is None:
+        with _offline_manifest_lock:
+            if _offline_manifest is None:
+                _offline_manifest = load_offline_manifest()
+                _offline_manifest_checked = time.monotonic()
+            return _offline_manifest
+    interval = settings.COMPRESS_OFFLINE_MANIFEST_RELOAD_INTERVAL
+    if (
+        interval is not None
+        and time.monotonic() - _offline_manifest_checked >= interval
+        # Other threads keep using the current manifest during the check.
+        and _offline_manifest_lock.acquire(blocking=False)
+    ):
+        try:
+            _offline_manifest_checked = time.monotonic()
+            if _offline_manifest is loaded:
+                _offline_manifest = loaded = reload_offline_manifest(loaded)
+        finally:
+            _offline_manifest_lock.release()
+    return loaded
 
 
 def get_offline_manifest():
-    global _offline_manifest
-    if _offline_manifest is None:
-        filename = settings.COMPRESS_OFFLINE_MANIFEST
-        if default_offline_manifest_storage.exists(filename):
-            with default_offline_manifest_storage.open(filename) as fp:
-                _offline_manifest = json.loads(fp.read().decode("utf8"))
-        else:
-            _offline_manifest = {}
-    return _offline_manifest
+    return get_loaded_offline_manifest()[0]
+
+
+def get_offline_output(key):
+    """
+    Returns the entry of the offline manifest for ``key`` with the URL
+    placeholder replaced by ``COMPRESS_URL``, or ``None`` if it's missing.
+    The replaced entries are kept as long as the manifest is.
+    """
+    # Cast ``settings.COMPRESS_URL`` to a string to allow it to be
+    # a string-alike object to e.g. add ``SCRIPT_NAME`` WSGI param
+    # as a *path prefix* to the output URL.
+    # See https://code.djangoproject.com/ticket/25598.
+    url = str(settings.COMPRESS_URL)
+    offline_manifest, outputs, _ = get_loaded_offline_manifest()
+    outputs = outputs.setdefault((settings.COMPRESS_URL_PLACEHOLDER, url), {})
+    try:
+        return outputs[key]
+    except KeyError:
+        pass
+    if key not in offline_manifest:
+        return None
+    output = offline_manifest[key].replace(settings.COMPRESS_URL_PLACEHOLDER, url)
+    outputs[key] = output
+    return output
 
 
 def flush_offline_manifest():
@@ -89,13 +180,40 @@ def flush_offline_manifest():
 
 
 def write_offline_manifest(manifest):
-    content = json.dumps(manifest, indent=2).encode("utf8")
+    content = get_offline_manifest_backend().dumps(manifest)
     default_offline_manifest_storage.save(
         settings.COMPRESS_OFFLINE_MANIFEST, ContentFile(content)
     )
     flush_offline_manifest()
 
 
+def get_offline_state_filename():
+    root, ext = os.path.splitext(settings.COMPRESS_OFFLINE_MANIFEST)
+    return "%s.state.json" % root
+
+
+def get_offline_state():
+    """
+    Returns the state of the last incremental run of the ``compress``
+    management command.
+    """
+    filename = get_offline_state_filename()
+    if not default_offline_manifest_storage.exists(filename):
+        return {}
+    with default_offline_manifest_storage.open(filename) as fp:
+        try:
+            return json.loads(fp.read().decode("utf8"))
+        except ValueError:
+            return {}
+
+
+def write_offline_state(state):
+    content = json.dumps(state, indent=2, sort_keys=True).encode("utf8")
+    default_offline_manifest_storage.save(
+        get_offline_state_filename(), ContentFile(content)
+    )
+
+
 def get_templatetag_cachekey(compressor, mode, kind):
     return get_cachekey("templatetag.%s.%s.%s" % (compressor.cachekey, mode, kind))
 
@@ -111,6 +229,101 @@ def get_mtime(filename):
     return os.path.getmtime(filename)
 
 
+def get_mtimes(filenames):
+    """
+    Returns a dictionary mapping each of the given filenames to its mtime,
+    using a single ``get_many``/``set_many`` pair for the cached values.
+    """
+    if not settings.COMPRESS_MTIME_DELAY:
+        return {filename: os.path.getmtime(filename) for filename in filenames}
+    keys = {get_mtime_cachekey(filename): filename for filename in filenames}
+    if not keys:
+        return {}
+    cached = cache.get_many(list(keys))
+    mtimes = {}
+    missing = {}
+    for key, filename in keys.items():
+        mtime = cached.get(key)
+        if mtime is None:
+            mtime = missing[key] = os.path.getmtime(filename)
+        mtimes[filename] = mtime
+    if missing:
+        cache.set_many(missing, settings.COMPRESS_MTIME_DELAY)
+    return mtimes
+
+
+def get_filename_index_cachekey(basename):
+    # Files are looked up differently in DEBUG mode, see
+    # Compressor.find_filename.
+    return get_cachekey(
+        "filename.%s.%s" % (int(settings.DEBUG), get_hexdigest(basename))
+    )
+
+
+def get_indexed_filenames(basenames):
+    """
+    Returns a dict of the full paths previously resolved for the given
+    basenames, ``None`` for those that aren't known or whose files changed
+    since they were resolved.
+
+    The entries this process didn't look up recently are fetched with a
+    single ``get_many`` call.
+    """
+    keys = {get_filename_index_cachekey(basename): basename for basename in basenames}
+    entries = {}
+    missing = []
+    for key in keys:
+        entry = filename_index.get(key)
+        if entry is None:
+            missing.append(key)
+        else:
+            entries[key] = entry
+    if missing:
+        for key, entry in cache.get_many(missing).items():
+            filename_index.set(key, entry)
+            entries[key] = entry
+    filenames = {}
+    for key, basename in keys.items():
+        entry = entries.get(key)
+        filenames[basename] = None
+        if entry is None:
+            continue
+        filename, mtime = entry
+        try:
+            if os.path.getmtime(filename) == mtime:
+                filenames[basename] = filename
+                continue
+        except OSError:
+            pass
+        filename_index.delete(key)
+    return filenames
+
+
+def get_indexed_filename(basename):
+    """
+    Returns the full path previously resolved for the given basename, or
+    ``None`` if it isn't known or the file changed since it was resolved.
+    """
+    return get_indexed_filenames([basename])[basename]
+
+
+def set_indexed_filename(basename, filename):
+    try:
+        mtime = os.path.getmtime(filename)
+    except OSError:
+        return
+    key = get_filename_index_cachekey(basename)
+    filename_index.set(key, (filename, mtime))
+    cache.set(key, (filename, mtime), settings.COMPRESS_REBUILD_TIMEOUT)
+
+
+def delete_indexed_filenames(basenames):
+    keys = [get_filename_index_cachekey(basename) for basename in basenames]
+    for key in keys:
+        filename_index.delete(key)
+    cache.delete_many(keys)
+
+
 def get_hashed_mtime(filename, length=12):
     try:
         filename = os.path.realpath(filename)
@@ -123,12 +336,22 @@ def get_hashed_mtime(filename, length=12):
 def get_hashed_content(filename, length=12):
     try:
         filename = os.path.realpath(filename)
+        stat = os.stat(filename)
     except OSError:
         return None
 
-    # should we make sure that file is utf-8 encoded?
-    with open(filename, "rb") as file:
-        return get_hexdigest(file.read(), length)
+    # The content of a file is assumed unchanged as long as its modification
+    # time and size are.
+    key = (filename, stat.st_mtime_ns, stat.st_size, length)
+    hashed = hashed_content_cache.get(key)
+    if hashed is None:
+        digest = hashlib.sha256()
+        with open(filename, "rb") as file:
+            for chunk in iter(lambda: file.read(65536), b""):
+                digest.update(chunk)
+        hashed = digest.hexdigest()[:length] if length else digest.hexdigest()
+        hashed_content_cache.set(key, hashed)
+    return hashed
 
 
 def get_precompiler_cachekey(command, contents):
@@ -137,10 +360,305 @@ def get_precompiler_cachekey(command, contents):
     ).hexdigest()
 
 
+class LocalCache:
+    """
+    A small thread-safe, process-local LRU cache with expiring entries.
+
+    The size and default timeout are read from the named settings on every
+    call, so a size of ``0`` (or ``None``) disables the cache entirely.
+    ``hits`` and ``misses`` count the lookups made while it was enabled.
+    """
+
+    def __init__(self, size_setting, timeout_setting=None):
+        self.size_setting = size_setting
+        self.timeout_setting = timeout_setting
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def maxsize(self):
+        return getattr(settings, self.size_setting) or 0
+
+    @property
+    def timeout(self):
+        if self.timeout_setting is None:
+            return None
+        return getattr(settings, self.timeout_setting)
+
+    def get(self, key, default=None):
+        if not self.maxsize:
+            return default
+        with self._lock:
+            try:
+                value, expires = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            if expires is not None and time.time() >= expires:
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, expires=None):
+        """
+        Stores ``value`` until the ``expires`` timestamp or the configured
+        timeout, whichever comes first.
+        """
+        maxsize = self.maxsize
+        if not maxsize:
+            return
+        timeout = self.timeout
+        if timeout is not None:
+            timeout_expires = time.time() + timeout
+            if expires is None or timeout_expires < expires:
+                expires = timeout_expires
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self),
+            "maxsize": self.maxsize,
+        }
+
+
+# Process-local cache in front of the compressor's cache backend for the
+# packed values handled by ``cache_get`` and ``cache_set``.
+local_cache = LocalCache("COMPRESS_LOCAL_CACHE_SIZE", "COMPRESS_LOCAL_CACHE_TIMEOUT")
+
+# Content hashes of files by (path, mtime, size, length), see
+# COMPRESS_HASHED_CONTENT_CACHE_SIZE.
+hashed_content_cache = LocalCache("COMPRESS_HASHED_CONTENT_CACHE_SIZE")
+
+# Files referenced by stylesheets by (filter, path, mtime, ...), see
+# COMPRESS_REFERENCED_FILES_CACHE_SIZE.
+referenced_files_cache = LocalCache("COMPRESS_REFERENCED_FILES_CACHE_SIZE")
+
+# Data URIs of files by (path, mtime, size), see COMPRESS_DATA_URI_CACHE_SIZE.
+data_uri_cache = LocalCache("COMPRESS_DATA_URI_CACHE_SIZE")
+
+# Output files known to be in the storage, see COMPRESS_OUTPUT_REGISTRY_SIZE.
+output_registry = LocalCache("COMPRESS_OUTPUT_REGISTRY_SIZE")
+
+# The entries of the filename index this process looked up, by cache key, see
+# COMPRESS_FILENAME_INDEX_CACHE_SIZE.
+filename_index = LocalCache(
+    "COMPRESS_FILENAME_INDEX_CACHE_SIZE", "COMPRESS_LOCAL_CACHE_TIMEOUT"
+)
+
+
+def get_output_registry_cachekey(filepath):
+    return get_cachekey("output.%s" % get_hexdigest(filepath))
+
+
+def output_registry_enabled():
+    return bool(
+        settings.COMPRESS_OUTPUT_REGISTRY_SIZE or settings.COMPRESS_OUTPUT_REGISTRY_CACHE
+    )
+
+
+def is_registered_output(filepath):
+    """
+    Returns whether the output file ``filepath`` is known to be saved.
+    """
+    if output_registry.get(filepath):
+        return True
+    if settings.COMPRESS_OUTPUT_REGISTRY_CACHE and cache.get(
+        get_output_registry_cachekey(filepath)
+    ):
+        output_registry.set(filepath, True)
+        return True
+    return False
+
+
+def register_output(filepath):
+    output_registry.set(filepath, True)
+    if settings.COMPRESS_OUTPUT_REGISTRY_CACHE:
+        cache.set(
+            get_output_registry_cachekey(filepath),
+            True,
+            settings.COMPRESS_REBUILD_TIMEOUT,
+        )
+
+
+class DiskCache:
+    """
+    A content-addressed cache of strings on the file system.
+
+    Entries are stored as files named after their key below the directory
+    given by the named setting, so they survive restarts and can be shared
+    by processes and build steps using the same directory. ``None`` as
+    directory disables the cache. If the entries grow beyond the size (in
+    bytes) of the named size setting, the least recently used ones are
+    removed.
+
+    The size of the entries is counted once per process and then kept up to
+    date with the entries it writes, the directory is only walked again when
+    that count exceeds the limit. Entries are then removed until the cache is
+    at 90% of the limit, so that doesn't happen on each following write.
+    """
+
+    # the fraction of the size limit the cache is culled to
+    cull_ratio = 0.9
+
+    def __init__(self, dir_setting, size_setting):
+        self.dir_setting = dir_setting
+        self.size_setting = size_setting
+        # (directory, size of its entries) as counted by this process
+        self._size = None
+        self._size_lock = threading.Lock()
+
+    @property
+    def directory(self):
+        return getattr(settings, self.dir_setting)
+
+    @property
+    def maxsize(self):
+        return getattr(settings, self.size_setting)
+
+    def get_path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key, default=None):
+        if not self.directory:
+            return default
+        path = self.get_path(key)
+        try:
+            with open(path, "rb") as file:
+                value = file.read()
+            # The modification time doubles as the last access time.
+            os.utime(path)
+        except OSError:
+            return default
+        return value.decode("utf-8")
+
+    def set(self, key, value):
+        if not self.directory:
+            return
+        path = self.get_path(key)
+        data = value.encode("utf-8")
+        try:
+            replaced = os.stat(path).st_size
+        except OSError:
+            replaced = 0
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temporary file first, so readers never see
+            # partially written entries.
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+            try:
+                with os.fdopen(fd, "wb") as file:
+                    file.write(data)
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        except OSError:
+            return
+        self.cull(len(data) - replaced)
+
+    def entries(self):
+        """
+        Returns ``(mtime, size, path)`` tuples of all entries.
+        """
+        entries = []
+        for root, dirs, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def cull(self, added=0):
+        """
+        Removes the least recently used entries if the cache grew beyond its
+        size limit after ``added`` bytes were written to it.
+        """
+        maxsize = self.maxsize
+        if not maxsize:
+            return
+        directory = self.directory
+        with self._size_lock:
+            if self._size is not None and self._size[0] == directory:
+                total = self._size[1] + added
+                entries = None
+            else:
+                entries = self.entries()
+                total = sum(size for mtime, size, path in entries)
+            if total > maxsize:
+                if entries is None:
+                    # Other processes may have changed the cache as well.
+                    entries = self.entries()
+                    total = sum(size for mtime, size, path in entries)
+                target = maxsize * self.cull_ratio
+                for mtime, size, path in sorted(entries):
+                    if total <= target:
+                        break
+                    try:
+                        os.unlink(path)
+                    except OSError:
+                        continue
+                    total -= size
+            self._size = (directory, total)
+
+    def clear(self):
+        if not self.directory:
+            return
+        for mtime, size, path in self.entries():
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+        with self._size_lock:
+            self._size = None
+
+
+# Cache of compiler output on the file system.
+compiler_cache = DiskCache(
+    "COMPRESS_COMPILER_CACHE_DIR", "COMPRESS_COMPILER_CACHE_SIZE"
+)
+
+
+def get_compiler_cachekey(command, options, version, contents):
+    return get_hexdigest(
+        "compiler.%s.%s.%s.%s" % (command, options, version, get_hexdigest(contents))
+    )
+
+
 def cache_get(key):
-    packed_val = cache.get(key)
+    packed_val = local_cache.get(key)
     if packed_val is None:
-        return None
+        packed_val = cache.get(key)
+        if packed_val is None:
+            return None
+        # Never keep the value locally past its refresh time, so the
+        # dog-pile handling below always goes through the shared cache.
+        local_cache.set(key, packed_val, expires=packed_val[1])
     val, refresh_time, refreshed = packed_val
     if (time.time() > refresh_time) and not refreshed:
         # Store the stale value while the cache
@@ -156,6 +674,7 @@ def cache_set(key, val, refreshed=False, timeout=None):
     refresh_time = timeout + time.time()
     real_timeout = timeout + settings.COMPRESS_MINT_DELAY
     packed_val = (val, refresh_time, refreshed)
+    local_cache.set(key, packed_val, expires=refresh_time)
     return cache.set(key, packed_val, real_timeout)
 
 
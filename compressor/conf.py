@@ -17,6 +17,15 @@ class CompressorConf(AppConf):
     PARSER = "compressor.parser.AutoSelectParser"
     OUTPUT_DIR = "CACHE"
     STORAGE = "compressor.storage.CompressorFileStorage"
+    # compressed variants written by PrecompressedCompressorFileStorage
+    PRECOMPRESS_FORMATS = ("gzip", "brotli")
+    # compression levels by format, e.g. {"gzip": 6}, maximum levels otherwise
+    PRECOMPRESS_LEVELS = {}
+    # files smaller than this many bytes get no compressed variants
+    PRECOMPRESS_MIN_SIZE = 0
+    # threads writing compressed variants in the background, 0 writes them
+    # when the file is saved
+    PRECOMPRESS_WORKERS = 0
 
     COMPRESSORS = dict(
         css="compressor.css.CssCompressor",
@@ -36,6 +45,12 @@ class CompressorConf(AppConf):
 
     CSS_HASHING_METHOD = "mtime"
 
+    # the number of threads used to process the files of a compress block,
+    # 1 processes them sequentially
+    HUNK_WORKERS = 1
+    # write output files hunk by hunk instead of concatenating them in memory
+    STREAM_OUTPUT = False
+
     PRECOMPILERS = (
         # ('text/coffeescript', 'coffee --compile --stdio'),
         # ('text/less', 'lessc {infile} {outfile}'),
@@ -44,6 +59,16 @@ class CompressorConf(AppConf):
         # ('text/x-scss', 'sass --scss {infile} {outfile}'),
     )
     CACHEABLE_PRECOMPILERS = ()
+    # mimetypes of COMPRESS_PRECOMPILERS mapped to long-lived worker commands
+    PRECOMPILER_WORKERS = {}
+    # the maximum number of worker processes kept per worker command
+    COMPILER_WORKER_POOL_SIZE = 4
+    # seconds after which a worker not responding is killed, None for no limit
+    COMPILER_WORKER_TIMEOUT = 60
+    # directory of the file system cache of compiler output, None disables it
+    COMPILER_CACHE_DIR = None
+    # the maximum size of the compiler cache in bytes, None for no limit
+    COMPILER_CACHE_SIZE = 100 * 1024 * 1024
     CLOSURE_COMPILER_BINARY = "java -jar compiler.jar"
     CLOSURE_COMPILER_ARGUMENTS = ""
     YUI_BINARY = "java -jar yuicompressor.jar"
@@ -55,6 +80,12 @@ class CompressorConf(AppConf):
     CLEAN_CSS_BINARY = "cleancss"
     CLEAN_CSS_ARGUMENTS = ""
     DATA_URI_MAX_SIZE = 1024
+    # number of data URIs of embedded files kept in each process, 0 disables
+    # this cache
+    DATA_URI_CACHE_SIZE = 1000
+    # the shortest data URI CssDataUriDedupFilter moves into a custom property
+    # when it's repeated in a file
+    DATA_URI_DEDUP_MIN_SIZE = 256
 
     # the cache backend to use
     CACHE_BACKEND = None
@@ -67,6 +98,29 @@ class CompressorConf(AppConf):
     MINT_DELAY = 30  # seconds
     # check for file changes only after a delay
     MTIME_DELAY = 10  # seconds
+    # number of entries kept in the process-local cache in front of the
+    # cache backend, 0 disables it
+    LOCAL_CACHE_SIZE = 0
+    # the longest time an entry is kept in the process-local cache
+    LOCAL_CACHE_TIMEOUT = 60  # seconds
+    # remember the full paths of linked files in the cache
+    FILENAME_INDEX = False
+    # number of entries of the filename index kept in each process, 0
+    # disables this cache
+    FILENAME_INDEX_CACHE_SIZE = 1000
+    # number of content hashes of files referenced in stylesheets kept in
+    # each process, 0 disables this cache
+    HASHED_CONTENT_CACHE_SIZE = 1000
+    # number of stylesheets whose referenced files are remembered in each
+    # process, 0 disables this cache
+    REFERENCED_FILES_CACHE_SIZE = 1000
+    # number of output files remembered as saved to skip checking that they
+    # exist in the storage, 0 disables this registry
+    OUTPUT_REGISTRY_SIZE = 0
+    # also remember them in the cache backend, shared between processes
+    OUTPUT_REGISTRY_CACHE = False
+    # save output files missing from the registry without checking the storage
+    OUTPUT_REGISTRY_TRUSTED = False
     # enables the offline cache -- also filled by the compress command
     OFFLINE = False
     # invalidates the offline cache after one year
@@ -76,6 +130,10 @@ class CompressorConf(AppConf):
     # The name of the manifest file (e.g. filename.ext)
     OFFLINE_MANIFEST = "manifest.json"
     OFFLINE_MANIFEST_STORAGE = "compressor.storage.OfflineManifestFileStorage"
+    # The format of the manifest file, JSON or the lazily loaded binary format
+    OFFLINE_MANIFEST_BACKEND = "compressor.offline.manifest.JsonManifest"
+    # seconds between checks for a new offline manifest, None never checks
+    OFFLINE_MANIFEST_RELOAD_INTERVAL = None
     # The Context to be used when TemplateFilter is used
     TEMPLATE_FILTER_CONTEXT = {}
     # Placeholder to be used instead of settings.COMPRESS_URL during offline compression.
@@ -10,7 +10,14 @@ class CssCompressor(Compressor):
         if self.split_content:
             return self.split_content
         self.media_nodes = []
-        for elem in self.parser.css_elems():
+        elems = list(self.parser.css_elems())
+        self.prefetch_filenames(
+            self.parser.elem_attribs(elem)["href"]
+            for elem in elems
+            if self.parser.elem_name(elem) == "link"
+            and "href" in self.parser.elem_attribs(elem)
+        )
+        for elem in elems:
             data = None
             elem_name = self.parser.elem_name(elem)
             elem_attribs = self.parser.elem_attribs(elem)
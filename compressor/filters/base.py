@@ -1,9 +1,14 @@
 import io
 import logging
+import os
+import shlex
+import shutil
 import subprocess
 
+from copy import copy
 from importlib import import_module
 from platform import system
+from string import Formatter
 
 if system() != "Windows":
     from shlex import quote as shell_quote
@@ -19,15 +24,33 @@ from django.core.exceptions import ImproperlyConfigured
 from django.core.files.temp import NamedTemporaryFile
 from django.utils.encoding import smart_str
 
-from compressor.cache import cache, get_precompiler_cachekey
+from compressor.cache import (
+    cache,
+    compiler_cache,
+    get_compiler_cachekey,
+    get_precompiler_cachekey,
+)
 
 from compressor.conf import settings
 from compressor.exceptions import FilterError
 from compressor.utils import get_mod_func
+from compressor.utils.worker import WorkerError, get_worker_pool
 
 
 logger = logging.getLogger("compressor.filters")
 
+# Characters that need a shell to interpret the command they appear in.
+SHELL_CHARACTERS = frozenset("|&;<>()$`\\*?[]#~\n")
+
+
+def is_reusable(filter_cls):
+    """
+    Returns whether the filter class itself sets ``reusable = True``.
+    Subclasses have to set it again, since their ``__init__`` may depend on
+    the content.
+    """
+    return bool(vars(filter_cls).get("reusable", False))
+
 
 class FilterBase:
     """
@@ -43,6 +66,17 @@ class FilterBase:
     # This flag allows those filters to do so.
     run_with_compression_disabled = False
 
+    # Filters that don't depend on the content when being instantiated can
+    # set this to True. Compressors then create a single instance of them
+    # (passing ``None`` as content) and filter every content with ``apply``.
+    # It isn't inherited, see is_reusable.
+    reusable = False
+
+    # Filters whose ``output`` method can process each hunk on its own
+    # instead of the concatenated content (e.g. minifiers) can set this to
+    # True, so that COMPRESS_STREAM_OUTPUT applies to them.
+    streamable = False
+
     def __init__(
         self,
         content,
@@ -60,12 +94,45 @@ class FilterBase:
         self.filename = filename
         self.charset = charset
 
+    def apply(self, content, method="input", **kwargs):
+        """
+        Passes the given content to the ``input`` or ``output`` method
+        without modifying this filter instance, e.g.::
+
+            minifier = rCSSMinFilter(None)
+            minified = minifier.apply(content, "output")
+        """
+        filter = copy(self)
+        filter.content = content
+        return getattr(filter, method)(**kwargs)
+
     def input(self, **kwargs):
         raise NotImplementedError
 
     def output(self, **kwargs):
         raise NotImplementedError
 
+    def get_referenced_files(self, filename, basename=None, charset=None, mtimes=None):
+        """
+        Returns the paths of the files besides ``filename`` that ``input``
+        reads when filtering it, e.g. the stylesheets it imports, so that
+        their modification times are part of the compressor's cache key.
+
+        ``mtimes`` maps the paths whose modification times the compressor
+        already looked up to them, the ones looked up here may be added.
+        """
+        return []
+
+    def get_asset_files(self, filename, basename=None, charset=None, mtimes=None):
+        """
+        Returns the paths of the files ``filename`` refers to whose changes
+        may change the output, e.g. images whose hashes are added to their
+        URLs. Unlike the referenced files they aren't part of the cache key,
+        ``compress --incremental`` renders the templates again when they
+        change.
+        """
+        return []
+
 
 class CallbackOutputFilter(FilterBase):
     """
@@ -126,15 +193,30 @@ class CompilerFilter(FilterBase):
     """
     A filter subclass that is able to filter content via
     external commands.
+
+    ``command`` is either a string or a list of arguments, each of which
+    is formatted with the options. String commands are only run through a
+    shell if they use shell syntax such as redirections or pipes. Commands
+    without ``{infile}`` and ``{outfile}`` placeholders receive the content
+    on stdin and write the result to stdout, without any temporary files.
+
+    If ``worker_command`` is given, the content is sent to a pool of
+    long-lived processes running that command instead, see
+    ``compressor.utils.worker``. ``command`` is still used if the
+    workers can't be started.
+
+    The output for contents not read from a file is stored in the
+    ``COMPRESS_COMPILER_CACHE_DIR``, see ``get_compiler_cache_key``.
     """
 
     command = None
+    worker_command = None
     options = ()
     default_encoding = (
         settings.FILE_CHARSET if settings.is_overridden("FILE_CHARSET") else "utf-8"
     )
 
-    def __init__(self, content, command=None, **kwargs):
+    def __init__(self, content, command=None, worker_command=None, **kwargs):
         super().__init__(content, **kwargs)
         self.cwd = None
 
@@ -142,6 +224,8 @@ class CompilerFilter(FilterBase):
             self.command = command
         if self.command is None:
             raise FilterError("Required attribute 'command' not given")
+        if worker_command:
+            self.worker_command = worker_command
 
         if isinstance(self.options, dict):
             # turn dict into a tuple
@@ -157,12 +241,139 @@ class CompilerFilter(FilterBase):
         self.stdout = self.stdin = self.stderr = subprocess.PIPE
         self.infile = self.outfile = None
 
+    def run_worker(self):
+        """
+        Filters the content with a pooled worker process, returns ``None``
+        if no worker could handle it.
+        """
+        fields = set(
+            field for _, field, _, _ in Formatter().parse(self.worker_command) if field
+        )
+        if fields & {"infile", "outfile"}:
+            raise FilterError(
+                "The worker command %r of %s can't use the {infile} and "
+                "{outfile} placeholders, workers receive the content in "
+                "their requests."
+                % (self.worker_command, self.__class__.__name__)
+            )
+        try:
+            command = self.worker_command.format(**dict(self.options))
+        except KeyError as e:
+            raise FilterError(
+                "The worker command %r of %s uses the unknown option %s."
+                % (self.worker_command, self.__class__.__name__, e)
+            )
+        pool = get_worker_pool(
+            command,
+            settings.COMPRESS_COMPILER_WORKER_POOL_SIZE,
+            cwd=self.cwd,
+            timeout=settings.COMPRESS_COMPILER_WORKER_TIMEOUT,
+        )
+        try:
+            filtered = pool.run(self.content.encode("utf-8"), self.filename)
+        except WorkerError as e:
+            self.logger.warning(
+                "Falling back to %r for %s: %s",
+                self.command,
+                self.__class__.__name__,
+                e,
+            )
+            return None
+        return smart_str(filtered.decode("utf-8"))
+
+    def format_command(self, options):
+        """
+        Returns the command formatted with the given options, either as a
+        list of arguments or, if it needs a shell, as a string, and whether
+        it needs a shell.
+        """
+        if isinstance(self.command, (list, tuple)):
+            args = [arg.format(**options) for arg in self.command]
+            return [arg for arg in args if arg], False
+        command = self.command.format(**options)
+        if system() == "Windows" or SHELL_CHARACTERS.intersection(command):
+            return command, True
+        args = shlex.split(command)
+        if not args or "=" in args[0]:
+            # Empty or starts with an environment variable assignment.
+            return command, True
+        return args, False
+
+    def get_compiler_version(self):
+        """
+        Returns a fingerprint of the compiler, made of the path, mtime and
+        size of the executable and of any other existing file the command
+        refers to (e.g. a ``.jar`` or config file).
+        """
+        options = dict(self.options, infile="", outfile="")
+        args, shell = self.format_command(options)
+        if shell:
+            try:
+                args = shlex.split(args, posix=system() != "Windows")
+            except ValueError:
+                args = args.split()
+        # Skip environment variable assignments.
+        while args and "=" in args[0]:
+            args = args[1:]
+        version = []
+        for i, arg in enumerate(args):
+            path = shutil.which(arg) if i == 0 else os.path.join(self.cwd or "", arg)
+            if not path or not os.path.isfile(path):
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            version.append((path, stat.st_mtime_ns, stat.st_size))
+        return version
+
+    def is_compiler_cacheable(self):
+        """
+        Whether the output can be stored in the compiler cache. By default
+        only contents that aren't read from a file are cached, since
+        compiling a file may depend on the files it imports.
+        """
+        return self.filename is None
+
+    def get_compiler_cache_key(self):
+        options = sorted(
+            (name, str(value))
+            for name, value in self.options
+            if name not in ("infile", "outfile")
+        )
+        return get_compiler_cachekey(
+            self.command, options, self.get_compiler_version(), self.content
+        )
+
     def input(self, **kwargs):
+        key = None
+        if compiler_cache.directory and self.is_compiler_cacheable():
+            key = self.get_compiler_cache_key()
+            filtered = compiler_cache.get(key)
+            if filtered is not None:
+                return filtered
+        filtered = self.compile(**kwargs)
+        if key is not None:
+            compiler_cache.set(key, filtered)
+        return filtered
+
+    def compile(self, **kwargs):
+        """
+        Runs the content through the worker or the command.
+        """
+        if self.worker_command and settings.COMPRESS_COMPILER_WORKER_POOL_SIZE:
+            filtered = self.run_worker()
+            if filtered is not None:
+                return filtered
 
         encoding = self.default_encoding
         options = dict(self.options)
+        if isinstance(self.command, (list, tuple)):
+            command_template = " ".join(self.command)
+        else:
+            command_template = self.command
 
-        if self.infile is None and "{infile}" in self.command:
+        if self.infile is None and "{infile}" in command_template:
             # create temporary input file if needed
             if self.filename is None:
                 self.infile = NamedTemporaryFile(mode="wb")
@@ -178,23 +389,25 @@ class CompilerFilter(FilterBase):
                 self.infile = open(self.filename)
                 options["infile"] = self.filename
 
-        if "{outfile}" in self.command and "outfile" not in options:
+        if "{outfile}" in command_template and "outfile" not in options:
             # create temporary output file if needed
             ext = self.type and ".%s" % self.type or ""
             self.outfile = NamedTemporaryFile(mode="r+", suffix=ext)
             options["outfile"] = self.outfile.name
 
-        # Quote infile and outfile for spaces etc.
-        if "infile" in options:
-            options["infile"] = shell_quote(options["infile"])
-        if "outfile" in options:
-            options["outfile"] = shell_quote(options["outfile"])
+        # Quote infile and outfile for spaces etc., arguments of list
+        # commands are passed as they are.
+        if isinstance(self.command, str):
+            if "infile" in options:
+                options["infile"] = shell_quote(options["infile"])
+            if "outfile" in options:
+                options["outfile"] = shell_quote(options["outfile"])
 
         try:
-            command = self.command.format(**options)
+            command, shell = self.format_command(options)
             proc = subprocess.Popen(
                 command,
-                shell=True,
+                shell=shell,
                 cwd=self.cwd,
                 stdout=self.stdout,
                 stdin=self.stdin,
@@ -241,6 +454,9 @@ class CompilerFilter(FilterBase):
 class CachedCompilerFilter(CompilerFilter):
     def __init__(self, mimetype, *args, **kwargs):
         self.mimetype = mimetype
+        kwargs.setdefault(
+            "worker_command", settings.COMPRESS_PRECOMPILER_WORKERS.get(mimetype)
+        )
         super().__init__(*args, **kwargs)
 
     def input(self, **kwargs):
@@ -257,3 +473,6 @@ class CachedCompilerFilter(CompilerFilter):
 
     def get_cache_key(self):
         return get_precompiler_cachekey(self.command, self.content)
+
+    def is_compiler_cacheable(self):
+        return self.mimetype in settings.COMPRESS_CACHEABLE_PRECOMPILERS
@@ -3,7 +3,8 @@ from compressor.filters import CompilerFilter
 
 
 class CleanCSSFilter(CompilerFilter):
-    command = "{binary} {args} -o {outfile} {infile}"
+    # clean-css reads from stdin and writes to stdout if no files are given.
+    command = "{binary} {args}"
     options = (
         ("binary", settings.COMPRESS_CLEAN_CSS_BINARY),
         ("args", settings.COMPRESS_CLEAN_CSS_ARGUMENTS),
@@ -1,11 +1,17 @@
 import os
-import re
 import posixpath
+import re
+import warnings
+from copy import copy
 
 from compressor.cache import get_hashed_mtime, get_hashed_content
 from compressor.conf import settings
 from compressor.filters import FilterBase, FilterError
+from compressor.filters.css_urls import get_referenced_files, replace_references
 
+# Deprecated, the references are found by
+# compressor.filters.css_urls.scan_references, these patterns are only used
+# for subclasses overriding url_converter or src_converter.
 URL_PATTERN = re.compile(
     r"""
     url\(
@@ -24,6 +30,7 @@ SCHEMES = ("http://", "https://", "/")
 class CssAbsoluteFilter(FilterBase):
 
     run_with_compression_disabled = True
+    reusable = True
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -35,6 +42,27 @@ class CssAbsoluteFilter(FilterBase):
     def input(self, filename=None, basename=None, **kwargs):
         if not filename:
             return self.content
+        self.set_basename(basename)
+        if (
+            type(self).url_converter is not CssAbsoluteFilter.url_converter
+            or type(self).src_converter is not CssAbsoluteFilter.src_converter
+        ):
+            warnings.warn(
+                "%s overrides url_converter or src_converter, which are "
+                "deprecated, override reference_converter instead."
+                % type(self).__name__,
+                DeprecationWarning,
+            )
+            return SRC_PATTERN.sub(
+                self.src_converter, URL_PATTERN.sub(self.url_converter, self.content)
+            )
+        return replace_references(self.content, self.reference_converter)
+
+    def set_basename(self, basename):
+        """
+        Sets up the URLs the references of the stylesheet at ``basename``
+        are relative to.
+        """
         self.path = basename.replace(os.sep, "/")
         self.path = self.path.lstrip("/")
         if self.url.startswith(("http://", "https://")):
@@ -45,10 +73,31 @@ class CssAbsoluteFilter(FilterBase):
             self.protocol = "%s/" % "/".join(parts[:2])
             self.host = parts[2]
         self.directory_name = "/".join((self.url, os.path.dirname(self.path)))
-        return SRC_PATTERN.sub(
-            self.src_converter, URL_PATTERN.sub(self.url_converter, self.content)
+
+    def get_asset_files(self, filename, basename=None, charset=None, mtimes=None):
+        """
+        Returns the local files whose hashes are added to the URLs.
+        """
+        if not basename or settings.COMPRESS_CSS_HASHING_METHOD is None:
+            return []
+        filter = copy(self)
+        filter.set_basename(basename)
+        key = (type(self), basename, settings.COMPRESS_URL, settings.COMPRESS_ROOT)
+        return get_referenced_files(
+            filename, charset, key, filter.get_local_file, mtimes
         )
 
+    def get_local_file(self, reference):
+        """
+        Returns the path of the local file ``reference`` refers to, if any.
+        """
+        if reference.url.startswith(("#", "data:")):
+            return None
+        filename = self.guess_filename(self.get_full_url(reference.url))
+        if filename and os.path.isfile(filename):
+            return filename
+        return None
+
     def guess_filename(self, url):
         local_path = url
         if self.has_scheme:
@@ -97,15 +146,23 @@ class CssAbsoluteFilter(FilterBase):
             url = "%s#%s" % (url, fragment)
         return url
 
+    def get_full_url(self, url):
+        """
+        Returns the absolute URL of the relative ``url``.
+        """
+        if url.startswith(("#", "data:")) or url.startswith(SCHEMES):
+            return url
+        full_url = posixpath.normpath("/".join([str(self.directory_name), url]))
+        if self.has_scheme:
+            full_url = "%s%s" % (self.protocol, full_url)
+        return full_url
+
     def _converter(self, url):
         if url.startswith(("#", "data:")):
             return url
         elif url.startswith(SCHEMES):
             return self.add_suffix(url)
-        full_url = posixpath.normpath("/".join([str(self.directory_name), url]))
-        if self.has_scheme:
-            full_url = "%s%s" % (self.protocol, full_url)
-        full_url = self.add_suffix(full_url)
+        full_url = self.add_suffix(self.get_full_url(url))
         return self.post_process_url(full_url)
 
     def post_process_url(self, url):
@@ -114,12 +171,21 @@ class CssAbsoluteFilter(FilterBase):
         """
         return url
 
+    def reference_converter(self, reference):
+        return reference._replace(url=self._converter(reference.url))
+
     def url_converter(self, matchobj):
+        """
+        Deprecated, see ``reference_converter``.
+        """
         quote = matchobj.group(1)
         converted_url = self._converter(matchobj.group(2))
         return "url(%s%s%s)" % (quote, converted_url, quote)
 
     def src_converter(self, matchobj):
+        """
+        Deprecated, see ``reference_converter``.
+        """
         quote = matchobj.group(1)
         converted_url = self._converter(matchobj.group(2))
         return "src=%s%s%s" % (quote, converted_url, quote)
@@ -132,6 +198,7 @@ class CssRelativeFilter(CssAbsoluteFilter):
     """
 
     run_with_compression_disabled = True
+    reusable = True
 
     def post_process_url(self, url):
         """
@@ -154,6 +221,8 @@ class CssRelativeFilter(CssAbsoluteFilter):
         old_prefix = self.url
         if self.has_scheme:
             old_prefix = "{}{}".format(self.protocol, old_prefix)
+        if not url.startswith(old_prefix):
+            return url
         # One level up from 'css' / 'js' folder
         new_prefix = ".."
         # N levels up from ``settings.COMPRESS_OUTPUT_DIR``
@@ -164,4 +233,4 @@ class CssRelativeFilter(CssAbsoluteFilter):
                 )
             )
         )
-        return re.sub("^{}".format(old_prefix), new_prefix, url)
+        return new_prefix + url[len(old_prefix) :]
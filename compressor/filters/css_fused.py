@@ -0,0 +1,47 @@
+from compressor.conf import settings
+from compressor.filters.css_default import CssAbsoluteFilter
+from compressor.filters.cssmin import rCSSMinFilter
+from compressor.filters.datauri import CssDataUriFilter
+
+
+class CssFusedFilter(CssAbsoluteFilter, rCSSMinFilter):
+    """
+    Does the work of the default CSS filters in a single filter: rewrites
+    the URLs of each stylesheet and adds their hash suffixes like
+    ``CssAbsoluteFilter`` and minifies the output like ``rCSSMinFilter``.
+
+    The references of a stylesheet are scanned once, and with ``data_uris``
+    also embedded like ``CssDataUriFilter`` in the same pass. References
+    repeated in a stylesheet are converted once.
+    """
+
+    reusable = True
+    # embed the referenced files as data: URIs, see CssFusedDataUriFilter
+    data_uris = False
+
+    def input(self, filename=None, basename=None, **kwargs):
+        self.data_uri_filter = None
+        if self.data_uris and filename and filename.startswith(settings.COMPRESS_ROOT):
+            self.data_uri_filter = CssDataUriFilter(None)
+        self.converted = {}
+        return super().input(filename=filename, basename=basename, **kwargs)
+
+    def reference_converter(self, reference):
+        key = (reference.kind, reference.url, reference.quote)
+        converted = self.converted.get(key)
+        if converted is None:
+            converted = super().reference_converter(reference)
+            if self.data_uri_filter is not None and reference.kind == "url":
+                converted = self.data_uri_filter.reference_converter(converted)
+            self.converted[key] = converted
+        return converted._replace(start=reference.start, end=reference.end)
+
+
+class CssFusedDataUriFilter(CssFusedFilter):
+    """
+    ``CssFusedFilter`` that also embeds files smaller than
+    COMPRESS_DATA_URI_MAX_SIZE as data: URIs.
+    """
+
+    reusable = True
+    data_uris = True
@@ -0,0 +1,274 @@
+import os
+import posixpath
+import re
+import threading
+from collections import OrderedDict, namedtuple
+
+from compressor.cache import get_mtime, get_mtimes
+from compressor.conf import settings
+from compressor.exceptions import UncompressableFileError
+from compressor.filters import FilterBase
+from compressor.filters.css_urls import replace_references
+from compressor.utils import get_class
+
+# An ``@import`` rule, from ``start`` to ``end`` including the semicolon.
+ImportRule = namedtuple("ImportRule", "start end url media")
+
+# What may precede the @import rules of a stylesheet, browsers ignore the
+# ones after other rules.
+PRELUDE_PATTERN = re.compile(r'(?:\s+|/\*.*?\*/|@charset\s+"[^"]*";)*', re.S)
+IMPORT_PATTERN = re.compile(
+    r"""@import\s*(?:"""
+    r"""url\(\s*(?P<quote>["']?)(?P<url>[^"')]*)(?P=quote)\s*\)"""
+    r"""|(?P<string_quote>["'])(?P<string>[^"']*)(?P=string_quote))"""
+    r"""(?P<media>[^;]*)(?:;|$)""",
+    re.I,
+)
+CHARSET_PATTERN = re.compile(r'^@charset\s+"[^"]*";')
+
+# The modification time and the stylesheets imported by the latest files,
+# by (path, basename).
+_imports = OrderedDict()
+_imports_lock = threading.Lock()
+_IMPORTS_SIZE = 256
+
+
+def get_existing_mtimes(filenames):
+    """
+    Returns the modification times of the given files by path, skipping
+    the ones that don't exist.
+    """
+    try:
+        return get_mtimes(filenames)
+    except OSError:
+        mtimes = {}
+        for filename in filenames:
+            try:
+                mtimes[filename] = get_mtime(filename)
+            except OSError:
+                continue
+        return mtimes
+
+
+def get_import_rules(content):
+    """
+    Returns the ``@import`` rules at the start of the stylesheet ``content``.
+    """
+    rules = []
+    position = PRELUDE_PATTERN.match(content).end()
+    while True:
+        match = IMPORT_PATTERN.match(content, position)
+        if match is None:
+            return rules
+        url = match.group("url")
+        if url is None:
+            url = match.group("string")
+        rules.append(
+            ImportRule(match.start(), match.end(), url, match.group("media").strip())
+        )
+        position = PRELUDE_PATTERN.match(content, match.end()).end()
+
+
+def rebase_url(url, source, target):
+    """
+    Returns the relative ``url`` of the stylesheet at ``source`` relative to
+    the stylesheet at ``target`` instead, or ``None`` if it isn't relative.
+    """
+    if url.startswith(("/", "#", "data:")) or "://" in url:
+        return None
+    path, separator, suffix = url.partition("?")
+    if not separator:
+        path, separator, suffix = url.partition("#")
+    if not path:
+        return None
+    path = posixpath.normpath(posixpath.join(posixpath.dirname(source), path))
+    path = posixpath.relpath(path, posixpath.dirname(target) or ".")
+    return path + separator + suffix
+
+
+def rebase_references(content, source, target):
+    """
+    Makes the relative URLs of the stylesheet ``content`` at ``source``
+    relative to ``target``, e.g. when inlining it in that stylesheet.
+    """
+    if posixpath.dirname(source) == posixpath.dirname(target):
+        return content
+
+    def rebase(reference):
+        url = rebase_url(reference.url, source, target)
+        return None if url is None else reference._replace(url=url)
+
+    return replace_references(content, rebase)
+
+
+class CssImportFilter(FilterBase):
+    """
+    Inlines the local stylesheets imported with ``@import`` rules,
+    recursively.
+
+    Imports are resolved like the linked files of the CSS compressor and
+    their relative URLs rewritten, so that it has to be the first filter.
+    Imports of other hosts or with ``layer`` or ``supports()`` conditions
+    are kept, as are the ones before them so that the order of the rules
+    doesn't change. Stylesheets importing themselves are inlined once.
+    """
+
+    reusable = True
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.compressor = get_class(settings.COMPRESSORS["css"])("css")
+
+    def resolve(self, url, basename):
+        """
+        Returns the basename and path of the stylesheet imported by ``url``
+        in the stylesheet at ``basename``, or ``None`` if it isn't local.
+        """
+        if url.startswith(("data:", "//")):
+            return None
+        try:
+            if url.startswith("/") or "://" in url:
+                import_basename = self.compressor.get_basename(url)
+            else:
+                url = url.split("?", 1)[0].split("#", 1)[0]
+                import_basename = posixpath.normpath(
+                    posixpath.join(posixpath.dirname(basename), url)
+                )
+                if import_basename.startswith("../"):
+                    return None
+            filename = self.compressor.get_filename(import_basename)
+        except UncompressableFileError:
+            return None
+        return import_basename, os.path.realpath(filename)
+
+    def get_imports(self, content, basename):
+        """
+        Returns the ``@import`` rules of ``content`` with the stylesheets
+        they import, ``None`` for those that can't be inlined.
+        """
+        imports = []
+        for rule in get_import_rules(content):
+            media = rule.media.lower()
+            if media.startswith(("layer", "supports")):
+                imports.append((rule, None))
+            else:
+                imports.append((rule, self.resolve(rule.url, basename)))
+        return imports
+
+    def input(self, filename=None, basename=None, charset=None, **kwargs):
+        if not filename or not basename:
+            return self.content
+        charset = charset or self.compressor.charset
+        return self.flatten(
+            self.content, basename, charset, (os.path.realpath(filename),)
+        )
+
+    def flatten(self, content, basename, charset, parents):
+        """
+        Returns ``content`` with the stylesheets it imports inlined, skipping
+        the ones in ``parents``, which are being inlined already.
+        """
+        inlined = []
+        for rule, imported in self.get_imports(content, basename):
+            if imported is None:
+                inlined = []
+                continue
+            import_basename, filename = imported
+            if filename in parents:
+                inlined.append((rule, ""))
+                continue
+            imported_content = CHARSET_PATTERN.sub(
+                "", self.compressor.get_filecontent(filename, charset)
+            )
+            imported_content = self.flatten(
+                imported_content, import_basename, charset, parents + (filename,)
+            )
+            if get_import_rules(imported_content):
+                # Imports it couldn't inline would be ignored after its rules.
+                inlined = []
+                continue
+            imported_content = rebase_references(
+                imported_content, import_basename, basename
+            )
+            if rule.media:
+                imported_content = "@media %s{%s}" % (rule.media, imported_content)
+            inlined.append((rule, imported_content))
+        if not inlined:
+            return content
+        parts = [content[: inlined[0][0].start]]
+        for rule, imported_content in inlined:
+            parts.append(imported_content)
+        parts.append(content[inlined[-1][0].end :])
+        return "".join(parts)
+
+    def get_referenced_files(self, filename, basename=None, charset=None, mtimes=None):
+        if not basename:
+            return []
+        charset = charset or self.compressor.charset
+        if mtimes is None:
+            mtimes = {}
+        filename = os.path.realpath(filename)
+        # Walks the imports remembered from previous calls, and then checks
+        # the modification times of all the files at once, until reading the
+        # changed files doesn't find other imports.
+        imports = {}
+        files = None
+        while True:
+            collected = self.collect_imports(filename, basename, imports)
+            if collected == files:
+                return [path for path, path_basename in files[1:]]
+            files = collected
+            missing = [path for path, path_basename in files if path not in mtimes]
+            if missing:
+                mtimes.update(get_existing_mtimes(missing))
+            for key in files:
+                if key not in imports and key[0] in mtimes:
+                    imports[key] = self.get_file_imports(
+                        key[0], key[1], charset, mtimes[key[0]]
+                    )
+
+    def collect_imports(self, filename, basename, imports):
+        """
+        Returns the ``(path, basename)`` of the file and of the stylesheets
+        it imports recursively, as far as they're known from ``imports`` or
+        from previous calls.
+        """
+        files = [(filename, basename)]
+        seen = {filename}
+        for key in files:
+            imported = imports.get(key)
+            if imported is None:
+                with _imports_lock:
+                    imported = _imports.get(key, (None, []))[1]
+            for import_basename, import_filename in imported:
+                if import_filename not in seen:
+                    seen.add(import_filename)
+                    files.append((import_filename, import_basename))
+        return files
+
+    def get_file_imports(self, filename, basename, charset, mtime):
+        """
+        Returns the basenames and paths of the stylesheets the file imports,
+        remembered as long as its modification time doesn't change.
+        """
+        key = (filename, basename)
+        with _imports_lock:
+            remembered = _imports.get(key)
+        if remembered is not None and remembered[0] == mtime:
+            return remembered[1]
+        try:
+            content = self.compressor.get_filecontent(filename, charset)
+        except (OSError, UncompressableFileError):
+            imports = []
+        else:
+            imports = [
+                imported
+                for rule, imported in self.get_imports(content, basename)
+                if imported is not None
+            ]
+        with _imports_lock:
+            _imports[key] = (mtime, imports)
+            _imports.move_to_end(key)
+            while len(_imports) > _IMPORTS_SIZE:
+                _imports.popitem(last=False)
+        return imports
@@ -0,0 +1,197 @@
+import hashlib
+import re
+import threading
+from collections import OrderedDict, namedtuple
+
+from compressor.cache import get_mtime, referenced_files_cache
+
+# A reference to another file in a stylesheet. ``start`` and ``end`` delimit
+# the text to replace when the URL changes, ``kind`` is one of:
+# - "url": ``url(...)``, with or without quotes, e.g. in ``@import url(...)``
+# - "src": ``src="..."`` of IE filters
+# - "import": the string of ``@import "..."``
+CssReference = namedtuple("CssReference", "kind start end url quote")
+
+TOKEN_PATTERN = re.compile(r"""/\*|["']|url\(|(?<![\w-])src=(?=["'])|@import\b""")
+STRING_PATTERN = re.compile(r""""(?:[^"\\\n]|\\.)*"?|'(?:[^'\\\n]|\\.)*'?""", re.S)
+WHITESPACE_PATTERN = re.compile(r"\s*")
+
+# The references of the latest stylesheets by digest of their content, so
+# filters rewriting the URLs one after the other don't scan the output of
+# the previous one again. The stylesheets themselves aren't kept alive.
+_references = OrderedDict()
+_references_lock = threading.Lock()
+_REFERENCES_SIZE = 32
+
+
+def _get_key(content):
+    return hashlib.sha256(content.encode("utf-8", "surrogatepass")).digest()
+
+
+def _remember(key, references):
+    with _references_lock:
+        _references[key] = references
+        _references.move_to_end(key)
+        while len(_references) > _REFERENCES_SIZE:
+            _references.popitem(last=False)
+
+
+def _read_string(content, position):
+    """
+    Returns the value, quote and end of the string starting at ``position``.
+    """
+    match = STRING_PATTERN.match(content, position)
+    quote = content[position]
+    value = match.group()[1:]
+    if value.endswith(quote) and match.end() > position + 1:
+        value = value[:-1]
+    return value, quote, match.end()
+
+
+def _read_url(content, start, position):
+    """
+    Returns the reference of the ``url(`` at ``start`` whose argument begins
+    at ``position``, or ``None`` if it isn't closed.
+    """
+    position = WHITESPACE_PATTERN.match(content, position).end()
+    if content[position : position + 1] in ('"', "'"):
+        url, quote, position = _read_string(content, position)
+        position = WHITESPACE_PATTERN.match(content, position).end()
+        if content[position : position + 1] != ")":
+            return None
+    else:
+        quote = ""
+        end = content.find(")", position)
+        if end == -1:
+            return None
+        url = content[position:end].rstrip()
+        position = end
+    return CssReference("url", start, position + 1, url, quote)
+
+
+def scan_references(content):
+    """
+    Returns the references to other files in the stylesheet ``content``, in
+    a single pass that skips comments and strings.
+    """
+    references = []
+    position = 0
+    while True:
+        match = TOKEN_PATTERN.search(content, position)
+        if match is None:
+            return references
+        token = match.group()
+        if token == "/*":
+            end = content.find("*/", match.end())
+            position = len(content) if end == -1 else end + 2
+        elif token in ('"', "'"):
+            position = _read_string(content, match.start())[2]
+        elif token == "url(":
+            reference = _read_url(content, match.start(), match.end())
+            if reference is None:
+                position = match.end()
+            else:
+                references.append(reference)
+                position = reference.end
+        elif token == "src=":
+            url, quote, position = _read_string(content, match.end())
+            references.append(CssReference("src", match.start(), position, url, quote))
+        else:
+            # @import, either followed by a string or by url(...), which
+            # is found by the next search.
+            position = WHITESPACE_PATTERN.match(content, match.end()).end()
+            if content[position : position + 1] in ('"', "'"):
+                start = position
+                url, quote, position = _read_string(content, start)
+                references.append(CssReference("import", start, position, url, quote))
+
+
+def get_references(content):
+    """
+    Returns the references of ``content``, reusing those of a stylesheet
+    returned by ``replace_references``.
+    """
+    key = _get_key(content)
+    with _references_lock:
+        references = _references.get(key)
+    if references is None:
+        references = scan_references(content)
+        _remember(key, references)
+    return references
+
+
+def format_reference(reference):
+    if reference.kind == "url":
+        return "url(%s%s%s)" % (reference.quote, reference.url, reference.quote)
+    if reference.kind == "src":
+        return "src=%s%s%s" % (reference.quote, reference.url, reference.quote)
+    return "%s%s%s" % (reference.quote, reference.url, reference.quote)
+
+
+def replace_references(content, replace, kinds=None):
+    """
+    Returns ``content`` with each reference replaced by the reference the
+    ``replace`` callable returns for it, usually with another ``url``, or
+    kept if it returns ``None``. ``kinds`` limits the replaced references to
+    the given kinds.
+
+    The references of the output are remembered for ``get_references``.
+    """
+    parts = []
+    references = []
+    position = 0
+    offset = 0
+    for reference in get_references(content):
+        replacement = None
+        if kinds is None or reference.kind in kinds:
+            replacement = replace(reference)
+        if replacement is None:
+            references.append(
+                reference._replace(
+                    start=reference.start + offset, end=reference.end + offset
+                )
+            )
+            continue
+        text = format_reference(replacement)
+        parts.append(content[position : reference.start])
+        parts.append(text)
+        position = reference.end
+        start = reference.start + offset
+        references.append(replacement._replace(start=start, end=start + len(text)))
+        offset += len(text) - (reference.end - reference.start)
+    parts.append(content[position:])
+    output = "".join(parts)
+    _remember(_get_key(output), references)
+    return output
+
+
+def get_referenced_files(filename, charset, key, resolve, mtimes=None):
+    """
+    Returns the paths the ``resolve`` callable returns for the references
+    of the stylesheet file ``filename``, skipping ``None``.
+
+    They're remembered by ``key`` and the modification time of the file, so
+    ``key`` has to identify everything else ``resolve`` depends on. It's
+    taken from ``mtimes`` if the caller already looked it up.
+    """
+    try:
+        mtime = mtimes[filename] if mtimes and filename in mtimes else None
+        if mtime is None:
+            mtime = get_mtime(filename)
+    except OSError:
+        return []
+    key = (key, filename, mtime)
+    filenames = referenced_files_cache.get(key)
+    if filenames is None:
+        try:
+            with open(filename, encoding=charset or "utf-8") as file:
+                content = file.read()
+        except (OSError, LookupError, UnicodeDecodeError):
+            return []
+        filenames = []
+        for reference in scan_references(content):
+            path = resolve(reference)
+            if path and path not in filenames:
+                filenames.append(path)
+        referenced_files_cache.set(key, filenames)
+    return filenames
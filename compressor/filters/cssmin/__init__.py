@@ -9,11 +9,15 @@ class CSSCompressorFilter(CallbackOutputFilter):
 
     callback = "csscompressor.compress"
     dependencies = ["csscompressor"]
+    reusable = True
+    streamable = True
 
 
 class rCSSMinFilter(CallbackOutputFilter):
     callback = "rcssmin.cssmin"
     dependencies = ["rcssmin"]
+    reusable = True
+    streamable = True
     kwargs = {"keep_bang_comments": True}
 
 
@@ -1,10 +1,19 @@
 import os
 import re
 import mimetypes
+import posixpath
+import warnings
 from base64 import b64encode
 
+from compressor.cache import data_uri_cache, get_hexdigest
 from compressor.conf import settings
 from compressor.filters import FilterBase
+from compressor.filters.css_urls import (
+    format_reference,
+    get_referenced_files,
+    get_references,
+    replace_references,
+)
 
 
 class DataUriFilter(FilterBase):
@@ -34,18 +43,67 @@ class DataUriFilter(FilterBase):
             url = url.split("#")[0]
         return os.path.join(settings.COMPRESS_ROOT, url[len(settings.COMPRESS_URL) :])
 
+    def get_asset_files(self, filename, basename=None, charset=None, mtimes=None):
+        """
+        Returns the local files that may be embedded.
+        """
+        if not basename or not filename.startswith(settings.COMPRESS_ROOT):
+            return []
+        key = (type(self), basename, settings.COMPRESS_URL, settings.COMPRESS_ROOT)
+        return get_referenced_files(
+            filename,
+            charset,
+            key,
+            lambda reference: self.get_local_file(reference.url, basename),
+            mtimes,
+        )
+
+    def get_local_file(self, url, basename):
+        """
+        Returns the path of the local file ``url`` in the stylesheet at
+        ``basename`` refers to, relative or not, if any.
+        """
+        if url.startswith(("#", "data:", "//")):
+            return None
+        if url.startswith(settings.COMPRESS_URL):
+            path = self.get_file_path(url)
+        elif url.startswith("/") or "://" in url:
+            return None
+        else:
+            url = url.split("?", 1)[0].split("#", 1)[0]
+            path = os.path.join(
+                settings.COMPRESS_ROOT,
+                posixpath.normpath(posixpath.join(posixpath.dirname(basename), url)),
+            )
+        if os.path.isfile(path):
+            return path
+        return None
+
+    def get_data_uri(self, url):
+        """
+        Returns the data: URI embedding the file ``url`` refers to, or
+        ``None`` if it shouldn't be embedded.
+        """
+        if url.startswith("data:") or url.startswith("//"):
+            return None
+        path = os.path.realpath(self.get_file_path(url))
+        stat = os.stat(path)
+        if stat.st_size > settings.COMPRESS_DATA_URI_MAX_SIZE:
+            return None
+        # The content of a file is assumed unchanged as long as its
+        # modification time and size are.
+        key = (path, stat.st_mtime_ns, stat.st_size)
+        data_uri = data_uri_cache.get(key)
+        if data_uri is None:
+            with open(path, "rb") as file:
+                data = b64encode(file.read()).decode("ascii")
+            data_uri = "data:%s;base64,%s" % (mimetypes.guess_type(path)[0], data)
+            data_uri_cache.set(key, data_uri)
+        return data_uri
+
     def data_uri_converter(self, matchobj):
         url = matchobj.group(1).strip(" '\"")
-        if not url.startswith("data:") and not url.startswith("//"):
-            path = self.get_file_path(url)
-            if os.stat(path).st_size <= settings.COMPRESS_DATA_URI_MAX_SIZE:
-                with open(path, "rb") as file:
-                    data = b64encode(file.read()).decode("ascii")
-                return 'url("data:%s;base64,%s")' % (
-                    mimetypes.guess_type(path)[0],
-                    data,
-                )
-        return 'url("%s")' % url
+        return 'url("%s")' % (self.get_data_uri(url) or url)
 
 
 class CssDataUriFilter(DataUriFilter):
@@ -54,4 +112,93 @@ class CssDataUriFilter(DataUriFilter):
     See DataUriFilter.
     """
 
+    reusable = True
+    # Deprecated, the references are found by
+    # compressor.filters.css_urls.scan_references, the patterns are only used
+    # by subclasses overriding them or data_uri_converter.
     url_patterns = (re.compile(r"url\(([^\)]+)\)"),)
+
+    def input(self, filename=None, **kwargs):
+        if not filename or not filename.startswith(settings.COMPRESS_ROOT):
+            return self.content
+        if (
+            type(self).url_patterns is not CssDataUriFilter.url_patterns
+            or type(self).data_uri_converter is not DataUriFilter.data_uri_converter
+        ):
+            warnings.warn(
+                "%s overrides url_patterns or data_uri_converter, which are "
+                "deprecated, override reference_converter instead."
+                % type(self).__name__,
+                DeprecationWarning,
+            )
+            return super().input(filename=filename, **kwargs)
+        return replace_references(self.content, self.reference_converter, ("url",))
+
+    def reference_converter(self, reference):
+        url = reference.url.strip(" '\"")
+        return reference._replace(url=self.get_data_uri(url) or url, quote='"')
+
+
+def get_declaration_start(content, position):
+    """
+    Returns where the declaration around ``position`` starts, or ``None``
+    if it isn't a declaration of a style rule, e.g. in ``@font-face``.
+    """
+    block = content.rfind("{", 0, position)
+    if block == -1:
+        return None
+    start = max(content.rfind(char, 0, block) for char in "{};") + 1
+    if content[start:block].lstrip().startswith("@"):
+        return None
+    start = max(content.rfind(char, 0, position) for char in "{;") + 1
+    if ":" not in content[start:position]:
+        return None
+    return start
+
+
+def dedup_data_uris(content, min_size):
+    """
+    Moves data URIs of at least ``min_size`` characters that are used more
+    than once in the declarations of ``content`` into custom properties of
+    a ``:root`` rule appended to it, and uses them with ``var()`` instead.
+    """
+    references = {}
+    for reference in get_references(content):
+        if (
+            reference.kind == "url"
+            and reference.url.startswith("data:")
+            and len(reference.url) >= min_size
+            and get_declaration_start(content, reference.start) is not None
+        ):
+            references.setdefault(reference.url, []).append(reference)
+    replacements = []
+    properties = []
+    for url, repeated in references.items():
+        if len(repeated) < 2:
+            continue
+        name = "--compress-data-uri-%s" % get_hexdigest(url, 12)
+        # Keep the quotes of the reference, the URI may contain the others.
+        properties.append("%s:%s" % (name, format_reference(repeated[0])))
+        replacements.extend((reference, "var(%s)" % name) for reference in repeated)
+    if not properties:
+        return content
+    parts = []
+    position = 0
+    for reference, text in sorted(replacements, key=lambda item: item[0].start):
+        parts.extend((content[position : reference.start], text))
+        position = reference.end
+    parts.append(content[position:])
+    parts.append("\n:root{%s}\n" % ";".join(properties))
+    return "".join(parts)
+
+
+class CssDataUriDedupFilter(CssDataUriFilter):
+    """
+    ``CssDataUriFilter`` that stores each data URI repeated in the output
+    once, in a CSS custom property, see COMPRESS_DATA_URI_DEDUP_MIN_SIZE.
+    """
+
+    reusable = True
+
+    def output(self, **kwargs):
+        return dedup_data_uris(self.content, settings.COMPRESS_DATA_URI_DEDUP_MIN_SIZE)
@@ -6,6 +6,8 @@ from compressor.filters import FilterBase, CallbackOutputFilter
 class rJSMinFilter(CallbackOutputFilter):
     callback = "rjsmin.jsmin"
     dependencies = ["rjsmin"]
+    reusable = True
+    streamable = True
     kwargs = {"keep_bang_comments": True}
 
 
@@ -14,6 +16,8 @@ JSMinFilter = rJSMinFilter
 
 
 class CalmjsFilter(FilterBase):
+    reusable = True
+
     def __init__(self, *args, **kwargs):
         try:
             self._parser = kwargs.pop("parser")
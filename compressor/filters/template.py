@@ -5,6 +5,8 @@ from compressor.filters import FilterBase
 
 
 class TemplateFilter(FilterBase):
+    reusable = True
+
     def input(self, filename=None, basename=None, **kwargs):
         template = Template(self.content)
         context = Context(settings.COMPRESS_TEMPLATE_FILTER_CONTEXT)
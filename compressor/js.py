@@ -10,7 +10,13 @@ class JsCompressor(Compressor):
         if self.split_content:
             return self.split_content
         self.extra_nodes = []
-        for elem in self.parser.js_elems():
+        elems = list(self.parser.js_elems())
+        self.prefetch_filenames(
+            self.parser.elem_attribs(elem)["src"]
+            for elem in elems
+            if "src" in self.parser.elem_attribs(elem)
+        )
+        for elem in elems:
             attribs = self.parser.elem_attribs(elem)
             if "src" in attribs:
                 basename = self.get_basename(attribs["src"])
@@ -50,12 +56,11 @@ class JsCompressor(Compressor):
                 return "\n".join(ret)
         return super().output(*args, **kwargs)
 
-    def filter_input(self, forced=False):
+    def iter_input(self, forced=False):
         """
-        Passes each hunk (file or code) to the 'input' methods
+        Yields each hunk (file or code) passed to the 'input' methods
         of the compressor filters.
         """
-        content = []
         for hunk in self.hunks(forced):
             # If a file ends with a function call, say, console.log()
             # but doesn't have a semicolon, and the next file starts with
@@ -64,5 +69,4 @@ class JsCompressor(Compressor):
             # Forcing a semicolon in between fixes it.
             if settings.COMPRESS_ENABLED or forced:
                 hunk += ";"
-            content.append(hunk)
-        return content
+            yield hunk
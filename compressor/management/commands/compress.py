@@ -1,4 +1,6 @@
 # flake8: noqa
+import io
+import multiprocessing
 import os
 import sys
 import concurrent.futures
@@ -22,6 +24,8 @@ from compressor.cache import (
     get_offline_hexdigest,
     write_offline_manifest,
     get_offline_manifest,
+    get_offline_state,
+    write_offline_state,
 )
 from compressor.conf import settings
 from compressor.exceptions import (
@@ -29,10 +33,61 @@ from compressor.exceptions import (
     TemplateSyntaxError,
     TemplateDoesNotExist,
 )
+from compressor.offline.incremental import IncrementalState, get_settings_fingerprint
 from compressor.utils import get_mod_func
 
 offline_manifest_lock = Lock()
 
+# The command, parser, templates, contexts, incremental state, verbosity and
+# the keys claimed by the shards, inherited by the worker processes of the
+# process executor.
+_process_state = None
+# The index of the shard the worker process is compressing.
+_process_shard = None
+
+
+def _init_process(*state):
+    global _process_state
+    _process_state = state
+
+
+def _claim_key(key):
+    """
+    Returns whether the shard of this worker process compresses the block
+    with the given key, i.e. no other shard claimed it first, so that the
+    output file is only written once. Always true outside of the workers.
+    """
+    if _process_state is None:
+        return True
+    claims = _process_state[-1]
+    return claims.setdefault(key, _process_shard) == _process_shard
+
+
+def _compress_in_process(shard, items):
+    """
+    Compresses the given (context index, template index) pairs in a worker
+    process and returns the picklable results.
+    """
+    global _process_shard
+    _process_shard = shard
+    command, parser, templates, contexts, state, verbosity, claims = _process_state
+    log = io.StringIO()
+    work = [
+        (contexts[context_index], templates[template_index])
+        for context_index, template_index in items
+    ]
+    offline_manifest = OrderedDict()
+    errors = []
+    nodes_count = command.compress_templates(
+        parser, work, offline_manifest, errors, state, log, verbosity, 1
+    )
+    shard_state = {}
+    if state is not None:
+        for template_index in set(template_index for _, template_index in items):
+            name = templates[template_index].template_name
+            shard_state[name] = state.templates.get(name)
+    return dict(offline_manifest), nodes_count, errors, log.getvalue(), shard_state
+
 
 class Command(BaseCommand):
     help = "Compress content outside of the request/response cycle"
@@ -77,6 +132,31 @@ class Command(BaseCommand):
             "multiple engines. If not specified, django engine is used.",
             dest="engines",
         )
+        parser.add_argument(
+            "--workers",
+            default=4,
+            type=int,
+            help="The number of threads or processes compressing the "
+            "templates (default: 4).",
+            dest="workers",
+        )
+        parser.add_argument(
+            "--executor",
+            default="thread",
+            choices=["thread", "process"],
+            help="Compress the templates in threads (the default) or in "
+            "worker processes, which scales better with the number of CPUs.",
+            dest="executor",
+        )
+        parser.add_argument(
+            "--incremental",
+            default=False,
+            action="store_true",
+            help="Only render templates that changed since the last run "
+            "with this option (or whose linked files changed) and reuse "
+            "the offline manifest entries of the others.",
+            dest="incremental",
+        )
 
     def get_loaders(self):
         template_source_loaders = []
@@ -123,13 +203,29 @@ class Command(BaseCommand):
 
         return parser
 
-    def compress(self, engine, extensions, verbosity, follow_links, log):
+    def compress(
+        self,
+        engine,
+        extensions,
+        verbosity,
+        follow_links,
+        log,
+        state=None,
+        workers=4,
+        executor="thread",
+    ):
         """
         Searches templates containing 'compress' nodes and compresses them
         "offline" -- outside of the request/response cycle.
 
         The result is cached with a cache-key derived from the content of the
         compress nodes (not the content of the possibly linked files!).
+
+        If an ``IncrementalState`` is given, unchanged templates reuse the
+        entries of the current offline manifest instead.
+
+        The blocks are compressed by ``workers`` threads, or processes if
+        ``executor`` is ``"process"``.
         """
 
         if not self.get_loaders():
@@ -248,46 +344,63 @@ class Command(BaseCommand):
         offline_manifest = OrderedDict()
         errors = []
 
-        for context_dict in contexts:
-            compressor_nodes = OrderedDict()
+        if state is not None:
+            contexts = list(contexts)
+            state.start(get_settings_fingerprint(engine, contexts))
+            previous_manifest = get_offline_manifest()
+            changed_templates = []
             for template in fine_templates:
-                context = Context(parser.get_init_context(context_dict))
-
-                try:
-                    nodes = list(parser.walk_nodes(template, context=context))
-                except (TemplateDoesNotExist, TemplateSyntaxError) as e:
-                    # Could be an error in some base template
-                    if verbosity >= 1:
-                        log.write(
-                            "Error parsing template %s: %s\n"
-                            % (template.template_name, smart_str(e))
-                        )
+                entries = state.reuse(parser, template, previous_manifest)
+                if entries is None:
+                    changed_templates.append(template)
                     continue
-
-                if nodes:
-                    template_nodes = compressor_nodes.setdefault(
-                        template, OrderedDict()
-                    )
-                    for node in nodes:
-                        nodes_count += 1
-                        template_nodes.setdefault(node, []).append(context)
-
-            pool = concurrent.futures.ThreadPoolExecutor(max_workers=4)
-            for template, nodes in compressor_nodes.items():
-                template._log = log
-                template._log_verbosity = verbosity
-
-                pool.submit(
-                    self._compress_template,
-                    offline_manifest,
-                    nodes,
-                    parser,
-                    template,
-                    errors,
+                offline_manifest.update(entries)
+                nodes_count += state.templates[template.template_name]["nodes"]
+            if verbosity >= 1:
+                log.write(
+                    "(%d of %d template(s) changed) "
+                    % (len(changed_templates), len(fine_templates))
                 )
-
-            pool.shutdown(wait=True)
-            contexts_count += 1
+            fine_templates = changed_templates
+
+        contexts = list(contexts)
+        contexts_count = len(contexts)
+        # Templates that are the same for every context are only compressed
+        # for the first one.
+        static_templates = set()
+        if len(contexts) > 1:
+            static_templates = set(
+                template_index
+                for template_index, template in enumerate(fine_templates)
+                if self.is_static_template(parser, template, contexts[0])
+            )
+        items = [
+            (context_index, template_index)
+            for context_index in range(len(contexts))
+            for template_index in range(len(fine_templates))
+            if not context_index or template_index not in static_templates
+        ]
+        if executor == "process":
+            nodes_count += self.compress_in_processes(
+                parser,
+                fine_templates,
+                contexts,
+                items,
+                offline_manifest,
+                errors,
+                state,
+                log,
+                verbosity,
+                workers,
+            )
+        else:
+            work = [
+                (contexts[context_index], fine_templates[template_index])
+                for context_index, template_index in items
+            ]
+            nodes_count += self.compress_templates(
+                parser, work, offline_manifest, errors, state, log, verbosity, workers
+            )
 
         # If errors exist, raise the first one in the list
         if errors:
@@ -306,8 +419,171 @@ class Command(BaseCommand):
             )
         return offline_manifest, len(offline_manifest), offline_manifest.values()
 
+    def compress_templates(
+        self, parser, work, offline_manifest, errors, state, log, verbosity, workers
+    ):
+        """
+        Compresses the ``(context_dict, template)`` pairs of ``work`` with a
+        single pool of ``workers`` threads shared by all offline contexts,
+        so that a slow template doesn't hold up the next context. Blocks
+        that render to the same key are only compressed once. Returns the
+        number of nodes found.
+
+        Static blocks (see ``is_static_node`` of the parsers) are rendered
+        and compressed for one context only.
+        """
+        static_nodes = set()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [
+                pool.submit(
+                    self._compress_context_template,
+                    offline_manifest,
+                    parser,
+                    context_dict,
+                    template,
+                    errors,
+                    state,
+                    log,
+                    verbosity,
+                    static_nodes,
+                )
+                for context_dict, template in work
+            ]
+        return sum(future.result() for future in futures)
+
+    def _compress_context_template(
+        self,
+        offline_manifest,
+        parser,
+        context_dict,
+        template,
+        errors,
+        state,
+        log,
+        verbosity,
+        static_nodes,
+    ):
+        context = Context(parser.get_init_context(context_dict))
+
+        try:
+            nodes = list(parser.walk_nodes(template, context=context))
+        except (TemplateDoesNotExist, TemplateSyntaxError) as e:
+            # Could be an error in some base template
+            if verbosity >= 1:
+                log.write(
+                    "Error parsing template %s: %s\n"
+                    % (template.template_name, smart_str(e))
+                )
+            if state is not None:
+                state.discard(template)
+            return 0
+
+        if state is not None:
+            state.add_nodes(template, len(nodes))
+        if nodes:
+            template._log = log
+            template._log_verbosity = verbosity
+            template_nodes = OrderedDict()
+            for node in nodes:
+                if parser.is_static_node(node):
+                    key = (template.template_name, parser.get_static_node_key(node))
+                    with offline_manifest_lock:
+                        if key in static_nodes:
+                            continue
+                        static_nodes.add(key)
+                template_nodes.setdefault(node, []).append(context)
+            self._compress_template(
+                offline_manifest, template_nodes, parser, template, errors, state
+            )
+        return len(nodes)
+
+    def is_static_template(self, parser, template, context_dict):
+        """
+        Returns whether the compress blocks of the template are found and
+        rendered the same way for every offline context, i.e. it doesn't
+        extend or include templates given by variables and all its blocks
+        are static.
+        """
+        if parser.get_template_sources(template) is None:
+            return False
+        context = Context(parser.get_init_context(context_dict))
+        try:
+            nodes = parser.walk_nodes(template, context=context)
+            return all(parser.is_static_node(node) for node in nodes)
+        except (TemplateDoesNotExist, TemplateSyntaxError):
+            return False
+
+    def compress_in_processes(
+        self,
+        parser,
+        templates,
+        contexts,
+        items,
+        offline_manifest,
+        errors,
+        state,
+        log,
+        verbosity,
+        workers,
+    ):
+        """
+        Shards the (context index, template index) pairs of ``items`` by
+        template across ``workers`` forked processes and merges their
+        results in a deterministic order. Blocks rendering to the same key
+        in several templates are only compressed by the first shard that
+        claims the key. Returns the number of nodes found.
+        """
+        try:
+            mp_context = multiprocessing.get_context("fork")
+        except ValueError:
+            raise CommandError(
+                "The process executor requires the 'fork' start method, "
+                "which isn't available on this platform."
+            )
+        template_items = OrderedDict()
+        for context_index, template_index in items:
+            template_items.setdefault(template_index, []).append(
+                (context_index, template_index)
+            )
+        shards = [[] for i in range(workers)]
+        for i, template_index in enumerate(sorted(template_items)):
+            shards[i % workers].extend(template_items[template_index])
+        shards = [shard for shard in shards if shard]
+        with mp_context.Manager() as manager:
+            claims = manager.dict()
+            with concurrent.futures.ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=mp_context,
+                initializer=_init_process,
+                initargs=(self, parser, templates, contexts, state, verbosity, claims),
+            ) as pool:
+                results = list(
+                    pool.map(_compress_in_process, range(len(shards)), shards)
+                )
+
+        nodes_count = 0
+        manifest = {}
+        for result in results:
+            shard_manifest, shard_nodes_count, shard_errors, shard_log, shard_state = (
+                result
+            )
+            for key, value in shard_manifest.items():
+                if value is not None:
+                    manifest.setdefault(key, value)
+            nodes_count += shard_nodes_count
+            errors.extend(shard_errors)
+            log.write(shard_log)
+            if state is not None:
+                for template_name, entry in shard_state.items():
+                    state.merge(template_name, entry)
+        for key in sorted(manifest):
+            offline_manifest.setdefault(key, manifest[key])
+        return nodes_count
+
     @staticmethod
-    def _compress_template(offline_manifest, nodes, parser, template, errors):
+    def _compress_template(
+        offline_manifest, nodes, parser, template, errors, state=None
+    ):
         for node, node_contexts in nodes.items():
             for context in node_contexts:
                 context.push()
@@ -317,6 +593,8 @@ class Command(BaseCommand):
                 parser.process_node(template, context, node)
                 rendered = parser.render_nodelist(template, context, node)
                 key = get_offline_hexdigest(rendered)
+                if state is not None:
+                    state.add_key(template, key, rendered)
 
                 # Atomically check if the key exists in offline manifest.
                 # If it doesn't, set a placeholder key (None). This is to prevent
@@ -325,6 +603,9 @@ class Command(BaseCommand):
                 with offline_manifest_lock:
                     if key in offline_manifest:
                         continue
+                    if not _claim_key(key):
+                        # Compressed by another worker process.
+                        continue
 
                     offline_manifest[key] = None
 
@@ -387,16 +668,37 @@ class Command(BaseCommand):
         follow_links = options.get("follow_links", False)
         extensions = self.handle_extensions(options.get("extensions") or ["html"])
         engines = [e.strip() for e in options.get("engines", [])] or ["django"]
+        incremental = options.get("incremental", False)
+        workers = options.get("workers") or 4
+        executor = options.get("executor") or "thread"
+        if workers < 1:
+            raise CommandError("--workers must be at least 1.")
+        previous_state = get_offline_state() if incremental else {}
+        offline_state = {}
 
         final_offline_manifest = {}
         final_block_count = 0
         final_results = []
         for engine in engines:
+            state = None
+            if incremental:
+                state = IncrementalState(previous_state.get(engine))
             offline_manifest, block_count, results = self.compress(
-                engine, extensions, verbosity, follow_links, log
+                engine,
+                extensions,
+                verbosity,
+                follow_links,
+                log,
+                state=state,
+                workers=workers,
+                executor=executor,
             )
             final_results.extend(results)
             final_block_count += block_count
             final_offline_manifest.update(offline_manifest)
+            if state is not None:
+                offline_state[engine] = state.dump()
         write_offline_manifest(final_offline_manifest)
+        if incremental:
+            write_offline_state(offline_state)
         return final_block_count, final_results
@@ -0,0 +1,126 @@
+import fnmatch
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from compressor.base import Compressor
+from compressor.cache import delete_indexed_filenames
+from compressor.conf import settings
+from compressor.exceptions import UncompressableFileError
+from compressor.utils import staticfiles
+
+
+class Command(BaseCommand):
+    help = "Add or remove the full paths of all static files from the filename index"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "-i",
+            "--ignore",
+            action="append",
+            default=[],
+            dest="ignore_patterns",
+            metavar="PATTERN",
+            help="Ignore files or directories matching this glob-style "
+            "pattern. Use multiple times to ignore more.",
+        ),
+        parser.add_argument(
+            "--no-default-ignore",
+            action="store_false",
+            dest="use_default_ignore_patterns",
+            default=True,
+            help="Don't ignore the common private glob-style patterns 'CVS', "
+            "'.*' and '*~'.",
+        ),
+        parser.add_argument(
+            "--follow-links",
+            dest="follow_links",
+            action="store_true",
+            help="Follow symlinks when traversing the COMPRESS_ROOT "
+            "(which defaults to STATIC_ROOT). Be aware that using this "
+            "can lead to infinite recursion if a link points to a parent "
+            "directory of itself.",
+        ),
+        parser.add_argument(
+            "-c", "--clean", dest="clean", action="store_true", help="Remove all items"
+        ),
+        parser.add_argument(
+            "-a", "--add", dest="add", action="store_true", help="Add all items"
+        ),
+
+    def is_ignored(self, path):
+        """
+        Return True or False depending on whether the ``path`` should be
+        ignored (if it matches any pattern in ``ignore_patterns``).
+        """
+        for pattern in self.ignore_patterns:
+            if fnmatch.fnmatchcase(path, pattern):
+                return True
+        return False
+
+    def get_basenames(self, follow_links):
+        """
+        Returns the basenames of all files in COMPRESS_ROOT and those
+        found by the staticfiles finders, relative to COMPRESS_URL.
+        """
+        basenames = set()
+        output_dir = settings.COMPRESS_OUTPUT_DIR.strip("/")
+        for root, dirs, files in os.walk(
+            settings.COMPRESS_ROOT, followlinks=follow_links
+        ):
+            common = os.path.relpath(root, settings.COMPRESS_ROOT)
+            if common == os.curdir:
+                common = ""
+                # Skip the compressor's own output files.
+                if output_dir in dirs:
+                    dirs.remove(output_dir)
+            dirs[:] = [dir_ for dir_ in dirs if not self.is_ignored(dir_)]
+            for filename in files:
+                path = os.path.join(common, filename)
+                if not self.is_ignored(path):
+                    basenames.add(path.replace(os.sep, "/"))
+        if staticfiles.finders:
+            for finder in staticfiles.finders.get_finders():
+                for path, storage in finder.list(self.ignore_patterns):
+                    prefix = getattr(storage, "prefix", None)
+                    if prefix:
+                        path = os.path.join(prefix, path)
+                    basenames.add(path.replace(os.sep, "/"))
+        return basenames
+
+    def handle(self, **options):
+        ignore_patterns = options["ignore_patterns"]
+        if options["use_default_ignore_patterns"]:
+            ignore_patterns += ["CVS", ".*", "*~"]
+            options["ignore_patterns"] = ignore_patterns
+        self.ignore_patterns = ignore_patterns
+
+        if (options["add"] and options["clean"]) or (
+            not options["add"] and not options["clean"]
+        ):
+            raise CommandError('Please specify either "--add" or "--clean"')
+
+        if not settings.COMPRESS_FILENAME_INDEX:
+            raise CommandError(
+                "The filename index is currently disabled. Please "
+                "set the COMPRESS_FILENAME_INDEX setting to True."
+            )
+
+        basenames = self.get_basenames(options["follow_links"])
+
+        if basenames:
+            delete_indexed_filenames(basenames)
+            self.stdout.write(
+                "Deleted %d files from the filename index." % len(basenames)
+            )
+
+        if options["add"]:
+            compressor = Compressor("css", filters=[])
+            added = 0
+            for basename in sorted(basenames):
+                try:
+                    compressor.get_filename(basename)
+                except UncompressableFileError:
+                    continue
+                added += 1
+            self.stdout.write("Added %d files to the filename index." % added)
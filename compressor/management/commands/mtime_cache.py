@@ -4,7 +4,7 @@ import os
 from django.core.management.base import BaseCommand, CommandError
 
 from compressor.conf import settings
-from compressor.cache import cache, get_mtime, get_mtime_cachekey
+from compressor.cache import cache, get_mtime_cachekey, get_mtimes
 
 
 class Command(BaseCommand):
@@ -100,6 +100,5 @@ class Command(BaseCommand):
             )
 
         if files_to_add:
-            for filename in files_to_add:
-                get_mtime(filename)
+            get_mtimes(files_to_add)
             self.stdout.write("Added mtimes of %d files to cache." % len(files_to_add))
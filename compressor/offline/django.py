@@ -10,6 +10,7 @@ from django.template.loader_tags import (
     ExtendsNode,
     BlockNode,
     BlockContext,
+    IncludeNode,
 )
 
 
@@ -113,9 +114,54 @@ class DjangoParser:
     def process_template(self, template, context):
         return True
 
+    def get_template_sources(self, template):
+        """
+        Returns a dict of the names and sources of the template and all
+        templates it extends or includes, or ``None`` if some of them are
+        given by variables or can't be loaded.
+        """
+        sources = {}
+        pending = [template]
+        while pending:
+            template = pending.pop()
+            name = template.origin.name
+            if name in sources:
+                continue
+            sources[name] = template.source
+            for node in template.nodelist.get_nodes_by_type((ExtendsNode, IncludeNode)):
+                if isinstance(node, ExtendsNode):
+                    filter_expression = node.parent_name
+                else:
+                    filter_expression = node.template
+                if filter_expression.filters or not isinstance(
+                    filter_expression.var, str
+                ):
+                    return None
+                try:
+                    pending.append(self.parse(filter_expression.var))
+                except (TemplateSyntaxError, TemplateDoesNotExist):
+                    return None
+        return sources
+
     def get_init_context(self, offline_context):
         return offline_context
 
+    def is_static_node(self, node):
+        """
+        Returns whether the compress block renders to the same content in
+        every context, see ``CompressorNode.is_static``.
+        """
+        return getattr(node, "is_static", False)
+
+    def get_static_node_key(self, node):
+        """
+        Identifies a static compress block, including its copies made when
+        expanding ``{% extends %}``, which share the child nodes.
+        """
+        return (node.kind, node.mode, node.name) + tuple(
+            id(child) for child in node.nodelist
+        )
+
     def process_node(self, template, context, node):
         pass
 
@@ -0,0 +1,188 @@
+import hashlib
+import json
+import re
+import threading
+
+from compressor.cache import get_hexdigest
+from compressor.conf import settings
+from compressor.exceptions import UncompressableFileError
+from compressor.storage import default_storage
+from compressor.utils import get_class
+
+
+def get_settings_fingerprint(engine, contexts):
+    """
+    Returns a hash of the settings and offline contexts used to compress the
+    templates of the given engine.
+    """
+    compress_settings = dict(
+        (name, getattr(settings, name))
+        for name in dir(settings)
+        if name.startswith("COMPRESS_") and not callable(getattr(settings, name))
+    )
+    compress_settings["COMPRESSORS"] = settings.COMPRESSORS
+    compress_settings["STATIC_URL"] = str(settings.STATIC_URL)
+    return get_hexdigest(
+        json.dumps(
+            [engine, compress_settings, list(contexts)], sort_keys=True, default=repr
+        )
+    )
+
+
+def get_file_hash(filename):
+    digest = hashlib.sha256()
+    with open(filename, "rb") as file:
+        for chunk in iter(lambda: file.read(65536), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class IncrementalState:
+    """
+    The state of an incremental run of the ``compress`` management command
+    for one template engine.
+
+    For every template it remembers a fingerprint of its source and the
+    sources of the templates it extends or includes, the keys of the offline
+    manifest its compress blocks rendered to, and hashes of the files linked
+    in those blocks. Templates whose fingerprint and files didn't change
+    since the previous run reuse their entries of the previous manifest
+    instead of being rendered again.
+    """
+
+    def __init__(self, previous=None):
+        self.previous = previous or {}
+        self.fingerprint = None
+        self.templates = {}
+        self._file_hashes = {}
+        self._key_files = {}
+        self._lock = threading.Lock()
+
+    def start(self, fingerprint):
+        """
+        Sets the settings fingerprint of this run, previous runs with other
+        settings or offline contexts can't be reused.
+        """
+        self.fingerprint = fingerprint
+        if self.previous.get("fingerprint") != fingerprint:
+            self.previous = {}
+
+    def dump(self):
+        return {
+            "fingerprint": self.fingerprint,
+            "templates": self.templates,
+        }
+
+    def get_file_hash(self, filename):
+        if filename not in self._file_hashes:
+            try:
+                self._file_hashes[filename] = get_file_hash(filename)
+            except OSError:
+                self._file_hashes[filename] = None
+        return self._file_hashes[filename]
+
+    def get_template_fingerprint(self, parser, template):
+        sources = parser.get_template_sources(template)
+        if sources is None:
+            return None
+        return get_hexdigest(json.dumps(sorted(sources.items(), key=repr)))
+
+    def output_files_exist(self, result):
+        """
+        Checks that the files a manifest entry links to are still in the
+        storage.
+        """
+        pattern = r"%s([^\"'\s>]+)" % re.escape(settings.COMPRESS_URL_PLACEHOLDER)
+        return all(
+            default_storage.exists(name) for name in re.findall(pattern, result)
+        )
+
+    def reuse(self, parser, template, manifest):
+        """
+        Returns the entries of the previous ``manifest`` for the template if
+        it didn't change, otherwise ``None``. Either way the template's new
+        fingerprint is recorded.
+        """
+        fingerprint = self.get_template_fingerprint(parser, template)
+        if fingerprint is None:
+            return None
+        name = template.template_name
+        self.templates[name] = {
+            "fingerprint": fingerprint,
+            "nodes": 0,
+            "keys": [],
+            "files": {},
+        }
+        previous = self.previous.get("templates", {}).get(name)
+        if previous is None or previous["fingerprint"] != fingerprint:
+            return None
+        if any(
+            self.get_file_hash(filename) != file_hash
+            for filename, file_hash in previous["files"].items()
+        ):
+            return None
+        entries = {}
+        for key in previous["keys"]:
+            if key not in manifest or not self.output_files_exist(manifest[key]):
+                return None
+            entries[key] = manifest[key]
+        self.templates[name] = previous
+        return entries
+
+    def discard(self, template):
+        """
+        Forgets a template that couldn't be processed.
+        """
+        with self._lock:
+            self.templates.pop(template.template_name, None)
+
+    def merge(self, template_name, entry):
+        """
+        Merges the entry of a template recorded by a worker process, which
+        is ``None`` if it discarded the template.
+        """
+        if template_name not in self.templates:
+            return
+        if entry is None:
+            del self.templates[template_name]
+            return
+        own_entry = self.templates[template_name]
+        own_entry["nodes"] += entry["nodes"]
+        for key in entry["keys"]:
+            if key not in own_entry["keys"]:
+                own_entry["keys"].append(key)
+        own_entry["files"].update(entry["files"])
+
+    def add_nodes(self, template, count):
+        with self._lock:
+            entry = self.templates.get(template.template_name)
+            if entry is not None:
+                entry["nodes"] += count
+
+    def add_key(self, template, key, rendered):
+        """
+        Records that a compress block of the template rendered to ``key``
+        with the given original content.
+        """
+        with self._lock:
+            entry = self.templates.get(template.template_name)
+            if entry is None:
+                return
+            if key not in entry["keys"]:
+                entry["keys"].append(key)
+            if key not in self._key_files:
+                self._key_files[key] = self.get_linked_files(rendered)
+            for filename in self._key_files[key]:
+                entry["files"][filename] = self.get_file_hash(filename)
+
+    def get_linked_files(self, rendered):
+        filenames = []
+        for kind, compressor in settings.COMPRESSORS.items():
+            compressor = get_class(compressor)(kind, rendered)
+            try:
+                filenames.extend(compressor.filenames)
+                filenames.extend(compressor.referenced_filenames)
+                filenames.extend(compressor.asset_filenames)
+            except UncompressableFileError:
+                continue
+        return filenames
@@ -2,6 +2,7 @@ import io
 
 import jinja2
 import jinja2.ext
+import jinja2.meta
 from jinja2 import nodes
 from jinja2.ext import Extension
 from jinja2.nodes import CallBlock, Call, ExtensionAttribute
@@ -69,18 +70,42 @@ class Jinja2Parser:
 
     def parse(self, template_name):
         with io.open(template_name, mode="rb") as file:
+            source = file.read().decode(self.charset)
             try:
-                template = self.env.parse(file.read().decode(self.charset))
+                template = self.env.parse(source)
             except jinja2.TemplateSyntaxError as e:
                 raise TemplateSyntaxError(str(e))
             except jinja2.TemplateNotFound as e:
                 raise TemplateDoesNotExist(str(e))
 
+        template.source = source
         return template
 
     def process_template(self, template, context):
         return True
 
+    def get_template_sources(self, template):
+        """
+        Returns a dict of the names and sources of the template and all
+        templates it extends, includes or imports, or ``None`` if some of
+        them are given by variables or can't be loaded.
+        """
+        sources = {getattr(template, "template_name", None): template.source}
+        pending = [template]
+        while pending:
+            for name in jinja2.meta.find_referenced_templates(pending.pop()):
+                if name is None:
+                    return None
+                if name in sources:
+                    continue
+                try:
+                    source = self.env.loader.get_source(self.env, name)[0]
+                    pending.append(self.env.parse(source))
+                except (jinja2.TemplateNotFound, jinja2.TemplateSyntaxError):
+                    return None
+                sources[name] = source
+        return sources
+
     def get_init_context(self, offline_context):
         # Don't need to add filters and tests to the context, as Jinja2 will
         # automatically look for them in self.env.filters and self.env.tests.
@@ -95,6 +120,21 @@ class Jinja2Parser:
     def process_node(self, template, context, node):
         pass
 
+    def is_static_node(self, node):
+        """
+        Returns whether the compress block renders to the same content in
+        every context, i.e. it only consists of template data and has
+        constant arguments.
+        """
+        return all(isinstance(arg, nodes.Const) for arg in node.call.args) and all(
+            isinstance(child, nodes.Output)
+            and all(isinstance(data, nodes.TemplateData) for data in child.nodes)
+            for child in node.body
+        )
+
+    def get_static_node_key(self, node):
+        return id(node)
+
     def _render_nodes(self, template, context, nodes):
         compiled_node = self.env.compile(jinja2.nodes.Template(nodes))
         template = jinja2.Template.from_code(self.env, compiled_node, {})
@@ -0,0 +1,125 @@
+import json
+import mmap
+import struct
+from collections.abc import Mapping
+
+
+class JsonManifest:
+    """
+    Stores the offline manifest as an indented JSON object, parsed into a
+    dict when loaded.
+    """
+
+    def load(self, storage, name):
+        with storage.open(name) as fp:
+            return json.loads(fp.read().decode("utf8"))
+
+    def dumps(self, manifest):
+        return json.dumps(manifest, indent=2).encode("utf8")
+
+
+class BinaryManifestReader(Mapping):
+    """
+    A read-only mapping over the content of a binary manifest.
+
+    Only the header is read when it's created, keys are looked up with a
+    binary search over the index and values are decoded when accessed.
+    """
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        if bytes(buffer[: len(BinaryManifest.magic)]) != BinaryManifest.magic:
+            raise ValueError("Not a binary offline manifest")
+        (self.count,) = BinaryManifest.header.unpack_from(
+            buffer, len(BinaryManifest.magic)
+        )
+        self.index_offset = len(BinaryManifest.magic) + BinaryManifest.header.size
+
+    def get_entry(self, position):
+        return BinaryManifest.entry.unpack_from(
+            self.buffer, self.index_offset + position * BinaryManifest.entry.size
+        )
+
+    def get_key(self, position):
+        key_offset, key_length, _, _ = self.get_entry(position)
+        return bytes(self.buffer[key_offset : key_offset + key_length])
+
+    def find(self, key):
+        """
+        Returns the position of ``key`` in the index or ``None``.
+        """
+        if not isinstance(key, str):
+            return None
+        key = key.encode("utf8")
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.get_key(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.count and self.get_key(low) == key:
+            return low
+        return None
+
+    def __getitem__(self, key):
+        position = self.find(key)
+        if position is None:
+            raise KeyError(key)
+        _, _, value_offset, value_length = self.get_entry(position)
+        return bytes(self.buffer[value_offset : value_offset + value_length]).decode(
+            "utf8"
+        )
+
+    def __contains__(self, key):
+        return self.find(key) is not None
+
+    def __iter__(self):
+        for position in range(self.count):
+            yield self.get_key(position).decode("utf8")
+
+    def __len__(self):
+        return self.count
+
+
+class BinaryManifest:
+    """
+    Stores the offline manifest as a sorted index of keys followed by the
+    keys and values, loaded lazily.
+
+    When the storage has local paths the file is memory-mapped read-only, so
+    forked processes share its pages instead of each holding a parsed copy.
+    """
+
+    magic = b"COMPRESS-MANIFEST\x01"
+    # number of entries
+    header = struct.Struct("<I")
+    # key offset, key length, value offset, value length
+    entry = struct.Struct("<QIQI")
+
+    def load(self, storage, name):
+        try:
+            path = storage.path(name)
+        except NotImplementedError:
+            with storage.open(name) as fp:
+                return BinaryManifestReader(fp.read())
+        with open(path, "rb") as fp:
+            return BinaryManifestReader(
+                mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+            )
+
+    def dumps(self, manifest):
+        items = sorted(
+            (key.encode("utf8"), value.encode("utf8"))
+            for key, value in manifest.items()
+        )
+        index = []
+        data = []
+        offset = len(self.magic) + self.header.size + len(items) * self.entry.size
+        for key, value in items:
+            index.append(
+                self.entry.pack(offset, len(key), offset + len(key), len(value))
+            )
+            data.extend((key, value))
+            offset += len(key) + len(value)
+        return b"".join([self.magic, self.header.pack(len(items))] + index + data)
@@ -1,14 +1,21 @@
-import gzip
+import logging
 import os
-from datetime import datetime
+import tempfile
+import threading
 import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from urllib.parse import urljoin
 
+from django.core.exceptions import ImproperlyConfigured
 from django.core.files.storage import FileSystemStorage, get_storage_class
 from django.utils.functional import LazyObject, SimpleLazyObject
 
 from compressor.conf import settings
 
+logger = logging.getLogger("compressor.storage")
+
 
 class CompressorFileStorage(FileSystemStorage):
     """
@@ -52,62 +59,195 @@ compressor_file_storage = SimpleLazyObject(
 )
 
 
-class GzipCompressorFileStorage(CompressorFileStorage):
+_precompress_executor = None
+_precompress_executor_lock = threading.Lock()
+
+
+def get_precompress_executor(max_workers):
     """
-    File system storage that stores gzipped files in addition to the usual files.
+    Returns the thread pool writing precompressed variants in the background,
+    see COMPRESS_PRECOMPRESS_WORKERS.
     """
+    global _precompress_executor
+    with _precompress_executor_lock:
+        # Threads don't survive a fork, never reuse a parent's pool.
+        key = (max_workers, os.getpid())
+        if _precompress_executor is None or _precompress_executor[0] != key:
+            executor = ThreadPoolExecutor(
+                max_workers=max_workers, thread_name_prefix="compressor-precompress"
+            )
+            _precompress_executor = (key, executor)
+        return _precompress_executor[1]
 
-    def save(self, filename, content):
-        filename = super().save(filename, content)
-        orig_path = self.path(filename)
-        compressed_path = "%s.gz" % orig_path
 
-        with open(orig_path, "rb") as f_in, open(compressed_path, "wb") as f_out:
-            with gzip.GzipFile(fileobj=f_out, mode="wb") as gz_out:
-                gz_out.write(f_in.read())
+class BrotliEncoder:
+    def __init__(self, level):
+        import brotli
 
-        # Ensure the file timestamps match.
-        # os.stat() returns nanosecond resolution on Linux, but os.utime()
-        # only sets microsecond resolution.  Set times on both files to
-        # ensure they are equal.
-        stamp = time.time()
-        os.utime(orig_path, (stamp, stamp))
-        os.utime(compressed_path, (stamp, stamp))
+        self.compressor = brotli.Compressor(quality=level)
 
-        return filename
+    def compress(self, data):
+        return self.compressor.process(data)
+
+    def flush(self):
+        return self.compressor.finish()
 
 
-class BrotliCompressorFileStorage(CompressorFileStorage):
+def get_gzip_encoder(level):
+    # A gzip container without file name and modification time.
+    return zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+
+def get_zstd_encoder(level):
+    import zstandard
+
+    return zstandard.ZstdCompressor(level=level).compressobj()
+
+
+class PrecompressedCompressorFileStorage(CompressorFileStorage):
     """
-    File system storage that stores brotli files in addition to the usual files.
+    File system storage that stores gzip, brotli and zstd compressed variants
+    in addition to the usual files.
+
+    The variants are encoded in a single pass over the content, see
+    COMPRESS_PRECOMPRESS_FORMATS, COMPRESS_PRECOMPRESS_LEVELS,
+    COMPRESS_PRECOMPRESS_MIN_SIZE and COMPRESS_PRECOMPRESS_WORKERS.
     """
 
-    chunk_size = 1024
+    # format: (file extension, encoder factory, default level)
+    encoders = {
+        "gzip": ("gz", get_gzip_encoder, 9),
+        "brotli": ("br", BrotliEncoder, 11),
+        "zstd": ("zst", get_zstd_encoder, 19),
+    }
+    # the formats to write, None for COMPRESS_PRECOMPRESS_FORMATS
+    formats = None
+    chunk_size = 64 * 1024
+
+    def get_formats(self):
+        formats = self.formats
+        if formats is None:
+            formats = settings.COMPRESS_PRECOMPRESS_FORMATS
+        unknown = [format for format in formats if format not in self.encoders]
+        if unknown:
+            raise ImproperlyConfigured(
+                "Unknown precompress format(s) %s, the supported formats are %s."
+                % (", ".join(map(repr, unknown)), ", ".join(sorted(self.encoders)))
+            )
+        return formats
 
     def save(self, filename, content):
         filename = super().save(filename, content)
-        orig_path = self.path(filename)
-        compressed_path = "%s.br" % orig_path
+        workers = settings.COMPRESS_PRECOMPRESS_WORKERS
+        if workers:
+            # Fail early instead of in the background.
+            self.get_formats()
+            # The content may be closed once saved, read the file back.
+            future = get_precompress_executor(workers).submit(
+                self.precompress, filename
+            )
+            future.add_done_callback(
+                lambda future: self.precompress_done(filename, future)
+            )
+        else:
+            self.precompress(filename, content)
+        return filename
 
-        import brotli
+    def precompress_done(self, filename, future):
+        """
+        Logs the failure of writing the variants of ``filename`` in the
+        background.
+        """
+        if future.cancelled():
+            return
+        exception = future.exception()
+        if exception is not None:
+            logger.error(
+                "Failed to precompress %s",
+                filename,
+                exc_info=(type(exception), exception, exception.__traceback__),
+            )
+
+    def precompress(self, filename, content=None):
+        """
+        Writes the compressed variants of the saved file ``filename``, from
+        ``content`` if given.
+        """
+        orig_path = self.path(filename)
+        formats = self.get_formats()
+        if content is not None and not isinstance(content.read(0), bytes):
+            # Text is encoded when written, encode the file as written.
+            content = None
+        if os.path.getsize(orig_path) < settings.COMPRESS_PRECOMPRESS_MIN_SIZE:
+            # Don't leave variants of a previous content behind.
+            for format in formats:
+                extension = self.encoders[format][0]
+                try:
+                    os.remove("%s.%s" % (orig_path, extension))
+                except FileNotFoundError:
+                    pass
+            return
+
+        levels = settings.COMPRESS_PRECOMPRESS_LEVELS
+        outputs = []
+        try:
+            for format in formats:
+                extension, get_encoder, level = self.encoders[format]
+                encoder = get_encoder(levels.get(format, level))
+                compressed_path = "%s.%s" % (orig_path, extension)
+                fd, temp_path = tempfile.mkstemp(
+                    dir=os.path.dirname(orig_path), prefix=".precompress-"
+                )
+                outputs.append(
+                    (encoder, os.fdopen(fd, "wb"), temp_path, compressed_path)
+                )
+
+            if content is None:
+                with open(orig_path, "rb") as f_in:
+                    chunks = iter(lambda: f_in.read(self.chunk_size), b"")
+                    self.encode(chunks, outputs)
+            else:
+                self.encode(content.chunks(self.chunk_size), outputs)
+        except BaseException:
+            for encoder, f_out, temp_path, compressed_path in outputs:
+                f_out.close()
+                os.remove(temp_path)
+            raise
 
-        br_compressor = brotli.Compressor()
-        with open(orig_path, "rb") as f_in, open(compressed_path, "wb") as f_out:
-            for f_in_data in iter(lambda: f_in.read(self.chunk_size), b""):
-                compressed_data = br_compressor.process(f_in_data)
-                if not compressed_data:
-                    compressed_data = br_compressor.flush()
-                f_out.write(compressed_data)
-            f_out.write(br_compressor.finish())
         # Ensure the file timestamps match.
         # os.stat() returns nanosecond resolution on Linux, but os.utime()
-        # only sets microsecond resolution.  Set times on both files to
+        # only sets microsecond resolution.  Set times on all files to
         # ensure they are equal.
         stamp = time.time()
         os.utime(orig_path, (stamp, stamp))
-        os.utime(compressed_path, (stamp, stamp))
+        for encoder, f_out, temp_path, compressed_path in outputs:
+            os.chmod(temp_path, os.stat(orig_path).st_mode & 0o777)
+            os.utime(temp_path, (stamp, stamp))
+            os.replace(temp_path, compressed_path)
 
-        return filename
+    def encode(self, chunks, outputs):
+        for chunk in chunks:
+            for encoder, f_out, temp_path, compressed_path in outputs:
+                f_out.write(encoder.compress(chunk))
+        for encoder, f_out, temp_path, compressed_path in outputs:
+            f_out.write(encoder.flush())
+            f_out.close()
+
+
+class GzipCompressorFileStorage(PrecompressedCompressorFileStorage):
+    """
+    File system storage that stores gzipped files in addition to the usual files.
+    """
+
+    formats = ("gzip",)
+
+
+class BrotliCompressorFileStorage(PrecompressedCompressorFileStorage):
+    """
+    File system storage that stores brotli files in addition to the usual files.
+    """
+
+    formats = ("brotli",)
 
 
 class DefaultStorage(LazyObject):
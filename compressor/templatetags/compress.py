@@ -1,11 +1,14 @@
 from django import template
 from django.core.exceptions import ImproperlyConfigured
+from django.template.base import TextNode
+from django.template.defaulttags import CommentNode, LoadNode
+from django.templatetags.static import StaticNode
 
 from compressor.cache import (
     cache_get,
     cache_set,
     get_offline_hexdigest,
-    get_offline_manifest,
+    get_offline_output,
     get_templatetag_cachekey,
 )
 from compressor.conf import settings
@@ -20,6 +23,24 @@ OUTPUT_PRELOAD = "preload"
 OUTPUT_MODES = (OUTPUT_FILE, OUTPUT_INLINE, OUTPUT_PRELOAD)
 
 
+def is_static_node(node):
+    """
+    Returns whether the output of the given node is independent of the
+    template context it's rendered with.
+    """
+    if isinstance(node, (TextNode, CommentNode, LoadNode)):
+        return True
+    if isinstance(node, StaticNode):
+        # {% static "path/to/file.css" %}, but not {% static var %}
+        # or {% static "file.css" as var %}.
+        return (
+            node.varname is None
+            and isinstance(node.path.var, str)
+            and not node.path.filters
+        )
+    return False
+
+
 class CompressorMixin:
     def get_original_content(self, context):
         raise NotImplementedError
@@ -63,30 +84,28 @@ class CompressorMixin:
         """
         return (settings.COMPRESS_ENABLED and settings.COMPRESS_OFFLINE) or forced
 
+    def get_offline_key(self, original_content):
+        """
+        Returns the key of the block in the offline manifest.
+        """
+        return get_offline_hexdigest(original_content)
+
     def render_offline(self, context):
         """
         If enabled and in offline mode, and not forced check the offline cache
         and return the result if given
         """
         original_content = self.get_original_content(context)
-        key = get_offline_hexdigest(original_content)
-        offline_manifest = get_offline_manifest()
-        if key in offline_manifest:
-            return offline_manifest[key].replace(
-                settings.COMPRESS_URL_PLACEHOLDER,
-                # Cast ``settings.COMPRESS_URL`` to a string to allow it to be
-                # a string-alike object to e.g. add ``SCRIPT_NAME`` WSGI param
-                # as a *path prefix* to the output URL.
-                # See https://code.djangoproject.com/ticket/25598.
-                str(settings.COMPRESS_URL),
-            )
-        else:
-            raise OfflineGenerationError(
-                "You have offline compression "
-                'enabled but key "%s" is missing from offline manifest. '
-                'You may need to run "python manage.py compress". Here '
-                "is the original content:\n\n%s" % (key, original_content)
-            )
+        key = self.get_offline_key(original_content)
+        output = get_offline_output(key)
+        if output is not None:
+            return output
+        raise OfflineGenerationError(
+            "You have offline compression "
+            'enabled but key "%s" is missing from offline manifest. '
+            'You may need to run "python manage.py compress". Here '
+            "is the original content:\n\n%s" % (key, original_content)
+        )
 
     def render_cached(self, compressor, kind, mode):
         """
@@ -141,9 +160,82 @@ class CompressorNode(CompressorMixin, template.Node):
         self.kind = kind
         self.mode = mode
         self.name = name
+        # Blocks without any context dependent nodes render to the same
+        # content every time, so the content and the files it links to are
+        # remembered as (settings token, content, linked files) after the
+        # first render.
+        nodes = [nodelist] if isinstance(nodelist, template.Node) else nodelist
+        self.is_static = all(is_static_node(node) for node in nodes)
+        self._static_fingerprint = None
+        self._static_offline_key = None
+
+    def get_static_token(self):
+        """
+        Returns the settings the rendered content of a static block and the
+        resolution of its files depend on.
+        """
+        # Cast to strings to handle string-alike objects, see
+        # https://code.djangoproject.com/ticket/25598.
+        return (
+            str(settings.STATIC_URL),
+            str(settings.COMPRESS_URL),
+            settings.COMPRESS_ROOT,
+            settings.DEBUG,
+        )
+
+    def get_static_fingerprint(self):
+        fingerprint = self._static_fingerprint
+        if fingerprint is not None and fingerprint[0] == self.get_static_token():
+            return fingerprint
+        return None
 
     def get_original_content(self, context):
-        return self.nodelist.render(context)
+        if not self.is_static:
+            return self.nodelist.render(context)
+        fingerprint = self.get_static_fingerprint()
+        if fingerprint is not None:
+            return fingerprint[1]
+        content = self.nodelist.render(context)
+        self._static_fingerprint = (self.get_static_token(), content, None)
+        return content
+
+    def get_offline_key(self, original_content):
+        if not self.is_static:
+            return super().get_offline_key(original_content)
+        # The content of a static block only depends on the settings token,
+        # and so does its key.
+        token = self.get_static_token()
+        offline_key = self._static_offline_key
+        if offline_key is not None and offline_key[0] == token:
+            return offline_key[1]
+        key = super().get_offline_key(original_content)
+        self._static_offline_key = (token, key)
+        return key
+
+    def render_cached(self, compressor, kind, mode):
+        fingerprint = self.get_static_fingerprint()
+        if fingerprint is None or fingerprint[1] != compressor.content:
+            return super().render_cached(compressor, kind, mode)
+        token, content, linked_files = fingerprint
+        if linked_files is not None:
+            # Reuse the files found on a previous render, which skips parsing
+            # the content and looking up the files.
+            compressor.linked_files = linked_files
+            try:
+                return super().render_cached(compressor, kind, mode)
+            except OSError:
+                # One of the files is gone, look them up again.
+                for name in (
+                    "linked_files",
+                    "filenames",
+                    "file_mtimes",
+                    "referenced_filenames",
+                    "asset_filenames",
+                ):
+                    compressor.__dict__.pop(name, None)
+        result = super().render_cached(compressor, kind, mode)
+        self._static_fingerprint = (token, content, compressor.linked_files)
+        return result
 
     def render(self, context, forced=False):
 
@@ -0,0 +1,80 @@
+"""
+Compares the chained default CSS filters with the fused ones::
+
+    DJANGO_SETTINGS_MODULE=compressor.test_settings \
+        python -m compressor.tests.bench_css_filters
+"""
+import os
+import shutil
+import tempfile
+import timeit
+
+import django
+
+CHAINS = {
+    "chained": [
+        "compressor.filters.css_default.CssAbsoluteFilter",
+        "compressor.filters.cssmin.rCSSMinFilter",
+    ],
+    "fused": ["compressor.filters.css_fused.CssFusedFilter"],
+    "chained with data: URIs": [
+        "compressor.filters.css_default.CssAbsoluteFilter",
+        "compressor.filters.datauri.CssDataUriFilter",
+        "compressor.filters.cssmin.rCSSMinFilter",
+    ],
+    "fused with data: URIs": ["compressor.filters.css_fused.CssFusedDataUriFilter"],
+}
+
+RULE = """
+/* .icon-%(i)d { background: url(../../img/unused.png) } */
+.icon-%(i)d { background: url("../../img/python.png") no-repeat; }
+.icon-%(i)d:hover { background-image: url('../../img/add.png?v=%(i)d#hover'); }
+.icon-%(i)d:after { content: "url(%(i)d)"; margin: 0 %(i)dpx; }
+"""
+
+
+def write_stylesheets(directory, files, rules):
+    for index in range(files):
+        with open(os.path.join(directory, "bench%d.css" % index), "w") as file:
+            file.write("".join(RULE % {"i": i} for i in range(rules)))
+
+
+def main(files=20, rules=200, number=10):
+    django.setup()
+
+    from django.test.utils import override_settings
+
+    from compressor.conf import settings
+    from compressor.css import CssCompressor
+
+    directory = tempfile.mkdtemp(dir=os.path.join(settings.COMPRESS_ROOT, "css"))
+    try:
+        write_stylesheets(directory, files, rules)
+        relative = os.path.relpath(directory, settings.COMPRESS_ROOT)
+        content = "".join(
+            '<link rel="stylesheet" href="%s%s/bench%d.css" type="text/css">'
+            % (settings.COMPRESS_URL, relative, index)
+            for index in range(files)
+        )
+        results = {}
+        for name, filters in CHAINS.items():
+            with override_settings(
+                COMPRESS_ENABLED=True, COMPRESS_FILTERS={"css": filters}
+            ):
+                results[name] = CssCompressor("css", content).output("inline")
+                seconds = timeit.timeit(
+                    lambda: CssCompressor("css", content).output("inline"),
+                    number=number,
+                )
+            print(
+                "%-24s %8.1f ms per block of %d stylesheets"
+                % (name, seconds / number * 1000, files)
+            )
+        assert results["chained"] == results["fused"]
+        assert results["chained with data: URIs"] == results["fused with data: URIs"]
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
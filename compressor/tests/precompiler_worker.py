@@ -0,0 +1,20 @@
+#!/usr/bin/env python
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+
+from compressor.utils.worker import serve  # noqa: E402
+
+
+def compile(content, filename=None):
+    if "fail" in content:
+        raise ValueError("compilation failed")
+    if "hang" in content:
+        time.sleep(60)
+    return content.replace("background:", "color:")
+
+
+if __name__ == "__main__":
+    serve(compile)
@@ -1,7 +1,11 @@
 import os
 import re
 import sys
+import threading
+import time
+from importlib import import_module
 from tempfile import mkdtemp
+from unittest import mock
 from shutil import rmtree, copytree
 
 from bs4 import BeautifulSoup
@@ -10,9 +14,19 @@ from django.core.cache.backends import locmem
 from django.test import SimpleTestCase
 from django.test.utils import override_settings
 
-from compressor import cache as cachemod
-from compressor.base import SOURCE_FILE, SOURCE_HUNK
-from compressor.cache import get_cachekey, get_precompiler_cachekey
+from compressor import cache as cachemod, preload
+from compressor.base import Compressor, SOURCE_FILE, SOURCE_HUNK, get_hunk_executor
+from compressor.cache import (
+    cache_get,
+    cache_set,
+    compiler_cache,
+    get_cachekey,
+    get_mtime_cachekey,
+    get_mtimes,
+    get_precompiler_cachekey,
+    local_cache,
+    output_registry,
+)
 from compressor.conf import settings
 from compressor.css import CssCompressor
 from compressor.exceptions import FilterDoesNotExist, FilterError
@@ -428,6 +442,121 @@ class VerboseTestCase(CompressorTestCase):
     pass
 
 
+@override_settings(COMPRESS_HUNK_WORKERS=4)
+class HunkWorkersTestCase(CompressorTestCase):
+    def test_hunks_processed_in_threads(self):
+        threads = []
+        process_hunk = self.css_node.process_hunk
+
+        def record_thread(*args, **kwargs):
+            threads.append(threading.current_thread())
+            return process_hunk(*args, **kwargs)
+
+        with mock.patch.object(self.css_node, "process_hunk", record_thread):
+            hunks = list(self.css_node.hunks())
+        self.assertEqual(len(hunks), 3)
+        self.assertNotIn(threading.current_thread(), threads)
+        self.assertEqual(hunks[1], "p { border:5px solid green;}")
+
+    def test_executor_is_shared(self):
+        self.assertIs(get_hunk_executor(4), get_hunk_executor(4))
+
+
+@override_settings(COMPRESS_STREAM_OUTPUT=True)
+class StreamOutputTestCase(SimpleTestCase):
+    def setUp(self):
+        self.css = """\
+<link rel="stylesheet" href="/static/css/one.css" type="text/css">
+<style type="text/css">p { border:5px solid green;}</style>
+<link rel="stylesheet" href="/static/css/two.css" type="text/css">"""
+        self.js = """\
+<script src="/static/js/one.js" type="text/javascript"></script>
+<script type="text/javascript">obj.value = "value";</script>"""
+
+    def get_output(self, compressor, mode="file"):
+        with mock.patch.object(
+            Compressor,
+            "output_stream",
+            autospec=True,
+            side_effect=Compressor.output_stream,
+        ) as output_stream:
+            output = compressor.output(mode=mode)
+        return output, output_stream.called
+
+    def test_streamed_output_matches(self):
+        for kind, content, compressor_cls in (
+            ("css", self.css, CssCompressor),
+            ("js", self.js, JsCompressor),
+        ):
+            filters = {kind: []}
+            with self.settings(COMPRESS_FILTERS=filters):
+                streamed, called = self.get_output(compressor_cls(kind, content))
+                self.assertTrue(called)
+            with self.settings(COMPRESS_FILTERS=filters, COMPRESS_STREAM_OUTPUT=False):
+                output = compressor_cls(kind, content).output()
+            self.assertEqual(streamed, output)
+
+    def test_streamable_output_filters(self):
+        output, called = self.get_output(CssCompressor("css", self.css), "preload")
+        self.assertTrue(called)
+        self.assertIn('rel="preload"', output)
+        path = make_soup(output).link["href"][len(settings.COMPRESS_URL) :]
+        with open(os.path.join(settings.COMPRESS_ROOT, path)) as file:
+            self.assertEqual(
+                file.read(),
+                "body{background:#990}\np{border:5px solid green}\nbody{color:#fff}",
+            )
+
+    def test_not_streamed(self):
+        compressor = CssCompressor("css", self.css)
+        self.assertFalse(self.get_output(compressor, "inline")[1])
+        with self.settings(
+            COMPRESS_FILTERS={"css": ["compressor.filters.template.TemplateFilter"]}
+        ):
+            self.assertTrue(CssCompressor("css", self.css).can_stream_output("file"))
+        with self.settings(
+            COMPRESS_FILTERS={"js": ["compressor.filters.jsmin.CalmjsFilter"]}
+        ):
+            self.assertFalse(JsCompressor("js", self.js).can_stream_output("file"))
+
+
+@override_settings(COMPRESS_ENABLED=True, COMPRESS_OUTPUT_REGISTRY_SIZE=10)
+class OutputRegistryTestCase(SimpleTestCase):
+    def setUp(self):
+        self.css = '<style type="text/css">p { border:5px solid blue;}</style>'
+        output_registry.clear()
+        cachemod.cache.clear()
+
+    def tearDown(self):
+        output_registry.clear()
+
+    def output(self):
+        storage = mock.Mock(wraps=DefaultStorage())
+        with mock.patch("compressor.storage.default_storage", storage):
+            CssCompressor("css", self.css).output()
+        return storage.exists.call_count, storage.save.call_count
+
+    def test_registry(self):
+        self.assertEqual(self.output()[0], 1)
+        self.assertEqual(self.output(), (0, 0))
+
+    @override_settings(COMPRESS_OUTPUT_REGISTRY_SIZE=0)
+    def test_disabled(self):
+        self.assertEqual(self.output()[0], 1)
+        self.assertEqual(self.output(), (1, 0))
+
+    @override_settings(COMPRESS_OUTPUT_REGISTRY_CACHE=True)
+    def test_shared(self):
+        self.output()
+        output_registry.clear()
+        self.assertEqual(self.output(), (0, 0))
+
+    @override_settings(COMPRESS_OUTPUT_REGISTRY_TRUSTED=True)
+    def test_trusted(self):
+        self.assertEqual(self.output(), (0, 1))
+        self.assertEqual(self.output(), (0, 0))
+
+
 class CacheBackendTestCase(CompressorTestCase):
     def test_correct_backend(self):
         from compressor.cache import cache
@@ -475,6 +604,47 @@ class JSWithParensTestCase(SimpleTestCase):
         self.assertEqual(content[1], "pollos = {};")
 
 
+class PreloadTestCase(SimpleTestCase):
+    @override_settings(COMPRESS_ENABLED=True, COMPRESS_OFFLINE=True)
+    def test_preload(self):
+        with mock.patch.object(
+            cachemod, "get_offline_manifest"
+        ) as get_offline_manifest, mock.patch(
+            "django.template.loader.get_template"
+        ) as get_template:
+            preload()
+        self.assertEqual(get_offline_manifest.call_count, 1)
+        self.assertEqual(
+            sorted(call.args[0] for call in get_template.call_args_list),
+            [
+                "compressor/%s_%s.html" % (kind, mode)
+                for kind in ("css", "js")
+                for mode in ("file", "inline", "preload")
+            ],
+        )
+
+    def test_preload_imports_callbacks(self):
+        with mock.patch(
+            "compressor.filters.base.import_module", wraps=import_module
+        ) as import_module_mock:
+            preload()
+        imported = [call.args[0] for call in import_module_mock.call_args_list]
+        self.assertIn("rcssmin", imported)
+        self.assertIn("rjsmin", imported)
+
+    @override_settings(
+        COMPRESS_OFFLINE=False,
+        COMPRESS_PRECOMPILERS=(
+            ("text/foobar", "python %s {infile} {outfile}" % "foobar.py"),
+            ("text/x-missing", "compressor.filters.base.MissingFilter"),
+        ),
+    )
+    def test_preload_missing_precompiler(self):
+        with mock.patch.object(cachemod, "get_offline_manifest") as get_offline_manifest:
+            self.assertRaises(FilterDoesNotExist, preload)
+        self.assertFalse(get_offline_manifest.called)
+
+
 class CacheTestCase(SimpleTestCase):
     def setUp(self):
         cachemod._cachekey_func = None
@@ -496,6 +666,125 @@ class CacheTestCase(SimpleTestCase):
         except TypeError:
             self.fail("get_precompiler_cachekey raised TypeError unexpectedly")
 
+    def test_get_mtimes(self):
+        filenames = [
+            os.path.join(settings.COMPRESS_ROOT, "css", name)
+            for name in ("one.css", "two.css")
+        ]
+        cachemod.cache.delete_many([get_mtime_cachekey(f) for f in filenames])
+        with mock.patch.object(
+            cachemod.cache, "get_many", wraps=cachemod.cache.get_many
+        ) as get_many:
+            mtimes = get_mtimes(filenames)
+            self.assertEqual(mtimes, get_mtimes(filenames))
+        self.assertEqual(get_many.call_count, 2)
+        self.assertEqual(
+            mtimes, {filename: os.path.getmtime(filename) for filename in filenames}
+        )
+        self.assertEqual(
+            cachemod.cache.get(get_mtime_cachekey(filenames[0])), mtimes[filenames[0]]
+        )
+
+    @override_settings(COMPRESS_MTIME_DELAY=0)
+    def test_get_mtimes_without_delay(self):
+        filename = os.path.join(settings.COMPRESS_ROOT, "css", "one.css")
+        self.assertEqual(get_mtimes([filename]), {filename: os.path.getmtime(filename)})
+
+
+@override_settings(COMPRESS_LOCAL_CACHE_SIZE=2, COMPRESS_LOCAL_CACHE_TIMEOUT=60)
+class LocalCacheTestCase(SimpleTestCase):
+    def setUp(self):
+        cachemod.cache.clear()
+        local_cache.clear()
+
+    def tearDown(self):
+        local_cache.clear()
+
+    def test_hit_skips_cache_backend(self):
+        cache_set("foo", "bar")
+        cachemod.cache.clear()
+        self.assertEqual(cache_get("foo"), "bar")
+        self.assertEqual(local_cache.hits, 1)
+
+    def test_miss_populates_local_cache(self):
+        cachemod.cache.set("foo", ("bar", time.time() + 60, False))
+        self.assertEqual(cache_get("foo"), "bar")
+        self.assertEqual(local_cache.misses, 1)
+        self.assertEqual(cache_get("foo"), "bar")
+        self.assertEqual(local_cache.hits, 1)
+
+    def test_lru_eviction(self):
+        for key in ("a", "b", "c"):
+            cache_set(key, key)
+        self.assertEqual(len(local_cache), 2)
+        self.assertIsNone(local_cache.get("a"))
+        self.assertEqual(local_cache.get("c")[0], "c")
+
+    def test_mint_delay_is_respected(self):
+        # A value past its refresh time must not be served from the local
+        # cache, the first caller gets None and rebuilds it.
+        cache_set("foo", "bar", timeout=-1)
+        self.assertIsNone(cache_get("foo"))
+        self.assertEqual(cache_get("foo"), "bar")
+
+    @override_settings(COMPRESS_LOCAL_CACHE_SIZE=0)
+    def test_disabled(self):
+        cache_set("foo", "bar")
+        self.assertEqual(len(local_cache), 0)
+        self.assertEqual(cache_get("foo"), "bar")
+        self.assertEqual(local_cache.stats()["hits"], 0)
+
+
+class DiskCacheTestCase(SimpleTestCase):
+    def setUp(self):
+        self.dir = mkdtemp()
+        self.override = override_settings(
+            COMPRESS_COMPILER_CACHE_DIR=self.dir, COMPRESS_COMPILER_CACHE_SIZE=10
+        )
+        self.override.enable()
+
+    def tearDown(self):
+        self.override.disable()
+        rmtree(self.dir)
+
+    def test_get_set(self):
+        self.assertIsNone(compiler_cache.get("abcdef"))
+        compiler_cache.set("abcdef", "b\xe4r")
+        self.assertEqual(compiler_cache.get("abcdef"), "b\xe4r")
+        self.assertTrue(os.path.exists(os.path.join(self.dir, "ab", "abcdef")))
+
+    def test_lru_eviction(self):
+        compiler_cache.set("aaaa", "1234")
+        compiler_cache.set("bbbb", "1234")
+        os.utime(compiler_cache.get_path("aaaa"), (1, 1))
+        os.utime(compiler_cache.get_path("bbbb"), (2, 2))
+        # A hit marks the entry as recently used.
+        self.assertEqual(compiler_cache.get("aaaa"), "1234")
+        compiler_cache.set("cccc", "1234")
+        self.assertIsNone(compiler_cache.get("bbbb"))
+        self.assertEqual(compiler_cache.get("aaaa"), "1234")
+        self.assertEqual(compiler_cache.get("cccc"), "1234")
+
+    def test_size_counted_once(self):
+        entries = compiler_cache.entries
+        with mock.patch.object(compiler_cache, "entries", wraps=entries):
+            compiler_cache.set("aaaa", "12")
+            compiler_cache.set("bbbb", "12")
+            compiler_cache.set("aaaa", "1234")
+            self.assertEqual(compiler_cache.entries.call_count, 1)
+            os.utime(compiler_cache.get_path("bbbb"), (1, 1))
+            # Over the limit, the entries are counted again and culled.
+            compiler_cache.set("cccc", "123456")
+            self.assertEqual(compiler_cache.entries.call_count, 2)
+        self.assertIsNone(compiler_cache.get("bbbb"))
+        self.assertEqual(compiler_cache.get("cccc"), "123456")
+
+    @override_settings(COMPRESS_COMPILER_CACHE_DIR=None)
+    def test_disabled(self):
+        compiler_cache.set("abcdef", "bar")
+        self.assertIsNone(compiler_cache.get("abcdef"))
+        self.assertEqual(os.listdir(self.dir), [])
+
 
 class CompressorInDebugModeTestCase(SimpleTestCase):
     def setUp(self):
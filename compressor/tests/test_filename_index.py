@@ -0,0 +1,107 @@
+import io
+import os
+from unittest import mock
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase, override_settings
+
+from compressor.cache import cache, filename_index, get_indexed_filename
+from compressor.conf import settings
+from compressor.css import CssCompressor
+
+
+@override_settings(COMPRESS_FILENAME_INDEX=True)
+class FilenameIndexTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        filename_index.clear()
+        self.filename = os.path.join(settings.COMPRESS_ROOT, "css", "one.css")
+
+    def test_get_filename_uses_index(self):
+        compressor = CssCompressor("css")
+        self.assertEqual(compressor.get_filename("css/one.css"), self.filename)
+        self.assertEqual(get_indexed_filename("css/one.css"), self.filename)
+        with mock.patch.object(compressor, "find_filename") as find_filename:
+            self.assertEqual(compressor.get_filename("css/one.css"), self.filename)
+        self.assertFalse(find_filename.called)
+
+    def test_block_looked_up_at_once(self):
+        css = """
+        <link rel="stylesheet" href="/static/css/one.css" type="text/css">
+        <link rel="stylesheet" href="/static/css/two.css" type="text/css">
+        """
+        filenames = CssCompressor("css", css).filenames
+        filename_index.clear()
+        with mock.patch.object(
+            cache, "get_many", wraps=cache.get_many
+        ) as get_many, mock.patch(
+            "compressor.base.get_indexed_filename"
+        ) as get_indexed_filename:
+            self.assertEqual(CssCompressor("css", css).filenames, filenames)
+        self.assertEqual(get_many.call_count, 1)
+        self.assertFalse(get_indexed_filename.called)
+        # Entries are then remembered in the process.
+        with mock.patch.object(cache, "get_many") as get_many:
+            self.assertEqual(CssCompressor("css", css).filenames, filenames)
+        self.assertFalse(get_many.called)
+
+    def test_clean_in_other_process(self):
+        CssCompressor("css").get_filename("css/one.css")
+        # Done by the filename_index command in another process.
+        cache.clear()
+        self.assertEqual(get_indexed_filename("css/one.css"), self.filename)
+        with mock.patch("compressor.cache.time.time", return_value=2**40):
+            self.assertIsNone(get_indexed_filename("css/one.css"))
+
+    @override_settings(COMPRESS_FILENAME_INDEX_CACHE_SIZE=1)
+    def test_bounded(self):
+        CssCompressor("css").get_filename("css/one.css")
+        CssCompressor("css").get_filename("css/two.css")
+        self.assertEqual(len(filename_index), 1)
+
+    def test_index_invalidated_by_mtime(self):
+        CssCompressor("css").get_filename("css/one.css")
+        mtime = os.path.getmtime(self.filename)
+        os.utime(self.filename, (mtime + 10, mtime + 10))
+        try:
+            self.assertIsNone(get_indexed_filename("css/one.css"))
+        finally:
+            os.utime(self.filename, (mtime, mtime))
+
+    @override_settings(COMPRESS_FILENAME_INDEX=False)
+    def test_disabled(self):
+        CssCompressor("css").get_filename("css/one.css")
+        self.assertIsNone(get_indexed_filename("css/one.css"))
+
+
+@override_settings(COMPRESS_FILENAME_INDEX=True)
+class FilenameIndexCommandTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        filename_index.clear()
+
+    def test_handle_no_args(self):
+        with self.assertRaises(CommandError):
+            call_command("filename_index")
+
+    @override_settings(COMPRESS_FILENAME_INDEX=False)
+    def test_handle_disabled(self):
+        with self.assertRaises(CommandError):
+            call_command("filename_index", "--add")
+
+    def test_handle_add(self):
+        out = io.StringIO()
+        call_command("filename_index", "--add", stdout=out)
+        self.assertIn("Added", out.getvalue())
+        self.assertEqual(
+            get_indexed_filename("css/one.css"),
+            os.path.join(settings.COMPRESS_ROOT, "css", "one.css"),
+        )
+
+    def test_handle_clean(self):
+        CssCompressor("css").get_filename("css/one.css")
+        out = io.StringIO()
+        call_command("filename_index", "--clean", stdout=out)
+        self.assertNotIn("Added", out.getvalue())
+        self.assertIsNone(get_indexed_filename("css/one.css"))
@@ -1,6 +1,10 @@
 import io
 import os
+import re
+import shutil
+import subprocess
 import sys
+import tempfile
 from collections import defaultdict
 from unittest import mock
 
@@ -8,18 +12,47 @@ from django.conf import settings
 from django.test import override_settings, TestCase
 from django.utils.encoding import smart_str
 
-from compressor.cache import cache, get_hashed_content, get_hashed_mtime
+from compressor.cache import (
+    cache,
+    data_uri_cache,
+    get_hashed_content,
+    get_hashed_mtime,
+    get_hexdigest,
+    hashed_content_cache,
+    referenced_files_cache,
+)
 from compressor.css import CssCompressor
-from compressor.filters import CachedCompilerFilter, CompilerFilter
+from compressor.exceptions import FilterError
+from compressor.filters import (
+    CachedCompilerFilter,
+    CallbackOutputFilter,
+    CompilerFilter,
+    FilterBase,
+)
+from compressor.filters.base import is_reusable
 from compressor.filters.cleancss import CleanCSSFilter
 from compressor.filters.closure import ClosureCompilerFilter
 from compressor.filters.css_default import CssAbsoluteFilter, CssRelativeFilter
+from compressor.filters.css_import import CssImportFilter
+from compressor.filters import css_urls
+from compressor.filters.css_urls import (
+    get_references,
+    replace_references,
+    scan_references,
+)
 from compressor.filters.cssmin import CSSCompressorFilter, rCSSMinFilter
+from compressor.filters.datauri import (
+    CssDataUriFilter,
+    DataUriFilter,
+    dedup_data_uris,
+)
+from compressor.offline.incremental import IncrementalState
 from compressor.filters.jsmin import CalmjsFilter, rJSMinFilter
 from compressor.filters.template import TemplateFilter
 from compressor.filters.yuglify import YUglifyCSSFilter, YUglifyJSFilter
 from compressor.filters.yui import YUICSSFilter, YUIJSFilter
 from compressor.tests.test_base import test_dir
+from compressor.utils.worker import close_worker_pools, get_worker_pool
 
 
 def blankdict(*args, **kwargs):
@@ -118,6 +151,46 @@ class PrecompilerTestCase(TestCase):
         )
         self.assertEqual("body { color:#990; }%s" % os.linesep, compiler.input())
 
+    def test_precompiler_argv_command(self):
+        self.setup_infile("static/css/filename with spaces.css")
+        command = [sys.executable, self.test_precompiler, "-f", "{infile}", "{args}"]
+        compiler = CompilerFilter(
+            content=self.content,
+            filename=self.filename,
+            charset=self.CHARSET,
+            command=command,
+            args="",
+        )
+        with mock.patch("subprocess.Popen", wraps=subprocess.Popen) as popen:
+            output = compiler.input()
+        self.assertEqual("body { color:#424242; }%s" % os.linesep, output)
+        args, kwargs = popen.call_args
+        self.assertEqual(
+            args[0], [sys.executable, self.test_precompiler, "-f", self.filename]
+        )
+        self.assertFalse(kwargs["shell"])
+
+    def test_precompiler_without_shell(self):
+        command = "%s %s" % (sys.executable, self.test_precompiler)
+        compiler = CompilerFilter(
+            content=self.content, filename=None, charset=None, command=command
+        )
+        with mock.patch("subprocess.Popen", wraps=subprocess.Popen) as popen:
+            compiler.input()
+        args, kwargs = popen.call_args
+        self.assertEqual(args[0], [sys.executable, self.test_precompiler])
+        self.assertFalse(kwargs["shell"])
+
+    def test_precompiler_shell_syntax(self):
+        command = "%s %s < {infile}" % (sys.executable, self.test_precompiler)
+        compiler = CompilerFilter(
+            content=self.content, filename=None, charset=None, command=command
+        )
+        with mock.patch("subprocess.Popen", wraps=subprocess.Popen) as popen:
+            output = compiler.input()
+        self.assertEqual("body { color:#990; }%s" % os.linesep, output)
+        self.assertTrue(popen.call_args[1]["shell"])
+
     def test_precompiler_output_unicode(self):
         command = "%s %s" % (sys.executable, self.test_precompiler)
         compiler = CompilerFilter(
@@ -191,6 +264,164 @@ class PrecompilerTestCase(TestCase):
         self.assertEqual("", compiler.input())
 
 
+class CompilerWorkerTestCase(TestCase):
+    def setUp(self):
+        self.worker_command = "%s %s" % (
+            sys.executable,
+            os.path.join(test_dir, "precompiler_worker.py"),
+        )
+        self.command = "%s %s" % (
+            sys.executable,
+            os.path.join(test_dir, "precompiler.py"),
+        )
+
+    def tearDown(self):
+        close_worker_pools()
+
+    def test_worker_is_reused(self):
+        for content in ("body { background:#990; }", "p { background:#fff; }"):
+            compiler = CompilerFilter(
+                content=content,
+                command="false",
+                worker_command=self.worker_command,
+            )
+            self.assertEqual(content.replace("background:", "color:"), compiler.input())
+        pool = get_worker_pool(
+            self.worker_command,
+            settings.COMPRESS_COMPILER_WORKER_POOL_SIZE,
+            timeout=settings.COMPRESS_COMPILER_WORKER_TIMEOUT,
+        )
+        self.assertEqual(len(pool._idle), 1)
+
+    def test_worker_error(self):
+        compiler = CompilerFilter(
+            content="fail", command="false", worker_command=self.worker_command
+        )
+        with self.assertRaisesMessage(FilterError, "compilation failed"):
+            compiler.input()
+
+    def test_fallback_to_command(self):
+        compiler = CompilerFilter(
+            content="body { background:#990; }",
+            command=self.command,
+            worker_command="/nonexistent/worker",
+        )
+        self.assertEqual("body { color:#990; }", compiler.input().strip())
+
+    @override_settings(COMPRESS_COMPILER_WORKER_TIMEOUT=0.5)
+    def test_timeout(self):
+        compiler = CompilerFilter(
+            content="body { background:#990; } /* hang */",
+            command=self.command,
+            worker_command=self.worker_command,
+        )
+        with self.assertLogs("compressor.filters", "WARNING") as logs:
+            self.assertEqual(
+                "body { color:#990; } /* hang */", compiler.input().strip()
+            )
+        self.assertIn("timed out", logs.output[0])
+        # The stuck worker was killed, the next request starts a new one.
+        compiler = CompilerFilter(
+            content="p { background:#fff; }",
+            command="false",
+            worker_command=self.worker_command,
+        )
+        self.assertEqual("p { color:#fff; }", compiler.input())
+
+    def test_worker_command_with_files(self):
+        compiler = CompilerFilter(
+            content="body { background:#990; }",
+            command=self.command,
+            worker_command=self.worker_command + " {infile}",
+        )
+        with self.assertRaisesMessage(FilterError, "{infile} and {outfile}"):
+            compiler.input()
+
+    @override_settings(COMPRESS_COMPILER_WORKER_POOL_SIZE=0)
+    def test_disabled(self):
+        compiler = CompilerFilter(
+            content="body { background:#990; }",
+            command=self.command,
+            worker_command="/nonexistent/worker",
+        )
+        with mock.patch.object(compiler, "run_worker") as run_worker:
+            compiler.input()
+        self.assertFalse(run_worker.called)
+
+    def test_precompiler_workers_setting(self):
+        with self.settings(
+            COMPRESS_PRECOMPILER_WORKERS={"text/css": self.worker_command}
+        ):
+            compiler = CachedCompilerFilter(
+                content="body { background:#990; }",
+                command="false",
+                mimetype="text/css",
+            )
+        self.assertEqual(compiler.worker_command, self.worker_command)
+        self.assertEqual("body { color:#990; }", compiler.input())
+
+
+class CompilerCacheTestCase(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.override = override_settings(COMPRESS_COMPILER_CACHE_DIR=self.dir)
+        self.override.enable()
+        self.command = "%s %s" % (
+            sys.executable,
+            os.path.join(test_dir, "precompiler.py"),
+        )
+
+    def tearDown(self):
+        self.override.disable()
+        shutil.rmtree(self.dir)
+
+    def compile(self, content, **kwargs):
+        kwargs.setdefault("command", self.command)
+        compiler = CompilerFilter(content=content, **kwargs)
+        with mock.patch("subprocess.Popen", wraps=subprocess.Popen) as popen:
+            output = compiler.input()
+        return output, popen.called
+
+    def test_output_is_reused(self):
+        output, compiled = self.compile("body { background:#990; }")
+        self.assertTrue(compiled)
+        self.assertEqual(self.compile("body { background:#990; }"), (output, False))
+        self.assertTrue(self.compile("p { background:#990; }")[1])
+
+    def test_compiler_version(self):
+        script = os.path.join(self.dir, "precompiler.py")
+        shutil.copy(os.path.join(test_dir, "precompiler.py"), script)
+        command = "%s %s" % (sys.executable, script)
+        self.assertTrue(self.compile("body {}", command=command)[1])
+        self.assertFalse(self.compile("body {}", command=command)[1])
+        os.utime(script, (1, 1))
+        self.assertTrue(self.compile("body {}", command=command)[1])
+
+    def test_files_are_not_cached(self):
+        filename = os.path.join(test_dir, "static/css/one.css")
+        self.assertTrue(self.compile("body {}", filename=filename)[1])
+        self.assertTrue(self.compile("body {}", filename=filename)[1])
+
+    def test_cacheable_precompilers(self):
+        filename = os.path.join(test_dir, "static/css/one.css")
+        for cacheable, compiled in (((), True), (("text/css",), False)):
+            with self.settings(COMPRESS_CACHEABLE_PRECOMPILERS=cacheable):
+                cache.clear()
+                compiler = CachedCompilerFilter(
+                    content="body {}",
+                    filename=filename,
+                    command=self.command,
+                    mimetype="text/css",
+                )
+                compiler.input()
+                cache.clear()
+                with mock.patch.object(
+                    compiler, "compile", wraps=compiler.compile
+                ) as compile:
+                    compiler.input()
+                self.assertEqual(compile.called, compiled)
+
+
 class CSSCompressorTestCase(TestCase):
     def test_csscompressor_filter(self):
         content = """/*!
@@ -233,6 +464,69 @@ class rCssMinTestCase(TestCase):
         self.assertEqual(output, rCSSMinFilter(content).output())
 
 
+class CountingFilter(FilterBase):
+    reusable = True
+    instances = 0
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        CountingFilter.instances += 1
+
+    def input(self, **kwargs):
+        return self.content.upper()
+
+
+class CountingSubclassFilter(CountingFilter):
+    # Not reusable, e.g. reading the content in __init__.
+    instances = 0
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        CountingSubclassFilter.instances += 1
+
+
+class ReusableFilterTestCase(TestCase):
+    def test_apply(self):
+        minifier = rCSSMinFilter(None)
+        self.assertEqual("p{color:red}", minifier.apply("p {  color: red; }", "output"))
+        self.assertEqual("a{b:c}", minifier.apply("a { b: c }", "output"))
+        self.assertIsNone(minifier.content)
+        with self.assertRaises(NotImplementedError):
+            minifier.apply("p {}", "input")
+
+    @override_settings(COMPRESS_ENABLED=True)
+    def test_single_instance_per_compressor(self):
+        CountingFilter.instances = 0
+        css = """<style type="text/css">p { color: red; }</style>
+<style type="text/css">a { color: blue; }</style>"""
+        compressor = CssCompressor(
+            "css",
+            css,
+            filters=["compressor.tests.test_filters.CountingFilter"],
+        )
+        self.assertEqual(
+            ["P { COLOR: RED; }", "A { COLOR: BLUE; }"], list(compressor.hunks())
+        )
+        self.assertEqual(CountingFilter.instances, 1)
+
+    @override_settings(COMPRESS_ENABLED=True)
+    def test_subclasses_not_reusable(self):
+        CountingSubclassFilter.instances = 0
+        css = """<style type="text/css">p { color: red; }</style>
+<style type="text/css">a { color: blue; }</style>"""
+        compressor = CssCompressor(
+            "css",
+            css,
+            filters=["compressor.tests.test_filters.CountingSubclassFilter"],
+        )
+        self.assertEqual(
+            ["P { COLOR: RED; }", "A { COLOR: BLUE; }"], list(compressor.hunks())
+        )
+        self.assertEqual(CountingSubclassFilter.instances, 2)
+        self.assertTrue(is_reusable(rCSSMinFilter))
+        self.assertFalse(is_reusable(CallbackOutputFilter))
+
+
 class JsMinTestCase(TestCase):
     def test_jsmin_filter(self):
         content = """/*!
@@ -483,6 +777,17 @@ p { filter: progid:DXImageTransform.Microsoft.AlphaImageLoader(src='%(compress_u
             expected, filter.input(filename=filename, basename="css/url/test.css")
         )
 
+    def test_deprecated_converters(self):
+        class UpperCaseFilter(self.filter_class):
+            def url_converter(self, matchobj):
+                return super().url_converter(matchobj).upper()
+
+        filename = os.path.join(settings.COMPRESS_ROOT, "css/url/test.css")
+        filter = UpperCaseFilter("p { background: url(../../img/python.png) }")
+        with self.assertWarns(DeprecationWarning):
+            output = filter.input(filename=filename, basename="css/url/test.css")
+        self.assertIn("URL(%sIMG/PYTHON.PNG" % self.expected_url_prefix.upper(), output)
+
 
 @override_settings(COMPRESS_URL="http://static.example.com/")
 class CssAbsolutizingTestCaseWithDifferentURL(CssAbsolutizingTestCase):
@@ -494,6 +799,137 @@ class CssAbsolutizingTestCaseWithHash(CssAbsolutizingTestCase):
     hashing_func = staticmethod(get_hashed_content)
 
 
+class CssReferencesTestCase(TestCase):
+    def test_scan_references(self):
+        content = (
+            '@import "a.css";@import url(b.css);\n'
+            "/* url(comment.png) */\n"
+            'p:after { content: "url(string.png)" }\n'
+            "p { background: url( 'c.png' ) url(d.png ) }\n"
+            "p { filter: Alpha(src='e.png') }\n"
+            "[data-src='f.png'] { background: url(g.png"
+        )
+        references = scan_references(content)
+        self.assertEqual(
+            [(ref.kind, ref.url, ref.quote) for ref in references],
+            [
+                ("import", "a.css", '"'),
+                ("url", "b.css", ""),
+                ("url", "c.png", "'"),
+                ("url", "d.png", ""),
+                ("src", "e.png", "'"),
+            ],
+        )
+        self.assertEqual(
+            [content[ref.start : ref.end] for ref in references],
+            ['"a.css"', "url(b.css)", "url( 'c.png' )", "url(d.png )", "src='e.png'"],
+        )
+
+    def test_replace_references(self):
+        content = "p { background: url(a.png) } /* url(b.png) */ q { src='c.png' }"
+        output = replace_references(
+            content,
+            lambda ref: ref._replace(url="/static/%s" % ref.url, quote='"'),
+            ("url",),
+        )
+        self.assertEqual(
+            output,
+            'p { background: url("/static/a.png") } /* url(b.png) */ '
+            "q { src='c.png' }",
+        )
+        with mock.patch(
+            "compressor.filters.css_urls.scan_references"
+        ) as scan_references_mock:
+            references = get_references(output)
+        self.assertFalse(scan_references_mock.called)
+        self.assertEqual(
+            [output[ref.start : ref.end] for ref in references],
+            ['url("/static/a.png")', "src='c.png'"],
+        )
+        self.assertEqual(references, scan_references(output))
+
+    def test_stylesheets_not_kept(self):
+        content = "p { background: url(a.png) }" * 1000
+        get_references(content)
+        self.assertFalse(any(isinstance(key, str) for key in css_urls._references))
+
+
+@override_settings(COMPRESS_ENABLED=True, COMPRESS_URL="/static/")
+class CssFusedFilterTestCase(TestCase):
+    css = """
+    <link rel="stylesheet" href="/static/css/datauri.css" type="text/css">
+    <link rel="stylesheet" href="/static/css/relative_url.css" type="text/css">
+    <style type="text/css">p { background: url(/static/img/python.png) }</style>
+    """
+
+    def get_output(self, filters):
+        with self.settings(COMPRESS_FILTERS={"css": filters}):
+            return CssCompressor("css", self.css).output("inline")
+
+    def test_same_output_as_chained_filters(self):
+        self.assertEqual(
+            self.get_output(["compressor.filters.css_fused.CssFusedFilter"]),
+            self.get_output(
+                [
+                    "compressor.filters.css_default.CssAbsoluteFilter",
+                    "compressor.filters.cssmin.rCSSMinFilter",
+                ]
+            ),
+        )
+
+    def test_data_uris(self):
+        output = self.get_output(["compressor.filters.css_fused.CssFusedDataUriFilter"])
+        self.assertIn("data:image/png;base64,", output)
+        self.assertEqual(
+            output,
+            self.get_output(
+                [
+                    "compressor.filters.css_default.CssAbsoluteFilter",
+                    "compressor.filters.datauri.CssDataUriFilter",
+                    "compressor.filters.cssmin.rCSSMinFilter",
+                ]
+            ),
+        )
+
+
+class HashedContentCacheTestCase(TestCase):
+    def setUp(self):
+        hashed_content_cache.clear()
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, "image.png")
+        with open(self.filename, "wb") as file:
+            file.write(b"image")
+
+    def tearDown(self):
+        hashed_content_cache.clear()
+        shutil.rmtree(self.tmpdir)
+
+    def get_hashed_content(self):
+        with mock.patch("builtins.open", wraps=open) as open_mock:
+            hashed = get_hashed_content(self.filename)
+        return hashed, open_mock.called
+
+    def test_memoized(self):
+        hashed, opened = self.get_hashed_content()
+        self.assertTrue(opened)
+        self.assertEqual(self.get_hashed_content(), (hashed, False))
+        self.assertEqual(hashed, get_hexdigest(b"image", 12))
+
+    def test_invalidated(self):
+        hashed = self.get_hashed_content()[0]
+        mtime = os.path.getmtime(self.filename)
+        with open(self.filename, "wb") as file:
+            file.write(b"other")
+        os.utime(self.filename, (mtime + 10, mtime + 10))
+        self.assertEqual(self.get_hashed_content(), (get_hexdigest(b"other", 12), True))
+        self.assertNotEqual(hashed, get_hexdigest(b"other", 12))
+
+    @override_settings(COMPRESS_HASHED_CONTENT_CACHE_SIZE=0)
+    def test_disabled(self):
+        self.get_hashed_content()
+        self.assertTrue(self.get_hashed_content()[1])
+
+
 @override_settings(
     COMPRESS_ENABLED=True,
     COMPRESS_URL="/static/",
@@ -553,6 +989,309 @@ class CssDataUriTestCase(TestCase):
         ]
         self.assertEqual(out, list(self.css_node.hunks()))
 
+    def test_url_patterns(self):
+        class SrcDataUriFilter(DataUriFilter):
+            url_patterns = (re.compile(r"src=([^\)]+)\)"),)
+
+        class UpperCaseDataUriFilter(CssDataUriFilter):
+            def data_uri_converter(self, matchobj):
+                return super().data_uri_converter(matchobj).upper()
+
+        filename = os.path.join(settings.COMPRESS_ROOT, "css/datauri.css")
+        css = "p { filter: Alpha(src=/static/img/add.png) }"
+        self.assertIn(
+            'Alpha(url("data:image/png;base64,',
+            SrcDataUriFilter(css).input(filename=filename),
+        )
+        css = "p { background: url(/static/img/add.png) }"
+        with self.assertWarns(DeprecationWarning):
+            output = UpperCaseDataUriFilter(css).input(filename=filename)
+        self.assertIn('URL("DATA:IMAGE/PNG;BASE64,', output)
+
+
+@override_settings(COMPRESS_URL="/static/")
+class DataUriCacheTestCase(TestCase):
+    def setUp(self):
+        data_uri_cache.clear()
+        self.tmpdir = tempfile.mkdtemp(dir=settings.COMPRESS_ROOT)
+        self.filename = os.path.join(self.tmpdir, "image.png")
+        with open(self.filename, "wb") as file:
+            file.write(b"image")
+        self.url = "/static/%s/image.png" % os.path.basename(self.tmpdir)
+
+    def tearDown(self):
+        data_uri_cache.clear()
+        shutil.rmtree(self.tmpdir)
+
+    def get_data_uri(self):
+        with mock.patch("builtins.open", wraps=open) as open_mock:
+            data_uri = CssDataUriFilter(None).get_data_uri(self.url)
+        return data_uri, open_mock.called
+
+    def test_memoized(self):
+        self.assertEqual(self.get_data_uri(), ("data:image/png;base64,aW1hZ2U=", True))
+        self.assertEqual(self.get_data_uri(), ("data:image/png;base64,aW1hZ2U=", False))
+
+    def test_invalidated(self):
+        self.get_data_uri()
+        mtime = os.path.getmtime(self.filename)
+        with open(self.filename, "wb") as file:
+            file.write(b"other")
+        os.utime(self.filename, (mtime + 10, mtime + 10))
+        self.assertEqual(self.get_data_uri(), ("data:image/png;base64,b3RoZXI=", True))
+
+    def test_max_size(self):
+        self.get_data_uri()
+        with self.settings(COMPRESS_DATA_URI_MAX_SIZE=4):
+            self.assertEqual(self.get_data_uri(), (None, False))
+
+    @override_settings(COMPRESS_DATA_URI_CACHE_SIZE=0)
+    def test_disabled(self):
+        self.get_data_uri()
+        self.assertTrue(self.get_data_uri()[1])
+
+
+@override_settings(
+    COMPRESS_ENABLED=True,
+    COMPRESS_FILTERS={
+        "css": [
+            "compressor.filters.css_default.CssAbsoluteFilter",
+            "compressor.filters.datauri.CssDataUriDedupFilter",
+        ]
+    },
+    COMPRESS_URL="/static/",
+)
+class CssDataUriDedupTestCase(TestCase):
+    def test_repeated_data_uris(self):
+        css = """
+        <link rel="stylesheet" href="/static/css/datauri.css" type="text/css">
+        """
+        output = CssCompressor("css", css).output("inline")
+        data_uri = CssDataUriFilter(None).get_data_uri("/static/img/add.png")
+        name = "--compress-data-uri-%s" % get_hexdigest(data_uri, 12)
+        self.assertEqual(output.count(data_uri), 1)
+        self.assertEqual(output.count("var(%s)" % name), 2)
+        self.assertIn(':root{%s:url("%s")}' % (name, data_uri), output)
+        # used once
+        self.assertIn(
+            'url("data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAoA', output
+        )
+
+    def test_only_declarations_of_style_rules(self):
+        data_uri = "data:font/woff2;base64,d09GMgABAAAAAA"
+        content = (
+            '@import url("%(uri)s");'
+            '@font-face{font-family:a;src:url("%(uri)s")}'
+            '.a{background:url("%(uri)s")}'
+            '@media print{.b{color:red;background:url("%(uri)s")}}'
+        ) % {"uri": data_uri}
+        name = "--compress-data-uri-%s" % get_hexdigest(data_uri, 12)
+        self.assertEqual(
+            dedup_data_uris(content, 10),
+            (
+                '@import url("%(uri)s");'
+                '@font-face{font-family:a;src:url("%(uri)s")}'
+                ".a{background:var(%(name)s)}"
+                "@media print{.b{color:red;background:var(%(name)s)}}"
+                '\n:root{%(name)s:url("%(uri)s")}\n'
+            )
+            % {"uri": data_uri, "name": name},
+        )
+        self.assertEqual(dedup_data_uris(content, 100), content)
+
+    def test_quotes_kept(self):
+        data_uri = 'data:image/svg+xml;utf8,<svg xmlns="http://www.w3.org/2000/svg"/>'
+        content = ".a{background:url('%(uri)s')}.b{background:url('%(uri)s')}" % {
+            "uri": data_uri
+        }
+        name = "--compress-data-uri-%s" % get_hexdigest(data_uri, 12)
+        self.assertEqual(
+            dedup_data_uris(content, 10),
+            ".a{background:var(%(name)s)}.b{background:var(%(name)s)}"
+            "\n:root{%(name)s:url('%(uri)s')}\n" % {"uri": data_uri, "name": name},
+        )
+
+
+@override_settings(COMPRESS_URL="/static/", COMPRESS_CSS_HASHING_METHOD="mtime")
+class ReferencedFilesTestCase(TestCase):
+    def setUp(self):
+        referenced_files_cache.clear()
+        self.filename = os.path.join(settings.COMPRESS_ROOT, "css/datauri.css")
+        self.images = [
+            os.path.join(settings.COMPRESS_ROOT, "img", name)
+            for name in ["add.png", "python.png"]
+        ]
+
+    def tearDown(self):
+        referenced_files_cache.clear()
+
+    def test_css_absolute_filter(self):
+        filter = CssAbsoluteFilter(None)
+        self.assertEqual(
+            filter.get_asset_files(self.filename, "css/datauri.css", "utf-8"),
+            self.images,
+        )
+        with mock.patch("builtins.open", side_effect=AssertionError):
+            self.assertEqual(
+                filter.get_asset_files(self.filename, "css/datauri.css"),
+                self.images,
+            )
+        with self.settings(COMPRESS_CSS_HASHING_METHOD=None):
+            self.assertEqual(
+                filter.get_asset_files(self.filename, "css/datauri.css"), []
+            )
+
+    def test_data_uri_filter(self):
+        self.assertEqual(
+            CssDataUriFilter(None).get_asset_files(
+                self.filename, "css/datauri.css", "utf-8"
+            ),
+            self.images,
+        )
+
+    @override_settings(
+        COMPRESS_ENABLED=True,
+        COMPRESS_MTIME_DELAY=10,
+        COMPRESS_FILTERS={
+            "css": [
+                "compressor.filters.css_default.CssAbsoluteFilter",
+                "compressor.filters.datauri.CssDataUriFilter",
+            ]
+        },
+    )
+    def test_not_in_cachekey(self):
+        css = '<link rel="stylesheet" href="/static/css/datauri.css">'
+        cachekey = CssCompressor("css", css).cachekey
+        compressor = CssCompressor("css", css)
+        with mock.patch("compressor.cache.cache") as cache:
+            cache.get_many.return_value = {}
+            self.assertEqual(compressor.cachekey, cachekey)
+        cache.get.assert_not_called()
+        cache.get_many.assert_called_once()
+        self.assertEqual(compressor.asset_filenames, self.images)
+
+    @override_settings(COMPRESS_ENABLED=True)
+    def test_incremental_state(self):
+        self.assertEqual(
+            IncrementalState().get_linked_files(
+                '<link rel="stylesheet" href="/static/css/datauri.css">'
+            ),
+            [self.filename] + self.images,
+        )
+
+
+@override_settings(COMPRESS_URL="/static/", COMPRESS_MTIME_DELAY=0)
+class CssImportFilterTestCase(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(dir=settings.COMPRESS_ROOT)
+        self.dirname = os.path.basename(self.tmpdir)
+        os.mkdir(os.path.join(self.tmpdir, "sub"))
+        self.write("base.css", '@charset "utf-8";\nbody { color: red; }\n')
+        self.write(
+            "sub/print.css",
+            '@import "more.css";\np { background: url(../../img/python.png?v=1) }\n',
+        )
+        self.write("sub/more.css", "a { background: url(more.png) }\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, name, content):
+        with open(os.path.join(self.tmpdir, name), "w") as file:
+            file.write(content)
+
+    def flatten(self, content, name="main.css"):
+        self.write(name, content)
+        return CssImportFilter(content).input(
+            filename=os.path.join(self.tmpdir, name),
+            basename="%s/%s" % (self.dirname, name),
+            charset="utf-8",
+        )
+
+    def test_inline(self):
+        self.assertEqual(
+            self.flatten(
+                '@charset "utf-8";\n'
+                '@import "base.css";\n'
+                "/* print */\n"
+                "@import url('/static/%s/sub/print.css') print;\n"
+                "h1 { color: blue; }\n" % self.dirname
+            ),
+            '@charset "utf-8";\n'
+            "\nbody { color: red; }\n"
+            "@media print{a { background: url(sub/more.png) }\n\n"
+            "p { background: url(../img/python.png?v=1) }\n}\n"
+            "h1 { color: blue; }\n",
+        )
+
+    def test_cycle(self):
+        self.write("other.css", '@import "main.css";\nb { color: red; }\n')
+        self.assertEqual(
+            self.flatten('@import "other.css";\ni { color: red; }\n'),
+            "\nb { color: red; }\n\ni { color: red; }\n",
+        )
+
+    def test_kept_imports(self):
+        for content in [
+            '@import "base.css";\n@import "http://example.com/remote.css";\n',
+            '@import "base.css" layer(base);\n',
+            '@import "missing.css";\n',
+            'body { color: red; }\n@import "base.css";\n',
+        ]:
+            with self.subTest(content=content):
+                self.assertEqual(self.flatten(content), content)
+        self.assertEqual(
+            self.flatten('@import "//example.com/remote.css";\n@import "base.css";'),
+            '@import "//example.com/remote.css";\n\nbody { color: red; }\n',
+        )
+
+    @override_settings(
+        COMPRESS_ENABLED=True,
+        COMPRESS_FILTERS={
+            "css": [
+                "compressor.filters.css_import.CssImportFilter",
+                "compressor.filters.css_default.CssAbsoluteFilter",
+            ]
+        },
+    )
+    def test_compressor(self):
+        self.write("main.css", '@import "sub/print.css";\n')
+        css = '<link rel="stylesheet" href="/static/%s/main.css">' % self.dirname
+        compressor = CssCompressor("css", css)
+        self.assertEqual(
+            compressor.referenced_filenames,
+            [
+                os.path.realpath(os.path.join(self.tmpdir, name))
+                for name in ["sub/print.css", "sub/more.css"]
+            ],
+        )
+        self.assertIn(
+            "url(/static/%s/sub/more.png" % self.dirname, compressor.output("inline")
+        )
+        cachekey = compressor.cachekey
+        filename = os.path.join(self.tmpdir, "sub/more.css")
+        mtime = os.path.getmtime(filename)
+        os.utime(filename, (mtime + 10, mtime + 10))
+        self.assertNotEqual(cachekey, CssCompressor("css", css).cachekey)
+
+    @override_settings(
+        COMPRESS_ENABLED=True,
+        COMPRESS_MTIME_DELAY=10,
+        COMPRESS_FILTERS={"css": ["compressor.filters.css_import.CssImportFilter"]},
+    )
+    def test_mtimes_looked_up_at_once(self):
+        self.write("main.css", '@import "base.css";\n@import "sub/print.css";\n')
+        css = '<link rel="stylesheet" href="/static/%s/main.css">' % self.dirname
+        cachekey = CssCompressor("css", css).cachekey
+        compressor = CssCompressor("css", css)
+        with mock.patch("compressor.cache.cache") as cache:
+            cache.get_many.return_value = {}
+            self.assertEqual(compressor.cachekey, cachekey)
+        cache.get.assert_not_called()
+        # One for the linked file, one for all the files it imports.
+        self.assertEqual(cache.get_many.call_count, 2)
+        self.assertEqual(len(cache.get_many.call_args[0][0]), 3)
+
 
 class TemplateTestCase(TestCase):
     @override_settings(
@@ -1,6 +1,10 @@
+import concurrent.futures
 import copy
 import io
+import mmap
 import os
+import tempfile
+import time
 from contextlib import contextmanager
 from importlib import import_module
 from unittest import SkipTest
@@ -12,10 +16,16 @@ from django.template import Context, Origin, Template
 from django.test import override_settings, TestCase
 from django.urls import get_script_prefix, set_script_prefix
 
-from compressor.cache import flush_offline_manifest, get_offline_manifest
+from compressor.cache import (
+    flush_offline_manifest,
+    get_offline_manifest,
+    get_offline_state_filename,
+)
 from compressor.exceptions import OfflineGenerationError
 from compressor.management.commands.compress import Command as CompressCommand
-from compressor.storage import default_offline_manifest_storage
+from compressor.offline.django import DjangoParser
+from compressor.offline.manifest import BinaryManifest, BinaryManifestReader
+from compressor.storage import default_offline_manifest_storage, default_storage
 from compressor.utils import get_mod_func
 
 
@@ -327,6 +337,20 @@ class OfflineCompressBasicTestCase(OfflineTestCaseMixin, TestCase):
         for engine in self.engines:
             self._test_deleting_manifest_does_not_affect_rendering(engine)
 
+    def test_offline_output_memoized(self):
+        CompressCommand().handle_inner(engines=["django"], verbosity=0)
+        rendered_template = self._render_template("django")
+        with patch(
+            "compressor.cache.get_offline_manifest"
+        ) as get_offline_manifest, patch(
+            "compressor.templatetags.compress.get_offline_hexdigest"
+        ) as get_offline_hexdigest:
+            self.assertEqual(self._render_template("django"), rendered_template)
+        self.assertFalse(get_offline_manifest.called)
+        self.assertFalse(get_offline_hexdigest.called)
+        with self.settings(COMPRESS_URL="/other/"):
+            self.assertIn('src="/other/CACHE/js/', self.template.render(Context({})))
+
     def test_get_loaders(self):
         TEMPLATE_LOADERS = (
             (
@@ -356,6 +380,81 @@ class OfflineCompressBasicTestCase(OfflineTestCaseMixin, TestCase):
             CompressCommand().handle(verbosity=0)
 
 
+class OfflineCompressBinaryManifestTestCase(OfflineTestCaseMixin, TestCase):
+    templates_dir = "basic"
+    expected_hash = "822ac7501287"
+    additional_test_settings = {
+        "COMPRESS_OFFLINE_MANIFEST_BACKEND": "compressor.offline.manifest.BinaryManifest",
+    }
+
+    def test_manifest_loaded_lazily(self):
+        CompressCommand().handle_inner(engines=["django"], verbosity=0)
+        manifest = get_offline_manifest()
+        self.assertIsInstance(manifest, BinaryManifestReader)
+        self.assertIsInstance(manifest.buffer, mmap.mmap)
+        self.assertEqual(len(manifest), 1)
+        key = list(manifest)[0]
+        self.assertIn(key, manifest)
+        self.assertNotIn("missing", manifest)
+        self.assertEqual(manifest[key], self._render_script(self.expected_hash))
+
+    def test_round_trip(self):
+        manifest = {"b": "<b>\u00e9</b>", "a\u00e9": "", "c": "<c></c>"}
+        reader = BinaryManifestReader(BinaryManifest().dumps(manifest))
+        self.assertEqual(dict(reader), manifest)
+        self.assertEqual(list(reader), sorted(manifest, key=str.encode))
+        with self.assertRaises(KeyError):
+            reader["d"]
+        self.assertEqual(dict(BinaryManifestReader(BinaryManifest().dumps({}))), {})
+
+
+class OfflineManifestReloadTestCase(OfflineTestCaseMixin, TestCase):
+    templates_dir = "basic"
+    expected_hash = "822ac7501287"
+    engines = ("django",)
+    additional_test_settings = {"COMPRESS_OFFLINE_MANIFEST_RELOAD_INTERVAL": 60}
+
+    def setUp(self):
+        super().setUp()
+        CompressCommand().handle_inner(engines=["django"], verbosity=0)
+        self.rendered_template = self._render_template("django")
+
+    def _replace_manifest(self, old, new):
+        manifest_path = default_offline_manifest_storage.path("manifest.json")
+        with open(manifest_path) as file:
+            content = file.read().replace(old, new)
+        mtime = os.path.getmtime(manifest_path)
+        with open(manifest_path, "w") as file:
+            file.write(content)
+        os.utime(manifest_path, (mtime + 10, mtime + 10))
+
+    def test_reload_throttled(self):
+        self._replace_manifest("<script", "<script defer")
+        self.assertEqual(self._render_template("django"), self.rendered_template)
+        with patch(
+            "compressor.cache.time.monotonic", return_value=time.monotonic() + 60
+        ):
+            self.assertEqual(
+                self._render_template("django"),
+                self.rendered_template.replace("<script", "<script defer"),
+            )
+
+    @override_settings(COMPRESS_OFFLINE_MANIFEST_RELOAD_INTERVAL=None)
+    def test_reload_disabled(self):
+        self._replace_manifest("<script", "<script defer")
+        with patch(
+            "compressor.cache.time.monotonic", return_value=time.monotonic() + 60
+        ):
+            self.assertEqual(self._render_template("django"), self.rendered_template)
+
+    @override_settings(COMPRESS_OFFLINE_MANIFEST_RELOAD_INTERVAL=0)
+    def test_missing_or_broken_manifest_kept(self):
+        self._replace_manifest("{", "")
+        self.assertEqual(self._render_template("django"), self.rendered_template)
+        default_offline_manifest_storage.delete("manifest.json")
+        self.assertEqual(self._render_template("django"), self.rendered_template)
+
+
 class OfflineCompressSkipDuplicatesTestCase(OfflineTestCaseMixin, TestCase):
     templates_dir = "test_duplicate"
 
@@ -445,6 +544,63 @@ class OfflineCompressStaticTemplateTagTestCase(OfflineTestCaseMixin, TestCase):
     expected_hash = "be0b1eade28b"
 
 
+class OfflineCompressIncrementalTestCase(OfflineTestCaseMixin, TestCase):
+    templates_dir = "test_static_templatetag"
+    expected_hash = "be0b1eade28b"
+
+    def tearDown(self):
+        super().tearDown()
+        state_filename = get_offline_state_filename()
+        if default_offline_manifest_storage.exists(state_filename):
+            default_offline_manifest_storage.delete(state_filename)
+
+    def _compress(self, engine="django", verbosity=0):
+        with patch.object(
+            CompressCommand,
+            "_compress_template",
+            wraps=CompressCommand._compress_template,
+        ) as compress_template:
+            count, result = CompressCommand().handle_inner(
+                engines=[engine], verbosity=verbosity, incremental=True
+            )
+        return result, compress_template.called
+
+    def _test_offline(self, engine, verbosity=0):
+        result, rendered = self._compress(engine, verbosity)
+        self.assertTrue(rendered)
+        self.assertEqual(self._compress(engine, verbosity), (result, False))
+        self.assertEqual([self._render_script(self.expected_hash)], result)
+        rendered_template = self._render_template(engine)
+        self.assertEqual(rendered_template, self._render_result(result))
+
+    def test_changed_template(self):
+        self._compress()
+        with patch.object(
+            DjangoParser, "get_template_sources", return_value={"a.html": "changed"}
+        ):
+            self.assertTrue(self._compress()[1])
+        self.assertTrue(self._compress()[1])
+        self.assertFalse(self._compress()[1])
+
+    def test_changed_linked_file(self):
+        self._compress()
+        with patch(
+            "compressor.offline.incremental.get_file_hash", return_value="changed"
+        ):
+            self.assertTrue(self._compress()[1])
+        self.assertTrue(self._compress()[1])
+
+    def test_deleted_output_file(self):
+        self._compress()
+        default_storage.delete("CACHE/js/output.%s.js" % self.expected_hash)
+        self.assertTrue(self._compress()[1])
+
+    def test_changed_settings(self):
+        self._compress()
+        with self.settings(COMPRESS_OFFLINE_CONTEXT={"foo": "bar"}):
+            self.assertTrue(self._compress()[1])
+
+
 class OfflineCompressTemplateTagNamedTestCase(OfflineTestCaseMixin, TestCase):
     templates_dir = "test_templatetag_named"
     expected_basename = "output_name"
@@ -488,6 +644,135 @@ class OfflineCompressTestCaseWithContextList(OfflineTestCaseMixin, TestCase):
         return None
 
 
+class OfflineCompressSharedPoolTestCase(OfflineTestCaseMixin, TestCase):
+    templates_dir = "basic"
+    expected_hash = "822ac7501287"
+    engines = ("django",)
+    additional_test_settings = {
+        "COMPRESS_OFFLINE_CONTEXT": list(offline_context_generator())
+    }
+
+    def _prepare_contexts(self, engine):
+        return [Context(c) for c in settings.COMPRESS_OFFLINE_CONTEXT]
+
+    def _render_template(self, engine):
+        return self.template.render(self._prepare_contexts(engine)[0])
+
+    def test_single_pool_and_render(self):
+        executor_cls = concurrent.futures.ThreadPoolExecutor
+        with patch(
+            "concurrent.futures.ThreadPoolExecutor", wraps=executor_cls
+        ) as executor, patch.object(
+            DjangoParser, "render_node", autospec=True, return_value="<p>OK</p>"
+        ) as render_node:
+            count, result = CompressCommand().handle_inner(
+                engines=["django"], verbosity=0
+            )
+        self.assertEqual(executor.call_count, 1)
+        # The block renders to the same key in all three contexts.
+        self.assertEqual(render_node.call_count, 1)
+        self.assertEqual(count, 1)
+
+    def test_static_template_compressed_once(self):
+        with patch.object(
+            CompressCommand,
+            "_compress_context_template",
+            autospec=True,
+            side_effect=CompressCommand._compress_context_template,
+        ) as compress_context_template, patch.object(
+            DjangoParser, "render_nodelist", autospec=True, return_value=""
+        ) as render_nodelist:
+            CompressCommand().handle_inner(engines=["django"], verbosity=0)
+        template_names = [
+            call.args[4].template_name
+            for call in compress_context_template.call_args_list
+        ]
+        self.assertEqual(template_names.count("test_compressor_offline.html"), 1)
+        self.assertEqual(render_nodelist.call_count, 1)
+
+    def test_is_static_template(self):
+        parser = DjangoParser(charset="utf-8")
+        command = CompressCommand()
+        template = parser.parse("test_compressor_offline.html")
+        template.template_name = "test_compressor_offline.html"
+        self.assertTrue(command.is_static_template(parser, template, {}))
+        TEMPLATES = copy.deepcopy(settings.TEMPLATES)
+        TEMPLATES[0]["DIRS"] = [
+            os.path.join(os.path.dirname(TEMPLATES[0]["DIRS"][0]), "test_with_context")
+        ]
+        with self.settings(TEMPLATES=TEMPLATES):
+            template = parser.parse("test_compressor_offline.html")
+            template.template_name = "test_compressor_offline.html"
+            self.assertFalse(command.is_static_template(parser, template, {}))
+
+    def test_jinja2_static_node(self):
+        from compressor.offline.jinja2 import Jinja2Parser
+
+        parser = Jinja2Parser(charset="utf-8", env=self._get_jinja2_env())
+        static, dynamic = parser.walk_nodes(
+            parser.env.parse(
+                "{% compress js %}<script>a()</script>{% endcompress %}"
+                "{% compress js %}<script>{{ a }}</script>{% endcompress %}"
+            )
+        )
+        self.assertTrue(parser.is_static_node(static))
+        self.assertFalse(parser.is_static_node(dynamic))
+
+
+class OfflineCompressProcessExecutorTestCase(OfflineCompressTestCaseWithContextList):
+    def _test_offline(self, engine, verbosity=0):
+        count, result = CompressCommand().handle_inner(
+            engines=[engine], verbosity=verbosity, executor="process", workers=2
+        )
+        self.assertEqual(len(self.expected_hash), count)
+        self.assertEqual(
+            sorted(self._render_script(h) for h in self.expected_hash), sorted(result)
+        )
+        # The manifest is ordered by key, whichever process rendered a block.
+        self.assertEqual(list(get_offline_manifest()), sorted(get_offline_manifest()))
+        rendered_template = self._render_template(engine)
+        self.assertEqual(
+            rendered_template,
+            self._render_result([self._render_script(h) for h in self.expected_hash]),
+        )
+
+    def test_workers_must_be_positive(self):
+        with self.assertRaises(CommandError):
+            CompressCommand().handle_inner(engines=["django"], verbosity=0, workers=-1)
+
+
+class OfflineCompressProcessExecutorDuplicatesTestCase(OfflineTestCaseMixin, TestCase):
+    templates_dir = "test_duplicate_templates"
+    engines = ("django",)
+
+    def _test_offline(self, engine, verbosity=0):
+        # Both templates have the same block, compressed by one of the
+        # processes only.
+        fd, renders = tempfile.mkstemp()
+        os.close(fd)
+        render_node = DjangoParser.render_node
+
+        def record_render(parser, *args):
+            with open(renders, "a") as file:
+                file.write("render\n")
+            return render_node(parser, *args)
+
+        try:
+            with patch.object(DjangoParser, "render_node", record_render):
+                count, result = CompressCommand().handle_inner(
+                    engines=[engine],
+                    verbosity=verbosity,
+                    executor="process",
+                    workers=2,
+                )
+            with open(renders) as file:
+                self.assertEqual(file.read(), "render\n")
+        finally:
+            os.remove(renders)
+        self.assertEqual(1, count)
+        self.assertEqual([self._render_script("822ac7501287")], result)
+
+
 class OfflineCompressTestCaseWithContextListSuper(
     SuperMixin, OfflineCompressTestCaseWithContextList
 ):
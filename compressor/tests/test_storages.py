@@ -1,6 +1,10 @@
+import gzip
 import os
+from unittest import SkipTest, mock
+
 import brotli
 
+from django.core.exceptions import ImproperlyConfigured
 from django.core.files.base import ContentFile
 from django.core.files.storage import get_storage_class
 from django.test import TestCase
@@ -89,3 +93,108 @@ class StorageTestCase(TestCase):
         )
         # Check that the file is stored at the same default location as before the new manifest storage.
         self.assertTrue(self.default_storage.exists(os.path.join("CACHE", "test.txt")))
+
+
+@override_settings(COMPRESS_PRECOMPRESS_FORMATS=("gzip", "brotli", "zstd"))
+class PrecompressedStorageTestCase(TestCase):
+    def setUp(self):
+        self.storage = storage.PrecompressedCompressorFileStorage()
+        self.payload = b"".join(
+            b"p.rule-%d { margin: %dpx; }\n" % (i % 100, i) for i in range(5000)
+        )
+        self.path = os.path.join(settings.COMPRESS_ROOT, "test.txt")
+        try:
+            import zstandard
+        except ImportError:
+            zstandard = None
+        self.zstandard = zstandard
+        if zstandard is None:
+            self.settings_override = self.settings(
+                COMPRESS_PRECOMPRESS_FORMATS=("gzip", "brotli")
+            )
+            self.settings_override.enable()
+
+    def tearDown(self):
+        if self.zstandard is None:
+            self.settings_override.disable()
+        for extension in ("", ".gz", ".br", ".zst"):
+            if os.path.exists(self.path + extension):
+                os.remove(self.path + extension)
+
+    def assertVariants(self, payload):
+        with open(self.path + ".gz", "rb") as f:
+            self.assertEqual(gzip.decompress(f.read()), payload)
+        with open(self.path + ".br", "rb") as f:
+            self.assertEqual(brotli.decompress(f.read()), payload)
+        if self.zstandard is not None:
+            with open(self.path + ".zst", "rb") as f:
+                self.assertEqual(
+                    self.zstandard.ZstdDecompressor().decompressobj().decompress(
+                        f.read()
+                    ),
+                    payload,
+                )
+        for extension in (".gz", ".br"):
+            self.assertEqual(
+                os.path.getmtime(self.path), os.path.getmtime(self.path + extension)
+            )
+
+    def test_save(self):
+        self.storage.save("test.txt", ContentFile(self.payload))
+        self.assertVariants(self.payload)
+
+    def test_save_text(self):
+        self.storage.save("test.txt", ContentFile("yeah yeah"))
+        self.assertVariants(b"yeah yeah")
+
+    @override_settings(COMPRESS_PRECOMPRESS_MIN_SIZE=1000)
+    def test_min_size(self):
+        with self.settings(COMPRESS_PRECOMPRESS_MIN_SIZE=0):
+            self.storage.save("test.txt", ContentFile(b"yeah yeah"))
+        self.assertTrue(os.path.exists(self.path + ".gz"))
+        self.storage.save("test.txt", ContentFile(b"yeah yeah"))
+        self.assertFalse(os.path.exists(self.path + ".gz"))
+        self.assertFalse(os.path.exists(self.path + ".br"))
+        self.storage.save("test.txt", ContentFile(self.payload))
+        self.assertVariants(self.payload)
+
+    @override_settings(COMPRESS_PRECOMPRESS_WORKERS=1)
+    def test_background(self):
+        self.storage.save("test.txt", ContentFile(self.payload))
+        # The single worker runs the tasks in order.
+        storage.get_precompress_executor(1).submit(lambda: None).result()
+        self.assertVariants(self.payload)
+
+    @override_settings(COMPRESS_PRECOMPRESS_WORKERS=1)
+    def test_background_failure_logged(self):
+        with mock.patch.object(
+            self.storage, "precompress", side_effect=OSError("disk full")
+        ), self.assertLogs("compressor.storage", "ERROR") as logs:
+            self.storage.save("test.txt", ContentFile(self.payload))
+            storage.get_precompress_executor(1).submit(lambda: None).result()
+        self.assertIn("Failed to precompress test.txt", logs.output[0])
+        self.assertIn("disk full", logs.output[0])
+
+    def test_unknown_format(self):
+        for workers in (0, 1):
+            with self.settings(
+                COMPRESS_PRECOMPRESS_FORMATS=("gzip", "lzma"),
+                COMPRESS_PRECOMPRESS_WORKERS=workers,
+            ), self.assertRaisesMessage(ImproperlyConfigured, "'lzma'"):
+                self.storage.save("test.txt", ContentFile(self.payload))
+
+    @override_settings(COMPRESS_PRECOMPRESS_LEVELS={"gzip": 1})
+    def test_levels(self):
+        self.storage.save("test.txt", ContentFile(self.payload))
+        with open(self.path + ".gz", "rb") as f:
+            fast = len(f.read())
+        with self.settings(COMPRESS_PRECOMPRESS_LEVELS={}):
+            self.storage.save("test.txt", ContentFile(self.payload))
+        with open(self.path + ".gz", "rb") as f:
+            self.assertLess(len(f.read()), fast)
+
+    def test_zstd(self):
+        if self.zstandard is None:
+            raise SkipTest("zstandard is not installed.")
+        self.storage.save("test.txt", ContentFile(self.payload))
+        self.assertTrue(os.path.exists(self.path + ".zst"))
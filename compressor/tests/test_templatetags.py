@@ -1,12 +1,13 @@
 import os
 import sys
-from unittest.mock import Mock
+from unittest.mock import Mock, patch
 
 from django.conf import settings
 from django.template import Context, Template, TemplateSyntaxError
 from django.test import override_settings, TestCase
 from sekizai.context import SekizaiContext
 
+from compressor.css import CssCompressor
 from compressor.signals import post_compress
 from compressor.tests.test_base import css_tag, test_dir
 
@@ -177,6 +178,41 @@ class TemplatetagTestCase(TestCase):
         out = '<script src="/static/CACHE/js/output.ffc39dec05fd.js"></script>'
         self.assertEqual(out, render(template, self.context, SekizaiContext))
 
+    def test_static_block_skips_parsing_on_cache_hit(self):
+        template = Template(
+            """{% load compress static %}{% compress css %}
+<link rel="stylesheet" href="{% static 'css/one.css' %}" type="text/css">
+<style type="text/css">p { border:5px solid green;}</style>
+{% endcompress %}"""
+        )
+        node = template.nodelist[-1]
+        self.assertTrue(node.is_static)
+        first = template.render(Context({})).strip()
+        with patch.object(
+            CssCompressor, "split_contents", side_effect=AssertionError
+        ), patch.object(node.nodelist, "render", side_effect=AssertionError):
+            self.assertEqual(first, template.render(Context({})).strip())
+
+    @override_settings(
+        COMPRESS_FILTERS={
+            "css": [
+                "compressor.filters.css_import.CssImportFilter",
+                "compressor.filters.css_default.CssAbsoluteFilter",
+            ],
+            "js": [],
+        }
+    )
+    def test_static_block_with_referenced_files_skips_parsing(self):
+        self.test_static_block_skips_parsing_on_cache_hit()
+
+    def test_context_dependent_block_is_not_static(self):
+        template = Template(
+            """{% load compress %}{% compress css %}
+<link rel="stylesheet" href="{{ STATIC_URL }}css/one.css" type="text/css">
+{% endcompress %}"""
+        )
+        self.assertFalse(template.nodelist[-1].is_static)
+
 
 class PrecompilerTemplatetagTestCase(TestCase):
     def setUp(self):
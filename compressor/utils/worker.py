@@ -0,0 +1,208 @@
+"""
+Long-lived compiler processes for ``CompilerFilter``.
+
+A worker is a process reading requests from its stdin and writing responses
+to its stdout, each made of a header line followed by a payload::
+
+    request:  b"<length> <filename>\n<content>"
+    response: b"ok <length>\n<output>" or b"error <length>\n<message>"
+
+Payloads are UTF-8 encoded and lengths are in bytes, the filename is empty
+for inline content. ``serve`` implements the worker side for compilers
+written in Python. Workers not responding within the timeout are killed and
+replaced by new ones for the next requests.
+"""
+import atexit
+import os
+import shlex
+import subprocess
+import sys
+import threading
+
+from compressor.exceptions import FilterError
+
+
+class WorkerError(Exception):
+    """
+    Raised when a worker can't be started or stops speaking the protocol.
+    """
+
+    pass
+
+
+class Worker:
+    def __init__(self, command, cwd=None):
+        if isinstance(command, str):
+            command = shlex.split(command)
+        try:
+            self.process = subprocess.Popen(
+                command, cwd=cwd, stdin=subprocess.PIPE, stdout=subprocess.PIPE
+            )
+        except (IOError, OSError) as e:
+            raise WorkerError("Unable to start worker %r: %s" % (command, e))
+
+    def run(self, content, filename=None, timeout=None):
+        """
+        Returns the output of the worker for the content, killing it if it
+        doesn't respond within ``timeout`` seconds.
+        """
+        header = b"%d %s\n" % (len(content), os.fsencode(filename or ""))
+        timed_out = threading.Event()
+
+        def expire():
+            timed_out.set()
+            self.kill()
+
+        timer = None
+        if timeout:
+            timer = threading.Timer(timeout, expire)
+            timer.daemon = True
+            timer.start()
+        try:
+            self.process.stdin.write(header + content)
+            self.process.stdin.flush()
+            status, length = self.process.stdout.readline().split()
+            length = int(length)
+            payload = self.process.stdout.read(length)
+        except (IOError, OSError, ValueError) as e:
+            if timed_out.is_set():
+                raise WorkerError("Worker timed out after %s seconds" % timeout)
+            raise WorkerError("Worker failed: %s" % e)
+        finally:
+            if timer is not None:
+                timer.cancel()
+        if timed_out.is_set():
+            raise WorkerError("Worker timed out after %s seconds" % timeout)
+        if len(payload) != length:
+            raise WorkerError("Worker exited unexpectedly")
+        if status == b"ok":
+            return payload
+        raise FilterError(payload.decode("utf-8", "replace"))
+
+    def kill(self):
+        self.process.kill()
+
+    def is_alive(self):
+        return self.process.poll() is None
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+            self.process.wait(timeout=5)
+        except (IOError, OSError, subprocess.TimeoutExpired):
+            self.process.kill()
+            self.process.wait()
+        self.process.stdout.close()
+
+
+class WorkerPool:
+    """
+    Keeps up to ``size`` workers running the same command and hands each
+    request to an idle one, starting new workers as needed. Requests taking
+    longer than ``timeout`` seconds kill their worker.
+    """
+
+    def __init__(self, command, size, cwd=None, timeout=None):
+        self.command = command
+        self.cwd = cwd
+        self.size = size
+        self.timeout = timeout
+        self.pid = os.getpid()
+        self._semaphore = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._idle = []
+
+    def run(self, content, filename=None):
+        with self._semaphore:
+            with self._lock:
+                worker = self._idle.pop() if self._idle else None
+            if worker is not None and not worker.is_alive():
+                worker.close()
+                worker = None
+            if worker is None:
+                worker = Worker(self.command, self.cwd)
+            try:
+                output = worker.run(content, filename, self.timeout)
+            except WorkerError:
+                worker.close()
+                raise
+            except Exception:
+                self._release(worker)
+                raise
+            self._release(worker)
+            return output
+
+    def _release(self, worker):
+        with self._lock:
+            self._idle.append(worker)
+
+    def close(self):
+        with self._lock:
+            workers, self._idle = self._idle, []
+        for worker in workers:
+            worker.close()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_worker_pool(command, size, cwd=None, timeout=None):
+    """
+    Returns the pool of workers for the given command, shared by the whole
+    process. Pools inherited from a parent process are never reused.
+    """
+    key = (command, cwd)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if (
+            pool is None
+            or pool.pid != os.getpid()
+            or pool.size != size
+            or pool.timeout != timeout
+        ):
+            if pool is not None and pool.pid == os.getpid():
+                pool.close()
+            pool = _pools[key] = WorkerPool(command, size, cwd, timeout)
+        return pool
+
+
+@atexit.register
+def close_worker_pools():
+    with _pools_lock:
+        pools = [pool for pool in _pools.values() if pool.pid == os.getpid()]
+        _pools.clear()
+    for pool in pools:
+        pool.close()
+
+
+def serve(callback, stdin=None, stdout=None):
+    """
+    Runs a worker loop, passing the content and filename of each request to
+    ``callback`` and responding with the string it returns. Exceptions are
+    sent back as errors. For example::
+
+        from compressor.utils.worker import serve
+
+        def compile(content, filename=None):
+            return sass.compile(string=content)
+
+        if __name__ == "__main__":
+            serve(compile)
+    """
+    stdin = stdin or sys.stdin.buffer
+    stdout = stdout or sys.stdout.buffer
+    while True:
+        header = stdin.readline()
+        if not header:
+            break
+        length, _, filename = header.rstrip(b"\n").partition(b" ")
+        content = stdin.read(int(length)).decode("utf-8")
+        try:
+            output = callback(content, filename=os.fsdecode(filename) or None)
+            status, payload = b"ok", output.encode("utf-8")
+        except Exception as e:
+            status, payload = b"error", str(e).encode("utf-8")
+        stdout.write(b"%s %d\n" % (status, len(payload)))
+        stdout.write(payload)
+        stdout.flush()